@@ -0,0 +1,147 @@
+# backend/benchmarks/auth_bench.py
+#
+# Authentication overhead per request, before and after the verified-token cache.
+#
+#   python backend/benchmarks/auth_bench.py [--requests 20000]
+#
+# "legacy" is the previous dependency: a sync function (run through the threadpool)
+# doing a full jwt.decode plus datetime expiry checks on every request. "cached" is
+# the current backend.data_source.auth.get_current_user. Each variant guards a
+# trivial endpoint that is called in-process over ASGI; the cost of the same endpoint
+# without authentication is subtracted, so the numbers are auth overhead only.
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+os.environ.setdefault("LOG_LEVEL", "warning")
+# The benchmarks measure the services, not the per-user limits
+os.environ.setdefault("RATE_LIMIT_PER_SECOND", "0")
+os.environ.setdefault("MAX_CONCURRENT_TRANSFERS", "0")
+os.environ.setdefault("USER_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="auth-bench-"), "users.db"))
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_dir = os.path.dirname(current_dir)
+project_dir = os.path.dirname(backend_dir)
+if project_dir not in sys.path:
+    sys.path.append(project_dir)
+
+import jwt
+from fastapi import FastAPI, Depends, HTTPException
+
+from backend.common.auth_store import user_store
+from backend.common.token_cache import decode_token
+from backend.data_source import auth
+
+
+def legacy_get_current_user(token: str = Depends(auth.oauth2_scheme)) -> str:
+    try:
+        payload = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+        username = payload.get("sub")
+        if username is None or username not in user_store:
+            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+        exp = payload.get("exp")
+        if exp is None or datetime.utcnow() > datetime.fromtimestamp(exp):
+            raise HTTPException(status_code=401, detail="Token has expired")
+        return username
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Could not validate credentials")
+
+
+def build_app(dependency) -> FastAPI:
+    app = FastAPI()
+    if dependency is None:
+        @app.get("/")
+        async def endpoint():
+            return {"ok": True}
+    else:
+        @app.get("/")
+        async def endpoint(user: str = Depends(dependency)):
+            return {"ok": True}
+    return app
+
+
+async def drive(app: FastAPI, token: str, requests: int) -> float:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/",
+        "raw_path": b"/",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"bench"), (b"authorization", f"Bearer {token}".encode())],
+        "client": ("127.0.0.1", 1),
+        "server": ("bench", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    status = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    for _ in range(min(1000, requests)):
+        await app(dict(scope), receive, send)
+    status.clear()
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+    elapsed = time.perf_counter() - started
+    if any(code != 200 for code in status):
+        raise RuntimeError(f"Unexpected status codes: {set(status)}")
+    return elapsed / requests
+
+
+def time_function(func, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Authentication overhead benchmark")
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    if "bench" not in user_store:
+        user_store.create_user("bench", "unused")
+    token = jwt.encode(
+        {"sub": "bench", "exp": datetime.utcnow() + timedelta(hours=1), "iat": datetime.utcnow()},
+        auth.SECRET_KEY,
+        algorithm=auth.ALGORITHM,
+    )
+
+    legacy = time_function(lambda: legacy_get_current_user(token), args.requests)
+    auth.token_cache.clear()
+    cached = time_function(
+        lambda: decode_token(token, auth.SECRET_KEY, auth.ALGORITHM, auth.token_cache, require_exp=True),
+        args.requests,
+    )
+    print("token validation only")
+    print(f"  legacy jwt.decode + datetime checks : {legacy * 1e6:8.2f} us/call")
+    print(f"  cached claims                       : {cached * 1e6:8.2f} us/call")
+
+    baseline = asyncio.run(drive(build_app(None), token, args.requests))
+    legacy_request = asyncio.run(drive(build_app(legacy_get_current_user), token, args.requests))
+    auth.token_cache.clear()
+    cached_request = asyncio.run(drive(build_app(auth.get_current_user), token, args.requests))
+    print(f"per request over ASGI ({args.requests} requests, no-auth endpoint {baseline * 1e6:.1f} us)")
+    print(f"  legacy sync dependency              : {(legacy_request - baseline) * 1e6:8.2f} us auth overhead")
+    print(f"  cached async dependency             : {(cached_request - baseline) * 1e6:8.2f} us auth overhead")
+    print(f"  token cache: {auth.token_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
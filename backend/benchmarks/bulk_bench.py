@@ -0,0 +1,142 @@
+# backend/benchmarks/bulk_bench.py
+#
+# Throughput of syncing many small files, one request per file versus the batch endpoints.
+#
+#   python backend/benchmarks/bulk_bench.py [--files 2000] [--size 4096] [--clients 8]
+#
+# "single" uploads with one POST /files/ per file and deletes with one DELETE /files/
+# per file, from --clients concurrent clients. "batch" sends every file in a single
+# POST /files/batch/upload and removes them with one POST /files/batch/delete; "tree"
+# removes the whole directory with DELETE /files/?recursive=true. Requests go
+# in-process over ASGI (httpx), so the numbers are server-side cost without network.
+# Runs in a temporary data directory; requires httpx.
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+os.environ.setdefault("LOG_LEVEL", "warning")
+work_dir = tempfile.mkdtemp(prefix="bulk-bench-")
+os.environ.setdefault("USER_DB_PATH", os.path.join(work_dir, "users.db"))
+os.environ.setdefault("METADATA_INDEX_PATH", os.path.join(work_dir, "metadata.db"))
+os.environ.setdefault("DIGEST_DB_PATH", os.path.join(work_dir, "digests.db"))
+os.environ.setdefault("QUOTA_DB_PATH", os.path.join(work_dir, "quotas.db"))
+# The benchmarks measure the services, not the per-user limits
+os.environ.setdefault("RATE_LIMIT_PER_SECOND", "0")
+os.environ.setdefault("MAX_CONCURRENT_TRANSFERS", "0")
+# The routers use ./data relative to the working directory
+os.chdir(work_dir)
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_dir = os.path.dirname(current_dir)
+project_dir = os.path.dirname(backend_dir)
+if project_dir not in sys.path:
+    sys.path.append(project_dir)
+
+import jwt
+import httpx
+from datetime import datetime, timedelta
+from fastapi import FastAPI
+
+from backend.common.auth_store import user_store
+from backend.data_source import auth, files
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+    app.include_router(files.router)
+    return app
+
+
+async def single(client: httpx.AsyncClient, names: list, payload: bytes, clients: int) -> tuple:
+    queue = list(names)
+
+    async def upload_worker():
+        while queue:
+            name = queue.pop()
+            response = await client.post("/files/", data={"dir": "single"}, files={"file": (name, payload)})
+            response.raise_for_status()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(upload_worker() for _ in range(clients)))
+    uploaded = time.perf_counter() - started
+
+    queue = list(names)
+
+    async def delete_worker():
+        while queue:
+            name = queue.pop()
+            response = await client.delete("/files/", params={"path": f"single/{name}"})
+            response.raise_for_status()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(delete_worker() for _ in range(clients)))
+    return uploaded, time.perf_counter() - started
+
+
+async def batch(client: httpx.AsyncClient, names: list, payload: bytes, recursive: bool) -> tuple:
+    directory = "tree" if recursive else "batch"
+    started = time.perf_counter()
+    response = await client.post(
+        "/files/batch/upload",
+        data={"dir": directory},
+        files=[("files", (name, payload)) for name in names],
+    )
+    response.raise_for_status()
+    if response.json()["failed"]:
+        raise RuntimeError(f"Batch upload failed: {response.json()}")
+    uploaded = time.perf_counter() - started
+
+    started = time.perf_counter()
+    if recursive:
+        response = await client.delete("/files/", params={"path": directory, "recursive": "true"})
+    else:
+        response = await client.post("/files/batch/delete", json={"paths": [f"{directory}/{name}" for name in names]})
+    response.raise_for_status()
+    return uploaded, time.perf_counter() - started
+
+
+async def run(args) -> dict:
+    if "bench" not in user_store:
+        user_store.create_user("bench", "unused")
+    token = jwt.encode(
+        {"sub": "bench", "exp": datetime.utcnow() + timedelta(hours=1)},
+        auth.SECRET_KEY,
+        algorithm=auth.ALGORITHM,
+    )
+    names = [f"file-{i:06d}.bin" for i in range(args.files)]
+    payload = os.urandom(args.size)
+    transport = httpx.ASGITransport(app=build_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None,
+                                 headers={"Authorization": f"Bearer {token}"}) as client:
+        results = {}
+        results["single"] = await single(client, names, payload, args.clients)
+        results["batch"] = await batch(client, names, payload, recursive=False)
+        results["tree"] = await batch(client, names, payload, recursive=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk upload/delete throughput benchmark")
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--size", type=int, default=4096)
+    parser.add_argument("--clients", type=int, default=8)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(f"{args.files} files of {args.size} bytes, data in {work_dir}")
+    labels = {
+        "single": f"one request per file ({args.clients} clients)",
+        "batch": "batch upload + batch delete",
+        "tree": "batch upload + recursive delete",
+    }
+    for name, (uploaded, deleted) in results.items():
+        print(f"  {labels[name]:<38}: upload {args.files / uploaded:9.0f} files/s, "
+              f"delete {args.files / deleted:9.0f} files/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# backend/benchmarks/columnar_bench.py
+#
+# What the sink's columnar copies (COLUMNAR_FORMAT) save downstream readers.
+#
+#   python backend/benchmarks/columnar_bench.py [--rows 1000000] [--runs 3] [--output result.json]
+#
+# Generates three representative datasets in a temporary directory and converts each with
+# the sink's converter (backend.common.columnar.convert_file) to Parquet and Arrow IPC:
+#   metrics   CSV, numeric sensor readings (int, float, float, int)
+#   orders    CSV, mixed columns (ids, dates, categories, free text, amounts)
+#   events    NDJSON, one JSON object per line
+# For every dataset and file type it reports
+#   size      bytes on disk
+#   convert   time to produce the copy (included once, on ingest)
+#   parse     loading the whole file into memory: csv/json from the standard library as
+#             scripts do today, pyarrow's CSV/JSON reader, and the columnar copies
+#   scan      summing one numeric column, i.e. a typical query touching one column
+# Arrow IPC copies are memory-mapped, so "parsing" them is zero-copy and pages are only
+# read once a column is touched; the scan numbers are the fairer comparison there.
+# Requires pyarrow.
+
+import os
+import csv
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_dir = os.path.dirname(current_dir)
+project_dir = os.path.dirname(backend_dir)
+if project_dir not in sys.path:
+    sys.path.append(project_dir)
+
+import pyarrow as pa
+import pyarrow.csv
+import pyarrow.json
+import pyarrow.ipc
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from backend.common.columnar import convert_file
+
+CATEGORIES = ["books", "garden", "tools", "toys", "music", "sports", "food", "health"]
+WORDS = ["fast", "blue", "order", "gift", "express", "return", "bulk", "sample", "priority", "fragile"]
+
+
+def write_metrics(path: str, rows: int):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["sensor_id", "temperature", "humidity", "timestamp"])
+        for i in range(rows):
+            writer.writerow([i % 5000, round(random.uniform(-20, 40), 3), round(random.random() * 100, 2),
+                             1700000000 + i])
+
+
+def write_orders(path: str, rows: int):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["order_id", "date", "category", "customer", "note", "amount"])
+        for i in range(rows):
+            writer.writerow([i, f"2024-{1 + i % 12:02d}-{1 + i % 28:02d}", random.choice(CATEGORIES),
+                             f"customer-{random.randrange(100000)}", " ".join(random.sample(WORDS, 3)),
+                             round(random.uniform(1, 500), 2)])
+
+
+def write_events(path: str, rows: int):
+    with open(path, "w") as f:
+        for i in range(rows):
+            f.write(json.dumps({"event_id": i, "user": f"user-{random.randrange(50000)}",
+                                "type": random.choice(WORDS), "ts": 1700000000 + i,
+                                "value": round(random.random() * 1000, 3)}) + "\n")
+
+
+DATASETS = {
+    "metrics": ("csv", write_metrics, "temperature"),
+    "orders": ("csv", write_orders, "amount"),
+    "events": ("ndjson", write_events, "value"),
+}
+
+
+def stdlib_parse(path: str, kind: str) -> int:
+    with open(path, newline="") as f:
+        if kind == "csv":
+            return sum(1 for _ in csv.DictReader(f))
+        return sum(1 for line in f if json.loads(line))
+
+
+def stdlib_scan(path: str, kind: str, column: str) -> float:
+    with open(path, newline="") as f:
+        if kind == "csv":
+            return sum(float(row[column]) for row in csv.DictReader(f))
+        return sum(json.loads(line)[column] for line in f)
+
+
+def arrow_text_read(path: str, kind: str, columns=None) -> pa.Table:
+    if kind == "csv":
+        return pa.csv.read_csv(path, convert_options=pa.csv.ConvertOptions(include_columns=columns))
+    table = pa.json.read_json(path)
+    return table.select(columns) if columns else table
+
+
+def ipc_read(path: str, columns=None) -> pa.Table:
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.select(columns) if columns else table
+
+
+def timed(func, runs: int) -> float:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def bench_dataset(work_dir: str, name: str, rows: int, runs: int) -> dict:
+    kind, writer, column = DATASETS[name]
+    source = os.path.join(work_dir, f"{name}.{kind}")
+    writer(source, rows)
+    parquet_path = source + ".parquet"
+    arrow_path = source + ".arrow"
+
+    result = {"rows": rows, "kind": kind, "column": column}
+    result["convert_parquet"] = timed(lambda: convert_file(source, parquet_path, kind, "parquet"), 1)
+    result["convert_arrow"] = timed(lambda: convert_file(source, arrow_path, kind, "arrow"), 1)
+    result["size"] = {"original": os.path.getsize(source), "parquet": os.path.getsize(parquet_path),
+                      "arrow": os.path.getsize(arrow_path)}
+    result["parse"] = {
+        "stdlib": timed(lambda: stdlib_parse(source, kind), 1),
+        "pyarrow_text": timed(lambda: arrow_text_read(source, kind), runs),
+        "parquet": timed(lambda: pq.read_table(parquet_path), runs),
+        "arrow": timed(lambda: ipc_read(arrow_path), runs),
+    }
+    result["scan"] = {
+        "stdlib": timed(lambda: stdlib_scan(source, kind, column), 1),
+        "pyarrow_text": timed(lambda: pc.sum(arrow_text_read(source, kind, [column])[column]), runs),
+        "parquet": timed(lambda: pc.sum(pq.read_table(parquet_path, columns=[column])[column]), runs),
+        "arrow": timed(lambda: pc.sum(ipc_read(arrow_path, [column])[column]), runs),
+    }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar copy parse/scan benchmark")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--datasets", default=",".join(DATASETS))
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    random.seed(7)
+    work_dir = tempfile.mkdtemp(prefix="columnar-bench-")
+    results = {name: bench_dataset(work_dir, name, args.rows, args.runs)
+               for name in (name.strip() for name in args.datasets.split(","))}
+
+    print(f"{args.rows} rows per dataset, pyarrow {pa.__version__}, data in {work_dir}")
+    for name, result in results.items():
+        size = result["size"]
+        print(f"  {name} ({result['kind']}, scan sums '{result['column']}'):")
+        print(f"    size      : original {size['original'] / 1e6:8.1f} MB, parquet {size['parquet'] / 1e6:8.1f} MB, "
+              f"arrow {size['arrow'] / 1e6:8.1f} MB")
+        print(f"    convert   : parquet {result['convert_parquet'] * 1000:8.0f} ms, "
+              f"arrow {result['convert_arrow'] * 1000:8.0f} ms "
+              f"({size['original'] / result['convert_parquet'] / 1e6:.0f} MB/s to parquet)")
+        for step in ("parse", "scan"):
+            timings = result[step]
+            baseline = timings["stdlib"]
+            print(f"    {step:<10}: " + ", ".join(
+                f"{reader} {seconds * 1000:7.1f} ms ({baseline / seconds:5.1f}x)" for reader, seconds in timings.items()))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
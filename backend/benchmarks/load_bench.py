@@ -0,0 +1,569 @@
+# backend/benchmarks/load_bench.py
+#
+# Load test of both services, reported as JSON so runs can be compared across commits.
+#
+#   python backend/benchmarks/load_bench.py [--target inprocess|server] [--quick]
+#                                           [--scenarios login,listing,receive,download]
+#                                           [--output result.json] [--compare baseline.json]
+#
+# Scenarios:
+#   login      concurrent POST /auth/login (bcrypt on the password hasher's process pool)
+#   listing    GET /files/ of directories with 1k and 100k small files
+#   receive    POST /receive-file pushes of 1 MB (repeated), 1 GB and 5 GB
+#   download   concurrent GET /files/download of one large file
+#
+# "inprocess" imports both apps and drives them over ASGI without sockets; response
+# bodies are counted and dropped, never buffered. "server" starts run_backend.py in prod
+# mode (ports 8003 and 8002 must be free) and drives it over HTTP with httpx. All data
+# lives in a temporary directory. Each scenario reports requests/s, MB/s, latency
+# percentiles and the peak RSS of the serving processes during the scenario (their
+# VmHWM, reset through /proc/<pid>/clear_refs on Linux; in-process that includes the
+# load generator itself).
+
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+
+os.environ.setdefault("LOG_LEVEL", "warning")
+# The benchmarks measure the services, not the per-user limits
+os.environ.setdefault("RATE_LIMIT_PER_SECOND", "0")
+os.environ.setdefault("MAX_CONCURRENT_TRANSFERS", "0")
+# The 5 GB receive would otherwise be refused up front by the 1 GiB default limit
+os.environ.setdefault("MAX_RECEIVE_SIZE", "0")
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_dir = os.path.dirname(current_dir)
+project_dir = os.path.dirname(backend_dir)
+if project_dir not in sys.path:
+    sys.path.append(project_dir)
+
+BENCH_USER = "bench-user"
+BENCH_PASSWORD = "bench-password"
+BODY_CHUNK_SIZE = 1024 * 1024
+SIZE_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+FULL = {
+    "logins": 200,
+    "listing_sizes": [1000, 100000],
+    "listing_requests": 50,
+    "receive_sizes": ["1M", "1G", "5G"],
+    "small_receives": 200,
+    "download_size": "256M",
+    "downloads": 64,
+}
+QUICK = {
+    "logins": 40,
+    "listing_sizes": [1000, 10000],
+    "listing_requests": 20,
+    "receive_sizes": ["1M", "64M"],
+    "small_receives": 50,
+    "download_size": "16M",
+    "downloads": 32,
+}
+
+
+def parse_size(value: str) -> int:
+    value = value.strip().upper().rstrip("B")
+    if value and value[-1] in SIZE_UNITS:
+        return int(float(value[:-1]) * SIZE_UNITS[value[-1]])
+    return int(value)
+
+
+async def body_chunks(body):
+    if body is None:
+        return
+    if isinstance(body, bytes):
+        yield body
+        return
+    async for chunk in body:
+        yield chunk
+
+
+async def generated_body(size: int):
+    # Payload of any size from one reused buffer, so the client never holds more than a chunk
+    chunk = os.urandom(BODY_CHUNK_SIZE)
+    remaining = size
+    while remaining > 0:
+        piece = chunk if remaining >= BODY_CHUNK_SIZE else chunk[:remaining]
+        remaining -= len(piece)
+        yield piece
+
+
+class AsgiTarget:
+    # Minimal ASGI client: streams the request body, counts response bytes without keeping them
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, path: str, headers: dict = None, body=None, keep_body: bool = False):
+        path, _, query = path.partition("?")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "root_path": "",
+            "headers": [(b"host", b"bench")] + [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+            "client": ("127.0.0.1", 1),
+            "server": ("bench", 80),
+            "extensions": {},
+        }
+        chunks = body_chunks(body)
+        finished = asyncio.Event()
+        body_done = False
+        response = {"status": 0, "bytes": 0, "parts": []}
+
+        async def receive():
+            nonlocal body_done
+            if not body_done:
+                try:
+                    chunk = await chunks.__anext__()
+                    return {"type": "http.request", "body": chunk, "more_body": True}
+                except StopAsyncIteration:
+                    body_done = True
+                    return {"type": "http.request", "body": b"", "more_body": False}
+            # Like a server, only report the disconnect once the response is complete
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["bytes"] += len(message.get("body", b""))
+                if keep_body:
+                    response["parts"].append(message.get("body", b""))
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            finished.set()
+        return response["status"], response["bytes"], b"".join(response["parts"])
+
+    async def close(self):
+        pass
+
+
+class HttpTarget:
+
+    def __init__(self, base_url: str, connections: int):
+        import httpx
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=None,
+            limits=httpx.Limits(max_connections=connections, max_keepalive_connections=connections),
+        )
+
+    async def request(self, method: str, path: str, headers: dict = None, body=None, keep_body: bool = False):
+        received = 0
+        parts = []
+        async with self.client.stream(method, path, headers=headers, content=body) as response:
+            async for chunk in response.aiter_raw():
+                received += len(chunk)
+                if keep_body:
+                    parts.append(chunk)
+        return response.status_code, received, b"".join(parts)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class RssMonitor:
+    # Peak resident memory of a process and all its descendants
+
+    def __init__(self, root_pid: int):
+        self.root_pid = root_pid
+        self.resettable = True
+
+    def pids(self) -> list:
+        children = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # The command name may contain spaces, the fields after it do not
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+        pids = [self.root_pid]
+        for pid in pids:
+            pids.extend(children.get(pid, []))
+        return pids
+
+    def reset(self):
+        if not os.path.isdir("/proc"):
+            self.resettable = False
+            return
+        for pid in self.pids():
+            try:
+                with open(f"/proc/{pid}/clear_refs", "w") as f:
+                    f.write("5")
+            except OSError:
+                self.resettable = False
+
+    def peak_mb(self) -> float:
+        if not os.path.isdir("/proc"):
+            import resource
+            return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        total = 0
+        for pid in self.pids():
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmHWM:"):
+                            total += int(line.split()[1])
+                            break
+            except OSError:
+                continue
+        return round(total / 1024, 1)
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))
+    return values[index]
+
+
+def summarize(name: str, latencies: list, errors: int, transferred: int, elapsed: float, peak_rss_mb: float,
+              **extra) -> dict:
+    latencies = sorted(latencies)
+    requests = len(latencies)
+    result = {
+        "name": name,
+        "requests": requests,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(requests / elapsed, 1) if elapsed else 0.0,
+        "bytes": transferred,
+        "mb_per_s": round(transferred / elapsed / 1024 ** 2, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / requests * 1000, 2) if requests else 0.0,
+            "p50": round(percentile(latencies, 0.50) * 1000, 2),
+            "p90": round(percentile(latencies, 0.90) * 1000, 2),
+            "p99": round(percentile(latencies, 0.99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+        "peak_rss_mb": peak_rss_mb,
+    }
+    result.update(extra)
+    return result
+
+
+async def run_load(name: str, total: int, concurrency: int, make_request, monitor: RssMonitor, **extra) -> dict:
+    # make_request(i) returns (status, bytes transferred); workers share one counter
+    latencies = []
+    errors = 0
+    transferred = 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors, transferred
+        for i in remaining:
+            started = time.perf_counter()
+            try:
+                status, size = await make_request(i)
+                if status >= 400:
+                    errors += 1
+                else:
+                    transferred += size
+            except Exception as e:
+                print(f"[{name}] request failed: {e!r}", file=sys.stderr)
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    monitor.reset()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, total)))))
+    elapsed = time.perf_counter() - started
+    result = summarize(name, latencies, errors, transferred, elapsed, monitor.peak_mb(), concurrency=concurrency, **extra)
+    print(f"[{name}] {result['rps']} req/s, {result['mb_per_s']} MB/s, p99 {result['latency_ms']['p99']} ms, "
+          f"errors {errors}, peak RSS {result['peak_rss_mb']} MB", file=sys.stderr)
+    return result
+
+
+class Bench:
+
+    def __init__(self, args, source, sink, monitor: RssMonitor, data_dir: str):
+        self.args = args
+        self.source = source
+        self.sink = sink
+        self.monitor = monitor
+        self.data_dir = data_dir
+        self.profile = QUICK if args.quick else FULL
+        self.token = None
+
+    def auth(self, **headers) -> dict:
+        return {"authorization": f"Bearer {self.token}", **headers}
+
+    async def setup(self):
+        body = json.dumps({"username": BENCH_USER, "password": BENCH_PASSWORD}).encode()
+        headers = {"content-type": "application/json"}
+        status, _, _ = await self.source.request("POST", "/auth/register", headers, body)
+        if status not in (201, 400):
+            raise RuntimeError(f"Registration failed with status {status}")
+        status, _, response = await self.source.request("POST", "/auth/login", headers, body, keep_body=True)
+        if status != 200:
+            raise RuntimeError(f"Login failed with status {status}")
+        self.token = json.loads(response)["token"]
+
+    async def login(self) -> list:
+        body = json.dumps({"username": BENCH_USER, "password": BENCH_PASSWORD}).encode()
+        headers = {"content-type": "application/json"}
+
+        async def make_request(i):
+            status, size, _ = await self.source.request("POST", "/auth/login", headers, body)
+            return status, size
+
+        return [await run_load("login_storm", self.profile["logins"], self.args.concurrency, make_request, self.monitor)]
+
+    async def listing(self) -> list:
+        results = []
+        for count in self.profile["listing_sizes"]:
+            directory = f"listing-{count}"
+            path = os.path.join(self.data_dir, directory)
+            os.makedirs(path, exist_ok=True)
+            for i in range(count):
+                with open(os.path.join(path, f"file-{i:07d}.txt"), "wb") as f:
+                    f.write(b"x")
+            url = f"/files/?dir={directory}"
+
+            # The first listing of a directory is a full scan, the following ones are cached
+            started = time.perf_counter()
+            status, _, _ = await self.source.request("GET", url, self.auth())
+            cold_ms = round((time.perf_counter() - started) * 1000, 2)
+            if status != 200:
+                raise RuntimeError(f"Listing of {directory} failed with status {status}")
+
+            async def make_request(i):
+                status, size, _ = await self.source.request("GET", url, self.auth())
+                return status, size
+
+            results.append(await run_load(f"listing_{count}", self.profile["listing_requests"], self.args.concurrency,
+                                          make_request, self.monitor, entries=count, cold_ms=cold_ms))
+            shutil.rmtree(path)
+        return results
+
+    async def receive(self) -> list:
+        results = []
+        for label in self.profile["receive_sizes"]:
+            size = parse_size(label)
+            small = size <= 16 * 1024 ** 2
+            total = self.profile["small_receives"] if small else 1
+            concurrency = self.args.concurrency if small else 1
+            free = shutil.disk_usage(self.data_dir).free
+            if size * min(total, concurrency) * 2 > free:
+                print(f"[receive_{label}] skipped, needs {size * 2} bytes of free disk", file=sys.stderr)
+                results.append({"name": f"receive_{label}", "skipped": "not enough free disk space"})
+                continue
+
+            async def make_request(i, size=size, label=label):
+                name = f"bench-{label}-{i}.bin"
+                headers = self.auth(**{
+                    "content-type": "application/octet-stream",
+                    "content-length": str(size),
+                    "content-disposition": f'attachment; filename="{name}"',
+                })
+                status, _, _ = await self.sink.request("POST", "/receive-file", headers, generated_body(size))
+                # Keeps disk usage at one payload per client
+                await self.sink.request("DELETE", f"/received/?name={name}", self.auth())
+                return status, size
+
+            results.append(await run_load(f"receive_{label}", total, concurrency, make_request, self.monitor,
+                                          payload_bytes=size))
+        return results
+
+    async def download(self) -> list:
+        size = parse_size(self.profile["download_size"])
+        path = os.path.join(self.data_dir, "download.bin")
+        chunk = os.urandom(BODY_CHUNK_SIZE)
+        with open(path, "wb") as f:
+            for offset in range(0, size, BODY_CHUNK_SIZE):
+                f.write(chunk[:size - offset])
+
+        async def make_request(i):
+            status, received, _ = await self.source.request(
+                "GET", "/files/download?path=download.bin", self.auth(**{"accept-encoding": "identity"})
+            )
+            if status == 200 and received != size:
+                raise RuntimeError(f"Short download: {received} of {size} bytes")
+            return status, received
+
+        result = await run_load("concurrent_download", self.profile["downloads"], self.args.concurrency,
+                                make_request, self.monitor, payload_bytes=size)
+        os.remove(path)
+        return [result]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=project_dir, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+def start_server(work_dir: str, workers: int) -> subprocess.Popen:
+    # run_backend.py imports backend.<service>.main relative to its working directory
+    link = os.path.join(work_dir, "backend")
+    if not os.path.exists(link):
+        os.symlink(backend_dir, link)
+    return subprocess.Popen(
+        [sys.executable, os.path.join(backend_dir, "run_backend.py"), "--mode", "prod", "--workers", str(workers),
+         "--host", "127.0.0.1", "--log-level", "warning", "--graceful-timeout", "5"],
+        cwd=work_dir,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+async def wait_until_ready(targets: list, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    for target in targets:
+        while True:
+            try:
+                status, _, _ = await target.request("GET", "/metrics")
+                if status == 200:
+                    break
+            except Exception:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError("Services did not start in time")
+            await asyncio.sleep(0.5)
+
+
+async def run(args, work_dir: str) -> dict:
+    data_dir = os.path.join(work_dir, "data")
+    server = None
+    lifespans = []
+    if args.target == "server":
+        server = start_server(work_dir, args.workers)
+        source = HttpTarget("http://127.0.0.1:8003", args.concurrency)
+        sink = HttpTarget("http://127.0.0.1:8002", args.concurrency)
+        monitor = RssMonitor(server.pid)
+        await wait_until_ready([source, sink])
+    else:
+        # The services read ./data relative to the working directory
+        from backend.data_source.main import create_app as create_source_app
+        from backend.data_sink.main import create_app as create_sink_app
+        source_app = create_source_app()
+        sink_app = create_sink_app()
+        for app in (source_app, sink_app):
+            lifespan = app.router.lifespan_context(app)
+            await lifespan.__aenter__()
+            lifespans.append(lifespan)
+        source = AsgiTarget(source_app)
+        sink = AsgiTarget(sink_app)
+        monitor = RssMonitor(os.getpid())
+
+    bench = Bench(args, source, sink, monitor, data_dir)
+    scenarios = []
+    try:
+        await bench.setup()
+        for name in args.scenarios.split(","):
+            scenarios.extend(await getattr(bench, name.strip())())
+    finally:
+        await source.close()
+        await sink.close()
+        for lifespan in reversed(lifespans):
+            await lifespan.__aexit__(None, None, None)
+        if server is not None:
+            os.killpg(server.pid, signal.SIGTERM)
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                os.killpg(server.pid, signal.SIGKILL)
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "target": args.target,
+            "workers": args.workers if args.target == "server" else 1,
+            "concurrency": args.concurrency,
+            "profile": "quick" if args.quick else "full",
+            "rss_reset": monitor.resettable,
+        },
+        "scenarios": scenarios,
+    }
+
+
+def compare(result: dict, baseline: dict):
+    # Relative change of every scenario metric against a previous run, on stderr
+    previous = {scenario["name"]: scenario for scenario in baseline.get("scenarios", [])}
+    print(f"compared with {baseline.get('meta', {}).get('commit', '?')}:", file=sys.stderr)
+    for scenario in result["scenarios"]:
+        before = previous.get(scenario["name"])
+        if before is None or "skipped" in scenario or "skipped" in before:
+            continue
+        changes = []
+        for label, now, then in (
+                ("rps", scenario["rps"], before["rps"]),
+                ("MB/s", scenario["mb_per_s"], before["mb_per_s"]),
+                ("p99", scenario["latency_ms"]["p99"], before["latency_ms"]["p99"]),
+                ("rss", scenario["peak_rss_mb"], before["peak_rss_mb"]),
+        ):
+            if then:
+                changes.append(f"{label} {(now - then) / then * 100:+.1f}%")
+        print(f"  {scenario['name']:<22} " + ", ".join(changes), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the data source and data sink services")
+    parser.add_argument("--target", choices=["inprocess", "server"], default="inprocess")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes per service with --target server")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scenarios", default="login,listing,receive,download")
+    parser.add_argument("--quick", action="store_true", help="Smaller sizes and counts, for a fast check")
+    parser.add_argument("--output", help="Write the JSON result to this file instead of stdout")
+    parser.add_argument("--compare", help="Previous JSON result to compare against")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary data directory")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="load-bench-")
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        result = asyncio.run(run(args, work_dir))
+    finally:
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+    # A throughput figure with failed transfers in it measures the failures, not the service
+    failed = [scenario["name"] for scenario in result["scenarios"] if "payload_bytes" in scenario and scenario["errors"]]
+    if failed:
+        print(f"error: failed requests in {', '.join(failed)}; their throughput is not valid", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
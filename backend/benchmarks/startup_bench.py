@@ -0,0 +1,173 @@
+# backend/benchmarks/startup_bench.py
+#
+# Cold-start time of both services, each measured in fresh interpreter processes.
+#
+#   python backend/benchmarks/startup_bench.py [--runs 5] [--services data_sink,data_source]
+#                                              [--importtime 15] [--output result.json]
+#
+# For every run and service:
+#   import   importing backend.<service>.main (no side effects since the app factory)
+#   create   import plus create_app(): logging, storage backends and all routers
+#   ready    from spawning "python -m backend.<service>.main --mode prod --workers 1" to the
+#            first 200 from GET /metrics, i.e. what a readiness probe sees
+# --importtime lists the modules with the largest own import time (python -X importtime)
+# for create_app(), to find what to make lazy next. Runs in a temporary working directory.
+
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import argparse
+import tempfile
+import statistics
+import subprocess
+import http.client
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_dir = os.path.dirname(current_dir)
+project_dir = os.path.dirname(backend_dir)
+
+SERVICES = ("data_sink", "data_source")
+# Readiness budget from the deployment requirements
+READY_TARGET_SECONDS = 1.0
+
+MEASURE_CREATE = """
+import json, time
+started = time.perf_counter()
+import backend.{service}.main as main
+imported = time.perf_counter()
+main.create_app()
+created = time.perf_counter()
+print(json.dumps({{"import": imported - started, "create": created - started}}))
+"""
+
+
+def child_env() -> dict:
+    env = os.environ.copy()
+    env["PYTHONPATH"] = project_dir
+    env.setdefault("LOG_LEVEL", "warning")
+    return env
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_create(service: str, work_dir: str) -> dict:
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", MEASURE_CREATE.format(service=service)], cwd=work_dir,
+                            env=child_env(), capture_output=True, text=True, check=True)
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    # Includes interpreter startup and shutdown
+    timings["process"] = time.perf_counter() - started
+    return timings
+
+
+def probe(port: int) -> bool:
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+    try:
+        connection.request("GET", "/metrics")
+        return connection.getresponse().status == 200
+    except OSError:
+        return False
+    finally:
+        connection.close()
+
+
+def measure_ready(service: str, work_dir: str, timeout: float = 30) -> float:
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", f"backend.{service}.main", "--mode", "prod", "--workers", "1",
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=work_dir,
+        env=child_env(),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while not probe(port):
+            if server.poll() is not None:
+                raise RuntimeError(f"{service} exited with code {server.returncode}")
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError(f"{service} was not ready within {timeout}s")
+            time.sleep(0.005)
+        return time.perf_counter() - started
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+
+def import_profile(service: str, work_dir: str, limit: int) -> list:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import backend.{service}.main as m; m.create_app()"],
+        cwd=work_dir, env=child_env(), capture_output=True, text=True, check=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((int(own), int(cumulative), name.strip()))
+    modules.sort(reverse=True)
+    return [{"module": name, "self_ms": own / 1000, "cumulative_ms": cumulative / 1000}
+            for own, cumulative, name in modules[:limit]]
+
+
+def summarize(samples: list) -> dict:
+    return {"min": min(samples), "median": statistics.median(samples), "max": max(samples)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Service cold-start benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--services", default=",".join(SERVICES))
+    parser.add_argument("--importtime", type=int, default=0, metavar="N",
+                        help="Also list the N modules with the largest own import time")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="startup-bench-")
+    # The services import backend.<service>.main and use ./data and ./logs in the working directory
+    os.symlink(backend_dir, os.path.join(work_dir, "backend"))
+
+    results = {}
+    for service in (name.strip() for name in args.services.split(",")):
+        samples = {"import": [], "create": [], "process": [], "ready": []}
+        # One unmeasured round so every run sees warm OS file caches
+        measure_create(service, work_dir)
+        for _ in range(args.runs):
+            for key, value in measure_create(service, work_dir).items():
+                samples[key].append(value)
+            samples["ready"].append(measure_ready(service, work_dir))
+        results[service] = {key: summarize(values) for key, values in samples.items()}
+        if args.importtime:
+            results[service]["slowest_imports"] = import_profile(service, work_dir, args.importtime)
+
+    print(f"{args.runs} runs per service, python {sys.version.split()[0]}, data in {work_dir}")
+    for service, result in results.items():
+        print(f"  {service}:")
+        for key, label in (("import", "import module"), ("create", "import + create_app()"),
+                           ("process", "python -c (whole process)"), ("ready", "spawn to first 200")):
+            print(f"    {label:<26}: median {result[key]['median'] * 1000:7.1f} ms, "
+                  f"min {result[key]['min'] * 1000:7.1f} ms")
+        verdict = "ok" if result["ready"]["median"] < READY_TARGET_SECONDS else "over"
+        print(f"    {f'ready within {READY_TARGET_SECONDS:.1f}s':<26}: {verdict}")
+        for module in result.get("slowest_imports", []):
+            print(f"      {module['self_ms']:7.1f} ms self, {module['cumulative_ms']:7.1f} ms total  {module['module']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
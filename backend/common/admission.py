@@ -0,0 +1,336 @@
+# backend/common/admission.py
+
+import os
+import re
+import math
+import time
+import sqlite3
+import posixpath
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Pattern, Tuple
+
+import jwt
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from backend.common.storage import IOExecutor, io_executor, normalize_key
+from backend.common.token_cache import TokenCache, decode_token
+from backend.common.metrics import admission_rejections
+
+# Sustained requests per second per user (the JWT sub, or the client address for requests
+# without a valid token), per worker process; 0 (the default) disables rate limiting.
+# Behind a reverse proxy every anonymous request (login, register) has the proxy's
+# address, so they all share one bucket.
+RATE_LIMIT_PER_SECOND = float(os.environ.get("RATE_LIMIT_PER_SECOND", 0))
+# Requests a user may send at once on top of the sustained rate
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", 200))
+# Users whose bucket is kept per process; the least recently seen are dropped first
+RATE_LIMIT_MAX_USERS = int(os.environ.get("RATE_LIMIT_MAX_USERS", 100000))
+# Uploads and downloads per user in flight at once, per worker process; 0 (the default) disables
+MAX_CONCURRENT_TRANSFERS = int(os.environ.get("MAX_CONCURRENT_TRANSFERS", 0))
+# Set to 0 to stop tracking how many bytes every user has stored
+QUOTAS_ENABLED = os.environ.get("QUOTAS_ENABLED", "1") != "0"
+# Bytes a user may store over both services; 0 tracks usage without a limit
+USER_QUOTA_BYTES = int(os.environ.get("USER_QUOTA_BYTES", 0))
+# Shared by both services and all their workers, keyed like the digest store
+QUOTA_DB_PATH = os.environ.get("QUOTA_DB_PATH", os.path.join("./data", ".internal", "quotas.db"))
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS usage (
+        user TEXT PRIMARY KEY NOT NULL,
+        bytes INTEGER NOT NULL,
+        files INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS owners (
+        key TEXT PRIMARY KEY NOT NULL,
+        user TEXT NOT NULL,
+        size INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """,
+)
+
+ADD_USAGE = """
+INSERT INTO usage (user, bytes, files) VALUES (?, ?, ?)
+ON CONFLICT (user) DO UPDATE SET bytes = bytes + excluded.bytes, files = files + excluded.files
+"""
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, used: int, quota: int):
+        super().__init__(f"Storage quota exceeded: {used} of {quota} bytes used")
+        self.used = used
+        self.quota = quota
+
+
+class TokenBucket:
+    # Refilled lazily on every take(), so idle users cost nothing
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        # 0 when a token was taken, else the seconds until the next one is available
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    # One token bucket per user. Only touched from the event loop, so no locking.
+
+    def __init__(self, rate: float = RATE_LIMIT_PER_SECOND, burst: int = RATE_LIMIT_BURST,
+                 max_users: int = RATE_LIMIT_MAX_USERS):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self.buckets = OrderedDict()
+
+    def take(self, user: str) -> float:
+        bucket = self.buckets.get(user)
+        if bucket is None:
+            bucket = self.buckets[user] = TokenBucket(self.rate, self.burst)
+            if len(self.buckets) > self.max_users:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(user)
+        return bucket.take()
+
+
+class TransferLimiter:
+    # Transfers in flight per user; a user at the limit is turned away rather than queued
+
+    def __init__(self, limit: int = MAX_CONCURRENT_TRANSFERS):
+        self.limit = limit
+        self.active: Dict[str, int] = {}
+
+    def acquire(self, user: str) -> bool:
+        active = self.active.get(user, 0)
+        if active >= self.limit:
+            return False
+        self.active[user] = active + 1
+        return True
+
+    def release(self, user: str):
+        active = self.active.get(user, 0) - 1
+        if active > 0:
+            self.active[user] = active
+        else:
+            self.active.pop(user, None)
+
+
+class QuotaStore:
+    # Bytes stored per user, kept up to date on every write and delete instead of walking
+    # the tree. owners remembers who wrote each key and how large it was, so replacing or
+    # deleting a file credits the user who stored it. Files stored before tracking was
+    # enabled, or changed behind the services' back, are not counted. Same SQLite setup
+    # as DigestStore; root_key works as in MetadataIndex.
+
+    def __init__(self, path: str = QUOTA_DB_PATH, root_key: str = "", quota: int = USER_QUOTA_BYTES,
+                 executor: IOExecutor = io_executor):
+        self.path = path
+        self.root_key = normalize_key(root_key)
+        self.quota = quota
+        self.executor = executor
+        self.local = threading.local()
+        self.schema_lock = threading.Lock()
+        self.schema_ready = False
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, cached_statements=64)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            with self.schema_lock:
+                if not self.schema_ready:
+                    for statement in SCHEMA:
+                        conn.execute(statement)
+                    self.schema_ready = True
+            self.local.conn = conn
+        return conn
+
+    def index_key(self, key: str) -> str:
+        key = normalize_key(key)
+        if not self.root_key:
+            return key
+        return posixpath.join(self.root_key, key) if key else self.root_key
+
+    def get(self, user: str) -> Tuple[int, int]:
+        row = self.connection().execute("SELECT bytes, files FROM usage WHERE user = ?", (user,)).fetchone()
+        return (row[0], row[1]) if row is not None else (0, 0)
+
+    def put(self, key: str, user: str, size: int):
+        index_key = self.index_key(key)
+        conn = self.connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            previous = conn.execute("SELECT user, size FROM owners WHERE key = ?", (index_key,)).fetchone()
+            if previous is not None:
+                conn.execute(ADD_USAGE, (previous[0], -previous[1], -1))
+            conn.execute("INSERT OR REPLACE INTO owners (key, user, size) VALUES (?, ?, ?)", (index_key, user, size))
+            conn.execute(ADD_USAGE, (user, size, 1))
+
+    def remove(self, keys: List[str]):
+        # Keys and, for directories, everything below them
+        conn = self.connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for key in keys:
+                index_key = self.index_key(key)
+                bounds = (index_key, index_key + "/", index_key + "/\U0010ffff")
+                released = conn.execute(
+                    "SELECT user, SUM(size), COUNT(*) FROM owners WHERE key = ? OR (key >= ? AND key < ?) GROUP BY user",
+                    bounds,
+                ).fetchall()
+                for user, size, files in released:
+                    conn.execute(ADD_USAGE, (user, -size, -files))
+                conn.execute("DELETE FROM owners WHERE key = ? OR (key >= ? AND key < ?)", bounds)
+
+    async def usage(self, user: str) -> Dict[str, Optional[int]]:
+        used, files = await self.executor.run(self.get, user)
+        return {"bytes": used, "files": files, "quota": self.quota or None}
+
+    async def remaining(self, user: str) -> Optional[int]:
+        # Bytes the user may still store, None without a quota; raises QuotaExceeded at 0
+        if not self.quota:
+            return None
+        used, _ = await self.executor.run(self.get, user)
+        if used >= self.quota:
+            raise QuotaExceeded(used, self.quota)
+        return self.quota - used
+
+    async def check(self, user: str, size: int):
+        remaining = await self.remaining(user)
+        if remaining is not None and size > remaining:
+            raise QuotaExceeded(self.quota - remaining, self.quota)
+
+    async def record(self, key: str, user: str, size: int):
+        await self.executor.run(self.put, key, user, size)
+
+    async def forget(self, *keys: str):
+        keys = [key for key in dict.fromkeys(normalize_key(key) for key in keys) if key]
+        if keys:
+            await self.executor.run(self.remove, keys)
+
+
+def bearer_subject(authorization: Optional[str], secret_key: str, algorithm: str,
+                   cache: Optional[TokenCache]) -> Optional[str]:
+    # sub of a validly signed bearer token, None otherwise. The endpoints still authenticate
+    # every request; this only decides whose limits apply. cache must not be the services'
+    # auth cache: claims accepted here (exp optional) are not an authentication decision.
+    if not authorization or not authorization.startswith("Bearer "):
+        return None
+    try:
+        claims = decode_token(authorization[len("Bearer "):], secret_key, algorithm, cache)
+    except jwt.PyJWTError:
+        return None
+    subject = claims.get("sub")
+    return subject if isinstance(subject, str) and subject else None
+
+
+def compile_routes(routes: Iterable[Tuple[str, str]]) -> List[Tuple[str, Pattern]]:
+    return [(method, re.compile(path)) for method, path in routes]
+
+
+def matches(routes: List[Tuple[str, Pattern]], method: str, path: str) -> bool:
+    return any(method == route_method and pattern.fullmatch(path) for route_method, pattern in routes)
+
+
+class AdmissionMiddleware:
+    # Plain ASGI middleware that turns a request away before any endpoint, dependency or
+    # body parsing runs: FastAPI reads (and spools) multipart bodies before it resolves
+    # get_current_user, so limits applied there would come after the upload. Per user:
+    #   - every request takes a token from the user's bucket, else 429 with Retry-After
+    #   - transfers (uploads, downloads) count against MAX_CONCURRENT_TRANSFERS until
+    #     their response has been sent, else 429
+    #   - uploads whose Content-Length does not fit the user's remaining quota get 413;
+    #     the endpoints record what was stored and stop bodies without a length at the quota
+    # Rate and concurrency state lives in the process, so with several workers a user may
+    # get up to that many times the limits.
+
+    def __init__(self, app: ASGIApp, secret_key: str, algorithm: str,
+                 transfers: Iterable[Tuple[str, str]] = (), uploads: Iterable[Tuple[str, str]] = (),
+                 quota_store: Optional[QuotaStore] = None):
+        self.app = app
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+        # Its own cache, kept apart from the one get_current_user and validate_auth decide with
+        self.token_cache = TokenCache()
+        self.transfers = compile_routes(transfers)
+        self.uploads = compile_routes(uploads)
+        self.quota_store = quota_store if quota_store is not None and quota_store.quota else None
+        self.rate_limiter = RateLimiter() if RATE_LIMIT_PER_SECOND > 0 else None
+        self.transfer_limiter = TransferLimiter() if MAX_CONCURRENT_TRANSFERS > 0 else None
+
+    async def reject(self, scope: Scope, receive: Receive, send: Send, status_code: int, reason: str, detail: str,
+                     retry_after: Optional[float] = None):
+        admission_rejections.inc(1, reason)
+        headers = {"retry-after": str(max(1, math.ceil(retry_after)))} if retry_after is not None else None
+        await JSONResponse({"detail": detail}, status_code=status_code, headers=headers)(scope, receive, send)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        authorization = headers.get(b"authorization")
+        user = bearer_subject(authorization.decode("latin-1") if authorization else None,
+                              self.secret_key, self.algorithm, self.token_cache)
+
+        if self.rate_limiter is not None:
+            client = scope.get("client")
+            wait = self.rate_limiter.take(user if user is not None else f"address:{client[0] if client else ''}")
+            if wait:
+                await self.reject(scope, receive, send, 429, "rate_limited", "Too many requests", wait)
+                return
+
+        # Anonymous transfers are answered with 401 by the endpoint, without reading a body
+        if user is None:
+            await self.app(scope, receive, send)
+            return
+
+        method, path = scope["method"], scope["path"]
+        if self.quota_store is not None and matches(self.uploads, method, path):
+            content_length = headers.get(b"content-length")
+            try:
+                await self.quota_store.check(user, int(content_length) if content_length else 0)
+            except ValueError:
+                pass
+            except QuotaExceeded as e:
+                await self.reject(scope, receive, send, 413, "quota_exceeded", str(e))
+                return
+
+        if self.transfer_limiter is None or not matches(self.transfers, method, path):
+            await self.app(scope, receive, send)
+            return
+        if not self.transfer_limiter.acquire(user):
+            await self.reject(scope, receive, send, 429, "too_many_transfers",
+                              f"At most {self.transfer_limiter.limit} concurrent transfers per user", 1)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.transfer_limiter.release(user)
+
+
+def setup_admission(app, secret_key: str, algorithm: str,
+                    transfers: Iterable[Tuple[str, str]] = (), uploads: Iterable[Tuple[str, str]] = (),
+                    quota_store: Optional[QuotaStore] = None):
+    app.add_middleware(AdmissionMiddleware, secret_key=secret_key, algorithm=algorithm,
+                       transfers=list(transfers), uploads=list(uploads), quota_store=quota_store)
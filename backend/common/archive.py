@@ -0,0 +1,367 @@
+# backend/common/archive.py
+
+import os
+import stat
+import time
+import bisect
+import fnmatch
+import hashlib
+import tarfile
+import zipfile
+import posixpath
+from email.utils import formatdate
+from typing import AsyncIterator, Iterable, List, NamedTuple, Optional
+from urllib.parse import quote
+
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+from backend.common.storage import StorageBackend, COPY_CHUNK_SIZE
+from backend.common.compression import create_compressor, supported_encodings
+from backend.common.file_response import parse_range_header, etag_matches
+
+# Most files and directories one archive may contain; the manifest is kept in memory
+ARCHIVE_MAX_ENTRIES = int(os.environ.get("ARCHIVE_MAX_ENTRIES", 100000))
+
+TAR_BLOCK_SIZE = tarfile.BLOCKSIZE
+# Two zero blocks mark the end of a tar archive
+TAR_END = bytes(2 * TAR_BLOCK_SIZE)
+# Members at least this large get zip64 headers (the compressed size may exceed the input)
+ZIP64_THRESHOLD = 1 << 31
+
+# (format, compression) -> (file extension, media type)
+ARCHIVE_TYPES = {
+    ("tar", "none"): (".tar", "application/x-tar"),
+    ("tar", "gzip"): (".tar.gz", "application/gzip"),
+    ("tar", "zstd"): (".tar.zst", "application/zstd"),
+    ("zip", "none"): (".zip", "application/zip"),
+    ("zip", "deflate"): (".zip", "application/zip"),
+}
+
+
+class TooManyEntries(Exception):
+    pass
+
+
+class ArchiveEntry(NamedTuple):
+    key: str
+    name: str
+    is_dir: bool
+    size: int
+    mtime: float
+    # Strong validator of the file as listed, when the backend provides one
+    etag: Optional[str] = None
+
+
+def archive_type_supported(archive_format: str, compression: str) -> bool:
+    if (archive_format, compression) not in ARCHIVE_TYPES:
+        return False
+    return compression != "zstd" or "zstd" in supported_encodings()
+
+
+def include_matches(pattern: str, name: str) -> bool:
+    # Patterns with a "/" match the path below the archived directory, others the file name
+    if "/" in pattern:
+        return fnmatch.fnmatchcase(name, pattern.lstrip("/"))
+    return fnmatch.fnmatchcase(posixpath.basename(name), pattern)
+
+
+async def collect_entries(storage: StorageBackend, root_key: str, root_name: str, include: Optional[str] = None,
+                          excluded: Iterable[str] = (), max_entries: int = ARCHIVE_MAX_ENTRIES) -> List[ArchiveEntry]:
+    # Depth-first with every level sorted by name, so the same tree always produces the
+    # same archive byte for byte (which is what makes ranged resumes of tar possible).
+    # With an include pattern only matching files are archived, without their directories.
+    excluded = frozenset(excluded)
+    entries = []
+
+    async def walk(key: str, name: str):
+        directories, files = await storage.list(key)
+        children = [(d, True, None) for d in directories] + [(f["name"], False, f) for f in files]
+        for child_name, is_dir, info in sorted(children, key=lambda child: child[0]):
+            child_key = posixpath.join(key, child_name) if key else child_name
+            if child_key in excluded:
+                continue
+            relative = posixpath.join(name, child_name)
+            if is_dir:
+                if include is None:
+                    entries.append(ArchiveEntry(child_key, posixpath.join(root_name, relative), True, 0, 0.0))
+                await walk(child_key, relative)
+            elif include is None or include_matches(include, relative):
+                entries.append(ArchiveEntry(child_key, posixpath.join(root_name, relative), False,
+                                            info["size"], info.get("mtime") or 0.0, info.get("etag")))
+            if len(entries) > max_entries:
+                raise TooManyEntries(f"More than {max_entries} entries")
+
+    await walk(root_key, "")
+    return entries
+
+
+def tar_header(entry: ArchiveEntry) -> bytes:
+    info = tarfile.TarInfo(entry.name)
+    info.mtime = int(entry.mtime)
+    if entry.is_dir:
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+    else:
+        info.size = entry.size
+        info.mode = 0o644
+    # PAX only adds extended headers for long or non-ASCII names and huge sizes
+    return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+
+def tar_padding(size: int) -> int:
+    return -size % TAR_BLOCK_SIZE
+
+
+def clip(data: bytes, offset: int, start: int, end: int) -> bytes:
+    # Part of data (located at offset in the archive) that falls within [start, end)
+    return data[max(0, start - offset):max(0, end - offset)]
+
+
+class TarLayout:
+    # Offsets of every member of an uncompressed tar, computed from the manifest alone
+
+    def __init__(self, entries: List[ArchiveEntry]):
+        self.entries = entries
+        self.offsets = []
+        offset = 0
+        for entry in entries:
+            self.offsets.append(offset)
+            size = 0 if entry.is_dir else entry.size
+            offset += len(tar_header(entry)) + size + tar_padding(size)
+        self.members_end = offset
+        self.size = offset + len(TAR_END)
+
+    async def stream(self, storage: StorageBackend, start: int = 0, end: Optional[int] = None,
+                     chunk_size: int = COPY_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        # Bytes [start, end) of the archive; members before start are skipped without reading them
+        end = self.size if end is None else end
+        index = max(0, bisect.bisect_right(self.offsets, start) - 1)
+        for entry, offset in zip(self.entries[index:], self.offsets[index:]):
+            if offset >= end:
+                break
+            header = tar_header(entry)
+            data = clip(header, offset, start, end)
+            if data:
+                yield data
+            if entry.is_dir:
+                continue
+            data_offset = offset + len(header)
+            first = max(start, data_offset) - data_offset
+            last = min(end, data_offset + entry.size) - data_offset
+            if last > first:
+                sent = 0
+                async for chunk in storage.open_read(entry.key, first, last, chunk_size):
+                    chunk = chunk[:last - first - sent]
+                    sent += len(chunk)
+                    yield chunk
+                # A file that shrank since it was listed is zero-filled to keep the layout
+                if sent < last - first:
+                    yield bytes(last - first - sent)
+            padding = clip(bytes(tar_padding(entry.size)), data_offset + entry.size, start, end)
+            if padding:
+                yield padding
+        trailer = clip(TAR_END, self.members_end, start, end)
+        if trailer:
+            yield trailer
+
+
+class ZipSink:
+    # Unseekable file object for zipfile, which then writes data descriptors after each
+    # member instead of seeking back to patch its local header
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+
+    def write(self, data) -> int:
+        self.buffer += data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def zip_info(entry: ArchiveEntry, compress_type: int) -> zipfile.ZipInfo:
+    date_time = time.localtime(entry.mtime)[:6]
+    if date_time[0] < 1980:
+        date_time = (1980, 1, 1, 0, 0, 0)
+    if entry.is_dir:
+        info = zipfile.ZipInfo(entry.name + "/", date_time)
+        info.external_attr = (stat.S_IFDIR | 0o755) << 16 | 0x10
+        return info
+    info = zipfile.ZipInfo(entry.name, date_time)
+    info.external_attr = (stat.S_IFREG | 0o644) << 16
+    info.compress_type = compress_type
+    return info
+
+
+async def zip_stream(storage: StorageBackend, entries: List[ArchiveEntry], compression: str,
+                     chunk_size: int = COPY_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    # zipfile does the encoding; whatever it wrote is handed on after every chunk, so
+    # memory stays at one chunk plus the central directory
+    compress_type = zipfile.ZIP_DEFLATED if compression == "deflate" else zipfile.ZIP_STORED
+    sink = ZipSink()
+    archive = zipfile.ZipFile(sink, "w", allowZip64=True)
+    for entry in entries:
+        info = zip_info(entry, compress_type)
+        if entry.is_dir:
+            archive.writestr(info, b"")
+        else:
+            member = archive.open(info, "w", force_zip64=entry.size >= ZIP64_THRESHOLD)
+            try:
+                async for chunk in storage.open_read(entry.key, 0, entry.size, chunk_size):
+                    # Deflate runs on the executor, stored members are a plain copy
+                    if compress_type == zipfile.ZIP_STORED:
+                        member.write(chunk)
+                    else:
+                        await storage.run(member.write, chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            finally:
+                member.close()
+        data = sink.drain()
+        if data:
+            yield data
+    archive.close()
+    yield sink.drain()
+
+
+async def compress_archive(storage: StorageBackend, chunks: AsyncIterator[bytes], encoding: str) -> AsyncIterator[bytes]:
+    compressor = create_compressor(encoding)
+    try:
+        async for chunk in chunks:
+            data = await storage.run(compressor.compress, chunk)
+            if data:
+                yield data
+    finally:
+        await chunks.aclose()
+    yield compressor.flush()
+
+
+# Streams a directory tree as tar (optionally gzip or zstd compressed) or zip, built on
+# the fly from the manifest of collect_entries. Uncompressed tar has a known length
+# and deterministic content, so it gets a strong ETag and answers single Range and
+# If-Range requests by skipping straight to the member containing the first byte.
+class ArchiveResponse(Response):
+
+    def __init__(
+            self,
+            storage: StorageBackend,
+            entries: List[ArchiveEntry],
+            filename: str,
+            archive_format: str = "tar",
+            compression: str = "none",
+            headers: Optional[dict] = None,
+            background=None
+    ):
+        self.storage = storage
+        self.entries = entries
+        self.archive_format = archive_format
+        self.compression = compression
+        extension, self.media_type = ARCHIVE_TYPES[(archive_format, compression)]
+        self.filename = filename + extension
+        self.status_code = 200
+        self.background = background
+        self.init_headers(headers)
+
+    @property
+    def seekable(self) -> bool:
+        return self.archive_format == "tar" and self.compression == "none"
+
+    def manifest_etag(self) -> str:
+        # Strong, so it must change whenever any member's bytes may have: built from each
+        # file's own validator (inode, mtime_ns and size on local disks), not whole seconds
+        digest = hashlib.sha256(f"{self.archive_format}\0{self.compression}".encode())
+        for entry in self.entries:
+            identity = entry.etag or f"{entry.size}\0{entry.mtime!r}"
+            digest.update(f"\0{entry.name}\0{int(entry.is_dir)}\0{identity}".encode())
+        return f'"{digest.hexdigest()[:32]}"'
+
+    def base_headers(self) -> list:
+        headers = [(k, v) for k, v in self.raw_headers if k not in (b"content-type", b"content-length")]
+        headers.append((b"content-type", self.media_type.encode("latin-1")))
+        quoted = quote(self.filename)
+        if quoted != self.filename:
+            disposition = f"attachment; filename*=utf-8''{quoted}"
+        else:
+            disposition = f'attachment; filename="{self.filename}"'
+        headers.append((b"content-disposition", disposition.encode("latin-1")))
+        mtimes = [entry.mtime for entry in self.entries if not entry.is_dir]
+        if mtimes:
+            headers.append((b"last-modified", formatdate(max(mtimes), usegmt=True).encode("latin-1")))
+        return headers
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        headers = self.base_headers()
+        if self.seekable:
+            await self.send_tar(scope, send, headers)
+        else:
+            headers.append((b"accept-ranges", b"none"))
+            await send({"type": "http.response.start", "status": 200, "headers": headers})
+            if self.archive_format == "zip":
+                chunks = zip_stream(self.storage, self.entries, self.compression)
+            else:
+                chunks = compress_archive(self.storage, TarLayout(self.entries).stream(self.storage), self.compression)
+            await self.send_chunks(send, chunks)
+
+        if self.background is not None:
+            await self.background()
+
+    async def send_tar(self, scope: Scope, send: Send, headers: list) -> None:
+        request_headers = Headers(scope=scope)
+        layout = await self.storage.run(TarLayout, self.entries)
+        etag = self.manifest_etag()
+        headers.append((b"accept-ranges", b"bytes"))
+        headers.append((b"etag", etag.encode("latin-1")))
+
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None and etag_matches(if_none_match, etag, weak=True):
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        start, end = 0, layout.size
+        status = 200
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if range_header is not None and (if_range is None or if_range.strip() == etag):
+            ranges = parse_range_header(range_header, layout.size)
+            if ranges == []:
+                headers.append((b"content-range", f"bytes */{layout.size}".encode("latin-1")))
+                headers.append((b"content-length", b"0"))
+                await send({"type": "http.response.start", "status": 416, "headers": headers})
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+            # Resumes need a single range; multiple ranges get the whole archive
+            if ranges is not None and len(ranges) == 1:
+                start, end = ranges[0]
+                status = 206
+                headers.append((b"content-range", f"bytes {start}-{end - 1}/{layout.size}".encode("latin-1")))
+
+        headers.append((b"content-length", str(end - start).encode("latin-1")))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        await self.send_chunks(send, layout.stream(self.storage, start, end))
+
+    @staticmethod
+    async def send_chunks(send: Send, chunks: AsyncIterator[bytes]) -> None:
+        try:
+            async for chunk in chunks:
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        finally:
+            await chunks.aclose()
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
@@ -1,4 +1,7 @@
-users_db = {}
+from backend.common.user_store import SQLiteUserStore, USER_DB_PATH
+
+# Shared by every service process through the SQLite database at USER_DB_PATH
+user_store = SQLiteUserStore(USER_DB_PATH)
 
 JWT_SECRET_KEY = "SUPER_SECRET_JWT_KEY"
 JWT_ALGORITHM = "HS256"
@@ -1,6 +1,10 @@
+import os
 import argparse
 from typing import Dict, Any, Optional
 
+DEFAULT_WORKERS = os.cpu_count() or 1
+DEFAULT_GRACEFUL_TIMEOUT = 30
+
 
 def parse_arguments() -> Dict[str, Any]:
     parser = argparse.ArgumentParser(description="Data Space Connector Data Source/Sink Backend")
@@ -9,8 +13,8 @@ def parse_arguments() -> Dict[str, Any]:
         "--log-level",
         type=str,
         choices=["debug", "info", "warning", "error", "critical"],
-        default="info",
-        help="Set logging level (default: info)"
+        default=os.environ.get("LOG_LEVEL", "info").lower(),
+        help="Set logging level (default: $LOG_LEVEL or info)"
     )
 
     parser.add_argument(
@@ -22,8 +26,8 @@ def parse_arguments() -> Dict[str, Any]:
     parser.add_argument(
         "--host",
         type=str,
-        default="127.0.0.1",
-        help="Host to bind the service (default: 127.0.0.1)"
+        default=os.environ.get("HOST", "0.0.0.0"),
+        help="Host to bind the service (default: $HOST or 0.0.0.0)"
     )
 
     parser.add_argument(
@@ -38,6 +42,35 @@ def parse_arguments() -> Dict[str, Any]:
         help="Enable detailed logging with filename and line numbers"
     )
 
+    parser.add_argument(
+        "--json-logs",
+        action="store_true",
+        default=None,
+        help="Write logs as one JSON object per line (default: $LOG_FORMAT or text)"
+    )
+
+    parser.add_argument(
+        "--mode",
+        type=str,
+        choices=["dev", "prod"],
+        default="dev",
+        help="dev: single process with auto-reload, prod: multiple workers without reload (default: dev)"
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Worker processes in prod mode (default: CPU count, {DEFAULT_WORKERS})"
+    )
+
+    parser.add_argument(
+        "--graceful-timeout",
+        type=int,
+        default=DEFAULT_GRACEFUL_TIMEOUT,
+        help=f"Seconds to drain open requests on shutdown in prod mode (default: {DEFAULT_GRACEFUL_TIMEOUT})"
+    )
+
     return vars(parser.parse_args())
 
 
@@ -54,4 +87,76 @@ def get_service_settings(service_type: str, cli_args: Optional[Dict[str, Any]] =
     if cli_args.get("port") is None:
         cli_args["port"] = default_port
 
-    return cli_args
\ No newline at end of file
+    cli_args["service"] = service_type
+
+    return cli_args
+
+
+# Settings handed to worker processes through the environment. With an app factory
+# uvicorn imports the module in each worker, which must not parse the supervisor's argv.
+SETTINGS_ENV = {
+    "log_level": "LOG_LEVEL",
+    "log_file": "LOG_FILE",
+    "host": "HOST",
+    "port": "PORT",
+    "detailed_logs": "DETAILED_LOGS",
+    "mode": "RUN_MODE",
+    "workers": "WORKERS",
+    "graceful_timeout": "GRACEFUL_TIMEOUT",
+}
+
+
+def load_service_settings(service_type: str) -> Dict[str, Any]:
+    # Same defaults as parse_arguments, read from the environment instead of argv
+    cli_args = {
+        "log_level": os.environ.get("LOG_LEVEL", "info").lower(),
+        "log_file": os.environ.get("LOG_FILE") or None,
+        "host": os.environ.get("HOST", "0.0.0.0"),
+        "port": int(os.environ["PORT"]) if os.environ.get("PORT") else None,
+        "detailed_logs": os.environ.get("DETAILED_LOGS", "false").lower() in ("1", "true", "yes"),
+        # None falls back to $LOG_FORMAT in logging_utils
+        "json_logs": None,
+        "mode": os.environ.get("RUN_MODE", "dev"),
+        "workers": int(os.environ.get("WORKERS", DEFAULT_WORKERS)),
+        "graceful_timeout": int(os.environ.get("GRACEFUL_TIMEOUT", DEFAULT_GRACEFUL_TIMEOUT)),
+    }
+    return get_service_settings(service_type, cli_args)
+
+
+def export_settings(settings: Dict[str, Any]):
+    # Inverse of load_service_settings, called before uvicorn starts the workers
+    for key, name in SETTINGS_ENV.items():
+        value = settings.get(key)
+        if value is not None:
+            os.environ[name] = str(value).lower() if isinstance(value, bool) else str(value)
+    if settings.get("json_logs") is not None:
+        os.environ["LOG_FORMAT"] = "json" if settings["json_logs"] else "text"
+
+
+def get_uvicorn_options(settings: Dict[str, Any]) -> Dict[str, Any]:
+    options = {
+        "host": settings.get("host"),
+        "port": settings.get("port"),
+        "log_level": settings.get("log_level"),
+    }
+    if settings.get("mode") != "prod":
+        options["reload"] = True
+        return options
+
+    # uvicorn binds the socket once in the supervisor and shares it with the workers,
+    # restarts workers that die or stop answering its health pings, and on SIGTERM lets
+    # each worker finish open requests for up to timeout_graceful_shutdown seconds.
+    # "auto" picks uvloop and httptools when they are installed.
+    workers = max(1, settings.get("workers") or 1)
+    if workers > 1:
+        # Inherited by the workers, which then publish metrics snapshots for /metrics to merge
+        os.environ.setdefault("METRICS_DIR", os.path.join("./data", ".internal", "metrics", settings.get("service", "service")))
+    options.update(
+        workers=workers,
+        reload=False,
+        loop="auto",
+        http="auto",
+        timeout_graceful_shutdown=settings.get("graceful_timeout"),
+        access_log=False,
+    )
+    return options
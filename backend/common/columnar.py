@@ -0,0 +1,206 @@
+# backend/common/columnar.py
+
+import os
+import json
+import posixpath
+from importlib.util import find_spec
+from typing import Dict, List, Optional
+
+from backend.common.storage import (
+    StorageBackend, LocalStorageBackend, FileStat, IOExecutor, io_executor, remove_if_exists, write_all,
+)
+
+# "parquet" or "arrow" (Arrow IPC file) to convert received tabular payloads, "none" to keep
+# only the originals. Needs the optional pyarrow package.
+COLUMNAR_FORMAT = os.environ.get("COLUMNAR_FORMAT", "none").lower()
+# Converted copies, by the key of their original plus the format's suffix
+COLUMNAR_DIR = os.environ.get("COLUMNAR_DIR", os.path.join("./data", ".internal", "columnar"))
+# Conversions running at the same time; pyarrow parses and encodes on its own threads as well
+COLUMNAR_WORKERS = int(os.environ.get("COLUMNAR_WORKERS", 2))
+# Parquet column compression (zstd, snappy, gzip, none)
+PARQUET_COMPRESSION = os.environ.get("PARQUET_COMPRESSION", "zstd")
+# JSON documents holding an array of records are parsed whole, so only up to this size
+MAX_JSON_ARRAY_SIZE = int(os.environ.get("COLUMNAR_MAX_JSON_ARRAY_SIZE", 64 * 1024 * 1024))
+# Bytes of CSV/NDJSON parsed per record batch
+READ_BLOCK_SIZE = 4 * 1024 * 1024
+
+ARTIFACT_SUFFIXES = {"parquet": ".parquet", "arrow": ".arrow"}
+ARTIFACT_MEDIA_TYPES = {"parquet": "application/vnd.apache.parquet", "arrow": "application/vnd.apache.arrow.file"}
+TABULAR_EXTENSIONS = {".csv": "csv", ".tsv": "tsv", ".ndjson": "ndjson", ".jsonl": "ndjson", ".json": "json"}
+TABULAR_MEDIA_TYPES = {
+    "text/csv": "csv",
+    "text/tab-separated-values": "tsv",
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "application/json": "json",
+}
+
+pyarrow_loaded = False
+
+
+def load_pyarrow() -> bool:
+    # Imported on first conversion only, pyarrow alone takes longer to import than the service
+    global pyarrow_loaded
+    if not pyarrow_loaded:
+        import pyarrow.csv
+        import pyarrow.json
+        import pyarrow.parquet
+        import pyarrow.ipc
+        pyarrow_loaded = True
+    return pyarrow_loaded
+
+
+def columnar_supported(format: str = COLUMNAR_FORMAT) -> bool:
+    return format in ARTIFACT_SUFFIXES and find_spec("pyarrow") is not None
+
+
+def tabular_type(key: str, content_type: Optional[str] = None) -> Optional[str]:
+    # csv, tsv, ndjson or json by file extension, else by media type; None for anything else
+    kind = TABULAR_EXTENSIONS.get(posixpath.splitext(key)[1].lower())
+    if kind is None and content_type:
+        kind = TABULAR_MEDIA_TYPES.get(content_type.split(";", 1)[0].strip().lower())
+    return kind
+
+
+def json_layout(path: str) -> str:
+    # "array" for a JSON array of records, "ndjson" for one object per line
+    with open(path, "rb") as f:
+        head = f.read(4096).lstrip()
+    return "array" if head.startswith(b"[") else "ndjson"
+
+
+def open_batches(path: str, kind: str):
+    # Returns (schema, iterable of record batches) without loading the whole file, except
+    # for JSON arrays. Column types are inferred from the first block.
+    import pyarrow as pa
+
+    if kind in ("csv", "tsv"):
+        reader = pa.csv.open_csv(
+            path,
+            read_options=pa.csv.ReadOptions(block_size=READ_BLOCK_SIZE),
+            parse_options=pa.csv.ParseOptions(delimiter="," if kind == "csv" else "\t"),
+        )
+        return reader.schema, reader
+    if kind == "json" and json_layout(path) == "array":
+        if os.path.getsize(path) > MAX_JSON_ARRAY_SIZE:
+            raise ValueError(f"JSON array larger than {MAX_JSON_ARRAY_SIZE} bytes")
+        with open(path, "rb") as f:
+            records = json.load(f)
+        if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+            raise ValueError("JSON document is not an array of objects")
+        table = pa.Table.from_pylist(records)
+        return table.schema, table.to_batches()
+    reader = pa.json.open_json(path, read_options=pa.json.ReadOptions(block_size=READ_BLOCK_SIZE))
+    return reader.schema, reader
+
+
+def convert_file(source_path: str, target_path: str, kind: str, format: str) -> Dict[str, int]:
+    # Streams the record batches of source_path into a Parquet or Arrow IPC file
+    load_pyarrow()
+    import pyarrow as pa
+
+    schema, batches = open_batches(source_path, kind)
+    if format == "parquet":
+        writer = pa.parquet.ParquetWriter(target_path, schema, compression=PARQUET_COMPRESSION)
+    else:
+        writer = pa.ipc.new_file(target_path, schema)
+    rows = 0
+    with writer:
+        for batch in batches:
+            if batch.num_rows:
+                writer.write_batch(batch)
+                rows += batch.num_rows
+    return {"rows": rows, "columns": len(schema)}
+
+
+class ColumnarStore:
+    # Parquet or Arrow copies of tabular files, on local disk like the compression cache.
+    # Conversions run on a pool of their own, so they never hold up the I/O executor. A
+    # copy only counts while it is newer than its original; a rewritten original is
+    # converted again and a stale copy is never listed or served.
+
+    def __init__(self, format: str = COLUMNAR_FORMAT, root: str = COLUMNAR_DIR,
+                 pool: Optional[IOExecutor] = None, executor: IOExecutor = io_executor):
+        self.format = format
+        self.suffix = ARTIFACT_SUFFIXES[format]
+        self.media_type = ARTIFACT_MEDIA_TYPES[format]
+        self.pool = pool or IOExecutor(COLUMNAR_WORKERS, name="columnar")
+        self.storage = LocalStorageBackend(os.path.abspath(root), executor=executor)
+
+    def artifact_key(self, key: str) -> str:
+        return key + self.suffix
+
+    def copy_to_temp(self, temp_path: str, chunks: List[bytes]):
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            for chunk in chunks:
+                write_all(fd, chunk)
+        finally:
+            os.close(fd)
+
+    async def local_source(self, source: StorageBackend, key: str, temp_path: str) -> str:
+        # pyarrow reads from a file: the original itself when it is a plain local file,
+        # a temporary copy for S3 and compressed-at-rest storage
+        path = source.local_path(key)
+        if path is not None:
+            return path
+        batch, batch_size = [], 0
+        async for chunk in source.open_read(key):
+            batch.append(chunk)
+            batch_size += len(chunk)
+            if batch_size >= READ_BLOCK_SIZE:
+                await self.storage.run(self.copy_to_temp, temp_path, batch)
+                batch, batch_size = [], 0
+        await self.storage.run(self.copy_to_temp, temp_path, batch)
+        return temp_path
+
+    async def convert(self, source: StorageBackend, key: str, content_type: Optional[str] = None) -> Optional[dict]:
+        # Converts one file; None when it is not tabular. Parse errors are raised, and
+        # leave no copy behind.
+        kind = tabular_type(key, content_type)
+        if kind is None:
+            return None
+        source_stat = await source.stat(key)
+        if source_stat is None or source_stat.is_dir or not source_stat.size:
+            return None
+
+        target_path = self.storage.path(self.artifact_key(key))
+        await self.storage.run(os.makedirs, os.path.dirname(target_path), 0o777, True)
+        temp_target = self.storage.temp_path(self.artifact_key(key))
+        temp_source = self.storage.temp_path(self.artifact_key(key))
+        try:
+            source_path = await self.local_source(source, key, temp_source)
+            result = await self.pool.run(convert_file, source_path, temp_target, kind, self.format)
+            # The original changed while it was converted: its own conversion follows
+            current = await source.stat(key)
+            if current is None or current.mtime != source_stat.mtime or current.size != source_stat.size:
+                return None
+            await self.storage.run(os.replace, temp_target, target_path)
+        finally:
+            await self.storage.run(remove_if_exists, temp_target)
+            await self.storage.run(remove_if_exists, temp_source)
+        result.update({"format": self.format, "source_type": kind})
+        return result
+
+    async def lookup(self, key: str, source_stat: FileStat) -> Optional[FileStat]:
+        artifact_stat = await self.storage.stat(self.artifact_key(key))
+        if artifact_stat is None or artifact_stat.is_dir or artifact_stat.mtime < source_stat.mtime:
+            return None
+        return artifact_stat
+
+    async def lookup_directory(self, key: str, files: List[dict]) -> Dict[str, dict]:
+        # Copies of the listed files of one directory, by name, from a single listing
+        try:
+            _, artifacts = await self.storage.list(key)
+        except FileNotFoundError:
+            return {}
+        artifacts = {entry["name"]: entry for entry in artifacts}
+        found = {}
+        for entry in files:
+            artifact = artifacts.get(entry["name"] + self.suffix)
+            if artifact is not None and entry.get("mtime") is not None and artifact["mtime"] >= entry["mtime"]:
+                found[entry["name"]] = {"format": self.format, "size": artifact["size"]}
+        return found
+
+    async def forget(self, key: str):
+        await self.storage.run(remove_if_exists, self.storage.path(self.artifact_key(key)))
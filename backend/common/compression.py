@@ -0,0 +1,610 @@
+# backend/common/compression.py
+
+import os
+import time
+import uuid
+import zlib
+import struct
+import hashlib
+import threading
+from typing import AsyncIterator, List, Optional, Tuple
+
+from backend.common.storage import (
+    StorageBackend, LocalStorageBackend, FileStat, IOExecutor, io_executor, write_all, pwrite_all,
+    remove_if_exists, iterate_fileobj, TEMP_PREFIX, WRITE_BUFFER_SIZE, COPY_CHUNK_SIZE, PayloadTooLarge,
+    EmptyPayload,
+)
+
+# Set to 0 to always send downloads uncompressed
+COMPRESS_RESPONSES = os.environ.get("COMPRESS_RESPONSES", "1") != "0"
+# Compressed copies of downloaded files, keyed by file and ETag so a changed file is never served stale
+COMPRESSION_CACHE_DIR = os.environ.get("COMPRESSION_CACHE_DIR", os.path.join("./data", ".internal", "compressed"))
+COMPRESSION_CACHE_MAX_BYTES = int(os.environ.get("COMPRESSION_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+# Smaller files are not worth a Content-Encoding
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", 6))
+ZSTD_LEVEL = int(os.environ.get("ZSTD_LEVEL", 3))
+# Set to 1 to gzip files written through CompressedStorageBackend (see below)
+COMPRESS_AT_REST = os.environ.get("COMPRESS_AT_REST", "0") == "1"
+AT_REST_SUFFIX = ".atrest.gz"
+
+# Upper bound for one piece of decoded output, so a small compressed chunk can never
+# expand into one huge buffer
+DECODE_PIECE_SIZE = 1024 * 1024
+# No zstd block decodes to more than this (RFC 8878 3.1.1.2.4)
+ZSTD_MAX_BLOCK_SIZE = 128 * 1024
+# zstd blocks fed to the decompressor per step, keeping one step's output within a piece
+ZSTD_BLOCKS_PER_STEP = max(1, DECODE_PIECE_SIZE // ZSTD_MAX_BLOCK_SIZE - 1)
+ZSTD_MAGIC = 0xFD2FB528
+ZSTD_SKIPPABLE_MAGIC = 0x184D2A50
+# Media types that compress well; everything else (archives, images, ...) is sent as-is
+COMPRESSIBLE_TYPES = (
+    "text/", "application/json", "application/xml", "application/javascript", "application/x-ndjson",
+    "application/ld+json", "application/geo+json", "application/yaml", "application/x-yaml", "image/svg+xml",
+)
+
+zstd_module = None
+zstd_loaded = False
+
+
+def load_zstd():
+    # zstd support needs the optional zstandard package; gzip always works
+    global zstd_module, zstd_loaded
+    if not zstd_loaded:
+        try:
+            import zstandard
+            zstd_module = zstandard
+        except ImportError:
+            zstd_module = None
+        zstd_loaded = True
+    return zstd_module
+
+
+class UnsupportedEncoding(Exception):
+    pass
+
+
+class DecodingError(Exception):
+    pass
+
+
+def supported_encodings() -> List[str]:
+    # In order of preference when the client accepts several with the same weight
+    if load_zstd() is not None:
+        return ["zstd", "gzip"]
+    return ["gzip"]
+
+
+def is_compressible(media_type: str) -> bool:
+    media_type = (media_type or "").split(";")[0].strip().lower()
+    return media_type.startswith(COMPRESSIBLE_TYPES) or media_type.endswith(("+json", "+xml"))
+
+
+def negotiate_encoding(accept_encoding: Optional[str], available: List[str]) -> Optional[str]:
+    # Picks the best Content-Encoding from an Accept-Encoding header (RFC 9110 12.5.3),
+    # None for identity
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if coding == "x-gzip":
+            coding = "gzip"
+        weight = 1.0
+        params = params.strip()
+        if params.lower().startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        if coding:
+            weights[coding] = weight
+    wildcard = weights.get("*", 0.0)
+    best, best_weight = None, 0.0
+    for coding in available:
+        weight = weights.get(coding, wildcard)
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+class ZstdBlockSplitter:
+    # zstd's decompressobj has no output limit: 4 bytes of an RLE block are 128 KiB of
+    # output, so a few KB can decode into gigabytes in one call. This follows the frame
+    # format (RFC 8878) just far enough to find block headers, so the decompressor can be
+    # fed a few blocks at a time and their output stays bounded. Invalid data is passed
+    # through unsplit, the decompressor reports it.
+
+    def __init__(self):
+        self.state = "magic"
+        self.header = bytearray()
+        self.needed = 4
+        self.remaining = 0
+        self.checksum = False
+
+    def parse_header(self):
+        # Called once self.needed header bytes are collected; either needs more bytes or
+        # moves on to the next state
+        header = self.header
+        if self.state == "magic":
+            magic = int.from_bytes(header[:4], "little")
+            if magic == ZSTD_MAGIC:
+                self.state, self.needed = "frame", 5
+            elif magic & 0xFFFFFFF0 == ZSTD_SKIPPABLE_MAGIC:
+                self.state, self.needed = "skippable", 8
+            else:
+                self.state = "invalid"
+            return
+        if self.state == "frame" and self.needed == 5:
+            descriptor = header[4]
+            single_segment = descriptor >> 5 & 1
+            fcs_size = (1 if single_segment else 0, 2, 4, 8)[descriptor >> 6]
+            self.checksum = bool(descriptor >> 2 & 1)
+            self.needed = 5 + (0 if single_segment else 1) + (0, 1, 2, 4)[descriptor & 3] + fcs_size
+            if self.needed > 5:
+                return
+        if self.state == "skippable":
+            self.remaining = int.from_bytes(header[4:8], "little")
+            self.next_frame()
+            return
+        if self.state == "block":
+            value = int.from_bytes(header[:3], "little")
+            self.remaining = 1 if (value >> 1 & 3) == 1 else value >> 3
+            self.state = "last_block" if value & 1 else "block"
+            self.header = bytearray()
+            self.needed = 3
+            if self.state == "last_block":
+                self.needed = 4 if self.checksum else 0
+            return
+        self.state, self.needed = "block", 3
+        self.header = bytearray()
+
+    def next_frame(self):
+        self.state, self.needed = "magic", 4
+        self.header = bytearray()
+
+    def split(self, data: bytes, max_blocks: int) -> int:
+        # Length of the prefix of data that starts at most max_blocks new blocks
+        position = 0
+        blocks = 0
+        while position < len(data):
+            if self.state == "invalid":
+                return len(data)
+            if self.remaining:
+                step = min(self.remaining, len(data) - position)
+                position += step
+                self.remaining -= step
+                continue
+            if self.state == "last_block":
+                # Body done; skip the optional checksum, then the next frame starts
+                self.remaining, self.needed = self.needed, 4
+                self.next_frame()
+                continue
+            if self.state == "block" and not self.header:
+                if blocks == max_blocks:
+                    break
+                blocks += 1
+            take = min(self.needed - len(self.header), len(data) - position)
+            self.header += data[position:position + take]
+            position += take
+            if len(self.header) == self.needed:
+                self.parse_header()
+        return position
+
+
+class Decoder:
+    # Incremental decoder for one Content-Encoding. Concatenated gzip members or zstd
+    # frames are decoded one after the other, like gunzip and zstd -d do. Output is
+    # bounded per call for both: zlib through max_length, zstd by feeding it a few
+    # blocks at a time.
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        self.pending = b""
+        # Decoded bytes not yet returned, from output_offset on
+        self.output = b""
+        self.output_offset = 0
+        # zstd input already split into blocks, left over after the end of a frame
+        self.scanned = b""
+        self.started = False
+        self.splitter = ZstdBlockSplitter() if encoding == "zstd" else None
+        self.obj = self.new_obj()
+
+    def new_obj(self):
+        if self.encoding == "gzip":
+            return zlib.decompressobj(zlib.MAX_WBITS | 16)
+        if self.encoding == "deflate":
+            return zlib.decompressobj(zlib.MAX_WBITS)
+        return load_zstd().ZstdDecompressor().decompressobj()
+
+    def has_pending(self) -> bool:
+        return bool(self.pending or self.scanned or self.output_offset < len(self.output))
+
+    def decode_zstd(self, data: bytes) -> bytes:
+        # Decodes up to ZSTD_BLOCKS_PER_STEP blocks, at most about one piece of output.
+        # Returns the input that is left.
+        if self.scanned:
+            chunk, self.scanned = self.scanned, b""
+        else:
+            size = self.splitter.split(data, ZSTD_BLOCKS_PER_STEP)
+            chunk, data = data[:size], data[size:]
+        self.output = self.obj.decompress(chunk)
+        if self.obj.eof:
+            self.scanned = self.obj.unused_data
+        return data
+
+    def decode(self, data: bytes, max_length: int = DECODE_PIECE_SIZE) -> bytes:
+        # Returns at most max_length bytes; call again with b"" while has_pending()
+        data = self.pending + data if self.pending else data
+        self.pending = b""
+        try:
+            while self.output_offset >= len(self.output) and (data or self.scanned):
+                if self.obj.eof:
+                    self.obj = self.new_obj()
+                self.started = True
+                self.output_offset = 0
+                if self.splitter is not None:
+                    data = self.decode_zstd(data)
+                else:
+                    self.output = self.obj.decompress(data, max_length)
+                    data = self.obj.unconsumed_tail or (self.obj.unused_data if self.obj.eof else b"")
+        except Exception as e:
+            raise DecodingError(f"Invalid {self.encoding} data: {e}")
+        self.pending = data
+        # Moves an offset rather than re-slicing the rest of the buffer for every piece
+        start = self.output_offset
+        self.output_offset = min(len(self.output), start + max_length)
+        if start == 0 and self.output_offset == len(self.output):
+            piece = self.output
+        else:
+            piece = self.output[start:self.output_offset]
+        if self.output_offset >= len(self.output):
+            self.output, self.output_offset = b"", 0
+        return piece
+
+    def finish(self):
+        if self.started and not self.obj.eof:
+            raise DecodingError(f"Truncated {self.encoding} data")
+
+
+def create_decoder(content_encoding: Optional[str]) -> Optional[Decoder]:
+    # None for identity; raises UnsupportedEncoding for anything we cannot decode
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding == "x-gzip":
+        encoding = "gzip"
+    if encoding in ("", "identity"):
+        return None
+    if encoding in ("gzip", "deflate") or (encoding == "zstd" and load_zstd() is not None):
+        return Decoder(encoding)
+    raise UnsupportedEncoding(f"Unsupported Content-Encoding: {content_encoding}")
+
+
+async def decode_stream(chunks: AsyncIterator[bytes], decoder: Optional[Decoder],
+                        executor: IOExecutor = io_executor) -> AsyncIterator[bytes]:
+    # Decompression runs on the executor (zlib and zstd release the GIL) and is paced by
+    # the consumer, so size limits downstream stop a compression bomb early
+    if decoder is None:
+        async for chunk in chunks:
+            yield chunk
+        return
+    async for chunk in chunks:
+        data = chunk
+        while data or decoder.has_pending():
+            piece = await executor.run(decoder.decode, data)
+            data = b""
+            if piece:
+                yield piece
+    decoder.finish()
+
+
+def open_cache_file(path: str) -> int:
+    # The cache directory is only created once something is cached
+    try:
+        return os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+
+
+def create_compressor(encoding: str):
+    if encoding == "gzip":
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    return load_zstd().ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+
+class CompressionCache:
+    # Precompressed siblings of downloaded files on local disk. The first full download
+    # of a file in an encoding compresses it on the fly and keeps the result; later
+    # downloads (including ranges of the compressed representation) are plain file
+    # sends of the cached copy. Entries are named after key and ETag, so a rewritten
+    # file gets a new entry and the old one ages out of the size-bounded cache.
+
+    def __init__(self, root: str = COMPRESSION_CACHE_DIR, max_bytes: int = COMPRESSION_CACHE_MAX_BYTES,
+                 min_size: int = COMPRESS_MIN_SIZE, executor: IOExecutor = io_executor):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.min_size = min_size
+        self.storage = LocalStorageBackend(self.root, executor=executor)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicting = False
+
+    def negotiate(self, accept_encoding: Optional[str], media_type: str, size: int) -> Tuple[bool, Optional[str]]:
+        # Returns (whether the response varies by Accept-Encoding, chosen encoding or None)
+        if size < self.min_size or not is_compressible(media_type):
+            return False, None
+        return True, negotiate_encoding(accept_encoding, supported_encodings())
+
+    @staticmethod
+    def entry_key(key: str, etag: str, encoding: str) -> str:
+        return hashlib.sha256(f"{key}\0{etag}".encode()).hexdigest() + "." + encoding
+
+    async def lookup(self, key: str, etag: str, encoding: str) -> Optional[Tuple[str, FileStat]]:
+        entry = self.entry_key(key, etag, encoding)
+        file_stat = await self.storage.stat(entry)
+        with self.lock:
+            if file_stat is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return entry, file_stat
+
+    async def compress_stream(self, key: str, etag: str, encoding: str,
+                              chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        # Yields the compressed stream and stores it in the cache once it is complete.
+        # Concurrent misses each write their own temp file; the last rename wins.
+        compressor = create_compressor(encoding)
+        tmp_path = os.path.join(self.root, f"{TEMP_PREFIX}{uuid.uuid4().hex}")
+        fd = await self.storage.run(open_cache_file, tmp_path)
+        size = 0
+        try:
+            try:
+                async for chunk in chunks:
+                    data = await self.storage.run(compressor.compress, chunk)
+                    if data:
+                        await self.storage.run(write_all, fd, data)
+                        size += len(data)
+                        yield data
+                data = compressor.flush()
+                await self.storage.run(write_all, fd, data)
+                size += len(data)
+                yield data
+            finally:
+                await self.storage.run(os.close, fd)
+            await self.storage.run(os.replace, tmp_path, os.path.join(self.root, self.entry_key(key, etag, encoding)))
+        finally:
+            await self.storage.run(remove_if_exists, tmp_path)
+        if size and self.max_bytes:
+            await self.maybe_evict()
+
+    def evict(self):
+        # Drops the least recently written entries until the cache fits max_bytes
+        entries = []
+        total = 0
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if entry.name.startswith(TEMP_PREFIX) or not entry.is_file():
+                    continue
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            remove_if_exists(path)
+            total -= size
+
+    async def maybe_evict(self):
+        with self.lock:
+            if self.evicting:
+                return
+            self.evicting = True
+        try:
+            await self.storage.run(self.evict)
+        finally:
+            with self.lock:
+                self.evicting = False
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "encodings": supported_encodings()}
+
+
+compression_cache = CompressionCache() if COMPRESS_RESPONSES else None
+
+
+# Compressed-at-rest files are ordinary gzip files named <name>.atrest.gz. The
+# uncompressed size is kept in the gzip header (FEXTRA subfield "SZ"), so listings and
+# stat() report it without decompressing anything.
+GZIP_HEADER = struct.Struct("<2sBBIBBH2sHQ")
+GZIP_HEADER_SIZE = GZIP_HEADER.size
+
+
+def gzip_header(size: int, mtime: int) -> bytes:
+    # magic, CM=deflate, FLG=FEXTRA, MTIME, XFL, OS=unix, XLEN, subfield id, length, size
+    return GZIP_HEADER.pack(b"\x1f\x8b", 8, 4, mtime & 0xFFFFFFFF, 0, 3, 12, b"SZ", 8, size)
+
+
+def read_logical_size(path: str) -> Optional[int]:
+    try:
+        with open(path, "rb") as f:
+            header = f.read(GZIP_HEADER_SIZE)
+    except FileNotFoundError:
+        return None
+    if len(header) < GZIP_HEADER_SIZE:
+        return None
+    magic, _, flags, _, _, _, _, subfield, _, size = GZIP_HEADER.unpack(header)
+    if magic != b"\x1f\x8b" or not flags & 4 or subfield != b"SZ":
+        return None
+    return size
+
+
+class CompressedStorageBackend(StorageBackend):
+    # Wraps a LocalStorageBackend and stores what is written through write_stream and
+    # write_fileobj gzip-compressed, while every read, stat and listing shows the
+    # original name, size and content. Files written uncompressed (multipart uploads,
+    # or before the mode was enabled) are served as they are. Ranges on compressed
+    # files decompress from the start of the file, so they cost O(offset).
+
+    def __init__(self, inner: LocalStorageBackend, level: int = GZIP_LEVEL):
+        super().__init__(inner.executor)
+        self.inner = inner
+        self.level = level
+        self.min_part_size = inner.min_part_size
+        self.max_parts = inner.max_parts
+
+    def stored_key(self, key: str) -> str:
+        return key + AT_REST_SUFFIX
+
+    def local_path(self, key: str) -> Optional[str]:
+        # Zero-copy only applies to files stored as-is
+        path = self.inner.local_path(key)
+        return path if path and os.path.isfile(path) else None
+
+    async def dir_version(self, key: str) -> Optional[int]:
+        return await self.inner.dir_version(key)
+
+    async def stat(self, key: str) -> Optional[FileStat]:
+        file_stat = await self.inner.stat(key)
+        if file_stat is not None:
+            return file_stat
+        file_stat = await self.inner.stat(self.stored_key(key))
+        if file_stat is None:
+            return None
+        size = await self.run(read_logical_size, self.inner.path(self.stored_key(key)))
+        if size is None:
+            return None
+        return file_stat._replace(name=file_stat.name[:-len(AT_REST_SUFFIX)], size=size)
+
+    async def list(self, key: str) -> tuple:
+        directories, files = await self.inner.list(key)
+        compressed = [entry for entry in files if entry["name"].endswith(AT_REST_SUFFIX)]
+        if not compressed:
+            return directories, files
+        base = self.inner.path(key)
+
+        def read_sizes():
+            return [read_logical_size(os.path.join(base, entry["name"])) for entry in compressed]
+
+        sizes = dict(zip((entry["name"] for entry in compressed), await self.run(read_sizes)))
+        listed = []
+        for entry in files:
+            size = sizes.get(entry["name"])
+            if size is not None:
+                entry = dict(entry, name=entry["name"][:-len(AT_REST_SUFFIX)], size=size)
+            listed.append(entry)
+        return directories, listed
+
+    async def open_read(self, key: str, start: int = 0, end: Optional[int] = None,
+                        chunk_size: int = COPY_CHUNK_SIZE):
+        if await self.inner.isfile(key):
+            async for chunk in self.inner.open_read(key, start, end, chunk_size):
+                yield chunk
+            return
+        position = 0
+        chunks = self.inner.open_read(self.stored_key(key), GZIP_HEADER_SIZE, None, chunk_size)
+        decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+        try:
+            async for chunk in chunks:
+                data = chunk
+                while data and not decoder.eof:
+                    piece = await self.run(decoder.decompress, data, chunk_size)
+                    data = decoder.unconsumed_tail
+                    piece_start, position = position, position + len(piece)
+                    if position <= start:
+                        continue
+                    if end is not None and piece_start >= end:
+                        return
+                    yield piece[max(0, start - piece_start):(end - piece_start) if end is not None else None]
+                if decoder.eof:
+                    return
+        finally:
+            await chunks.aclose()
+
+    async def write_stream(self, key: str, chunks: AsyncIterator[bytes],
+                           max_size: Optional[int] = None, allow_empty: bool = True) -> int:
+        target = self.inner.path(self.stored_key(key))
+        tmp_path = self.inner.temp_path(key)
+        fd = await self.run(os.open, tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        size = 0
+        crc = 0
+        buffer = bytearray()
+
+        def compress_and_write(data: bytes):
+            nonlocal crc
+            crc = zlib.crc32(data, crc)
+            write_all(fd, compressor.compress(data))
+
+        try:
+            try:
+                await self.run(write_all, fd, gzip_header(0, int(time.time())))
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    size += len(chunk)
+                    if max_size and size > max_size:
+                        raise PayloadTooLarge(f"Payload exceeds {max_size} bytes")
+                    buffer += chunk
+                    if len(buffer) >= WRITE_BUFFER_SIZE:
+                        await self.run(compress_and_write, bytes(buffer))
+                        buffer.clear()
+                await self.run(compress_and_write, bytes(buffer))
+                trailer = compressor.flush() + struct.pack("<II", crc, size & 0xFFFFFFFF)
+                await self.run(write_all, fd, trailer)
+                # The real size goes into the header once it is known
+                await self.run(pwrite_all, fd, gzip_header(size, int(time.time())), 0)
+            finally:
+                await self.run(os.close, fd)
+
+            if size == 0 and not allow_empty:
+                raise EmptyPayload("No data received")
+            await self.run(os.replace, tmp_path, target)
+            await self.run(remove_if_exists, self.inner.path(key))
+            return size
+        finally:
+            await self.run(remove_if_exists, tmp_path)
+
+    async def write_fileobj(self, key: str, source) -> int:
+        return await self.write_stream(key, iterate_fileobj(source, self.executor))
+
+    async def delete(self, key: str):
+        if await self.inner.isfile(key):
+            await self.inner.delete(key)
+            return
+        await self.inner.delete(self.stored_key(key))
+
+    async def mkdir(self, key: str, exist_ok: bool = True):
+        await self.inner.mkdir(key, exist_ok)
+
+    async def rmdir(self, key: str):
+        await self.inner.rmdir(key)
+
+    async def is_empty_dir(self, key: str) -> bool:
+        return await self.inner.is_empty_dir(key)
+
+    async def delete_tree(self, key: str) -> int:
+        return await self.inner.delete_tree(key)
+
+    async def create_multipart(self, key: str, size: int, part_size: int) -> dict:
+        return await self.inner.create_multipart(key, size, part_size)
+
+    async def write_part(self, token: dict, offset: int, data_chunks: AsyncIterator[bytes], length: int):
+        await self.inner.write_part(token, offset, data_chunks, length)
+
+    async def complete_multipart(self, token: dict, key: str):
+        await self.inner.complete_multipart(token, key)
+        await self.run(remove_if_exists, self.inner.path(self.stored_key(key)))
+
+    async def abort_multipart(self, token: dict):
+        await self.inner.abort_multipart(token)
+
+
+def with_compression_at_rest(storage: StorageBackend) -> StorageBackend:
+    # Applies COMPRESS_AT_REST; compressed files need pwrite and local paths, so S3 is left as-is
+    if COMPRESS_AT_REST and isinstance(storage, LocalStorageBackend):
+        return CompressedStorageBackend(storage)
+    return storage
@@ -0,0 +1,195 @@
+# backend/common/content_store.py
+
+import os
+import time
+import uuid
+import hashlib
+import threading
+from typing import AsyncIterator, NamedTuple, Optional
+
+from backend.common.storage import (
+    IOExecutor, io_executor, write_all, remove_if_exists, TEMP_PREFIX, WRITE_BUFFER_SIZE,
+    PayloadTooLarge, EmptyPayload,
+)
+
+# Set to 1 to store received payloads once per content (local storage only)
+CONTENT_ADDRESSED = os.environ.get("CONTENT_ADDRESSED", "0") == "1"
+# Must be on the same filesystem as the received files, which are hardlinks to the blobs
+CAS_DIR = os.environ.get("CAS_DIR", os.path.join("./data", ".internal", "blobs"))
+# "sha256" (default) or any other hashlib algorithm, or "blake3" with the blake3 package installed
+CAS_HASH = os.environ.get("CAS_HASH", "sha256").lower()
+# Minimum seconds between two garbage collection sweeps of the blob directory
+CAS_GC_INTERVAL = float(os.environ.get("CAS_GC_INTERVAL", 60))
+# Temp files of writers older than this (seconds) are considered abandoned and removed
+CAS_GC_GRACE = float(os.environ.get("CAS_GC_GRACE", 3600))
+
+
+class StoredContent(NamedTuple):
+    digest: str
+    size: int
+    deduplicated: bool
+
+
+def new_hasher(algorithm: str):
+    if algorithm == "blake3":
+        try:
+            from blake3 import blake3
+        except ImportError:
+            raise RuntimeError("CAS_HASH=blake3 requires the blake3 package")
+        return blake3()
+    return hashlib.new(algorithm)
+
+
+def hash_and_write(fd: int, data: bytes, hasher):
+    # hashlib and blake3 release the GIL on large buffers, so hashing stays off the event loop
+    hasher.update(data)
+    write_all(fd, data)
+
+
+class ContentStore:
+    # Payloads are hashed while they are written to a temp file, then stored once as
+    # <root>/<algorithm>/<ab>/<cd>/<hexdigest>. User-visible names are hardlinks to the
+    # blob, so reads, ranges and zero-copy sends work on them like on any other file.
+    # The reference count of a blob is its link count minus one, which the filesystem
+    # keeps exact across processes and whatever removes a name (the sink, the data
+    # source, an operator). Blobs nothing links to any more are removed by collect().
+
+    def __init__(self, root: str = CAS_DIR, algorithm: str = CAS_HASH, executor: IOExecutor = io_executor,
+                 gc_interval: float = CAS_GC_INTERVAL, gc_grace: float = CAS_GC_GRACE):
+        new_hasher(algorithm)
+        self.root = os.path.abspath(root)
+        self.algorithm = algorithm
+        self.executor = executor
+        self.gc_interval = gc_interval
+        self.gc_grace = gc_grace
+        self.blob_root = os.path.join(self.root, algorithm)
+        self.temp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(self.blob_root, exist_ok=True)
+        os.makedirs(self.temp_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.last_collect = 0.0
+        self.collecting = False
+        self.stored = 0
+        self.deduplicated = 0
+        self.deduplicated_bytes = 0
+
+    def blob_path(self, hexdigest: str) -> str:
+        return os.path.join(self.blob_root, hexdigest[:2], hexdigest[2:4], hexdigest)
+
+    def publish(self, tmp_path: str, hexdigest: str, target: str) -> bool:
+        # Makes target a hardlink to the blob of hexdigest, creating the blob from
+        # tmp_path if it is new. Returns True when the content was already stored.
+        blob = self.blob_path(hexdigest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.isdir(target):
+            raise IsADirectoryError(f"A directory exists at {target}")
+        link_tmp = os.path.join(os.path.dirname(target), f"{TEMP_PREFIX}{uuid.uuid4().hex}")
+        try:
+            while True:
+                try:
+                    # Atomically claims the digest; fails when the blob already exists
+                    os.link(tmp_path, blob)
+                    existed = False
+                except FileExistsError:
+                    existed = True
+                try:
+                    os.link(blob, link_tmp)
+                    break
+                except FileNotFoundError:
+                    # Collected between the two links, store our copy instead
+                    continue
+            os.replace(link_tmp, target)
+            return existed
+        finally:
+            remove_if_exists(link_tmp)
+
+    async def write_stream(self, target: str, chunks: AsyncIterator[bytes],
+                           max_size: Optional[int] = None, allow_empty: bool = True) -> StoredContent:
+        # Same contract as LocalStorageBackend.write_stream: target only appears once
+        # the whole payload is stored, and replaces whatever was there before
+        hasher = new_hasher(self.algorithm)
+        tmp_path = os.path.join(self.temp_dir, f"{TEMP_PREFIX}{uuid.uuid4().hex}")
+        fd = await self.executor.run(os.open, tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o444)
+        size = 0
+        buffer = bytearray()
+        try:
+            try:
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    size += len(chunk)
+                    if max_size and size > max_size:
+                        raise PayloadTooLarge(f"Payload exceeds {max_size} bytes")
+                    buffer += chunk
+                    if len(buffer) >= WRITE_BUFFER_SIZE:
+                        await self.executor.run(hash_and_write, fd, bytes(buffer), hasher)
+                        buffer.clear()
+                if buffer:
+                    await self.executor.run(hash_and_write, fd, bytes(buffer), hasher)
+            finally:
+                await self.executor.run(os.close, fd)
+
+            if size == 0 and not allow_empty:
+                raise EmptyPayload("No data received")
+            hexdigest = hasher.hexdigest()
+            existed = await self.executor.run(self.publish, tmp_path, hexdigest, target)
+        finally:
+            await self.executor.run(remove_if_exists, tmp_path)
+
+        with self.lock:
+            self.stored += 1
+            if existed:
+                self.deduplicated += 1
+                self.deduplicated_bytes += size
+        return StoredContent(f"{self.algorithm}:{hexdigest}", size, existed)
+
+    def collect(self) -> dict:
+        # Removes blobs no name links to any more, and temp files abandoned by crashed
+        # writers. A writer that finds its blob gone before linking it simply stores
+        # its own copy again (see publish), so blobs need no grace period.
+        now = time.time()
+        removed = 0
+        removed_bytes = 0
+        blobs = 0
+        for directory, _, filenames in os.walk(self.root):
+            temp = directory == self.temp_dir
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if temp:
+                    # Every write updates the ctime, so only stalled or orphaned files are old
+                    if now - st.st_ctime < self.gc_grace:
+                        continue
+                elif st.st_nlink > 1:
+                    blobs += 1
+                    continue
+                remove_if_exists(path)
+                removed += 1
+                removed_bytes += st.st_size
+        return {"blobs": blobs, "removed": removed, "removed_bytes": removed_bytes}
+
+    async def maybe_collect(self, force: bool = False) -> Optional[dict]:
+        # Sweeps at most once per gc_interval per process, and never twice at a time
+        with self.lock:
+            if self.collecting or (not force and time.monotonic() - self.last_collect < self.gc_interval):
+                return None
+            self.collecting = True
+        try:
+            return await self.executor.run(self.collect)
+        finally:
+            with self.lock:
+                self.collecting = False
+                self.last_collect = time.monotonic()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "algorithm": self.algorithm,
+                "stored": self.stored,
+                "deduplicated": self.deduplicated,
+                "deduplicated_bytes": self.deduplicated_bytes,
+            }
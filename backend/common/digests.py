@@ -0,0 +1,326 @@
+# backend/common/digests.py
+
+import os
+import zlib
+import base64
+import asyncio
+import hashlib
+import sqlite3
+import posixpath
+import threading
+from importlib.util import find_spec
+from typing import AsyncIterator, BinaryIO, Dict, Iterable, List, Optional
+
+from backend.common.storage import FileStat, IOExecutor, io_executor, normalize_key, WRITE_BUFFER_SIZE
+
+# Set to 0 to stop computing and storing digests; digests sent by clients are still verified
+DIGESTS_ENABLED = os.environ.get("DIGESTS_ENABLED", "1") != "0"
+# Shared by both services and all their workers, keyed like the metadata index
+DIGEST_DB_PATH = os.environ.get("DIGEST_DB_PATH", os.path.join("./data", ".internal", "digests.db"))
+# Digests computed for every stored file, by their HTTP names (RFC 9530). "crc32c" needs the
+# optional crc32c package; the default falls back to zlib's CRC-32 without it.
+DIGEST_ALGORITHMS = [
+    name.strip().lower()
+    for name in os.environ.get(
+        "DIGEST_ALGORITHMS", "sha-256," + ("crc32c" if find_spec("crc32c") is not None else "crc32")
+    ).split(",")
+    if name.strip()
+]
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS digests (
+        key TEXT PRIMARY KEY NOT NULL,
+        parent TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime REAL NOT NULL,
+        digests TEXT NOT NULL
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS digests_parent ON digests (parent)",
+)
+
+UPSERT_DIGESTS = """
+INSERT INTO digests (key, parent, size, mtime, digests) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (key) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, digests = excluded.digests
+"""
+
+
+class DigestMismatch(Exception):
+    def __init__(self, algorithm: str):
+        super().__init__(f"{algorithm} digest does not match the received data")
+        self.algorithm = algorithm
+
+
+class CRC32:
+    # hashlib-like wrapper; CRCs are sent as 4 big-endian bytes, like S3 checksums
+
+    def __init__(self, function):
+        self.function = function
+        self.value = 0
+
+    def update(self, data: bytes):
+        self.value = self.function(data, self.value)
+
+    def digest(self) -> bytes:
+        return (self.value & 0xFFFFFFFF).to_bytes(4, "big")
+
+
+def new_hasher(algorithm: str):
+    if algorithm == "sha-256":
+        return hashlib.sha256()
+    if algorithm == "sha-512":
+        return hashlib.sha512()
+    if algorithm == "md5":
+        return hashlib.md5()
+    if algorithm == "crc32":
+        return CRC32(zlib.crc32)
+    if algorithm == "crc32c":
+        try:
+            import crc32c
+        except ImportError:
+            raise RuntimeError("The crc32c digest requires the crc32c package")
+        return CRC32(crc32c.crc32c)
+    raise ValueError(f"Unsupported digest algorithm: {algorithm}")
+
+
+def is_supported(algorithm: str) -> bool:
+    return algorithm in ("sha-256", "sha-512", "md5", "crc32") or (
+        algorithm == "crc32c" and find_spec("crc32c") is not None)
+
+
+class Digester:
+    # Hashes one stream with several algorithms at once. update() is called from the
+    # I/O executor; hashlib and zlib release the GIL on large buffers.
+
+    def __init__(self, algorithms: Iterable[str]):
+        self.hashers = {}
+        for algorithm in algorithms:
+            if algorithm not in self.hashers:
+                self.hashers[algorithm] = new_hasher(algorithm)
+
+    def update(self, data: bytes):
+        for hasher in self.hashers.values():
+            hasher.update(data)
+
+    def verify(self, expected: Dict[str, bytes]):
+        for algorithm, value in expected.items():
+            if self.hashers[algorithm].digest() != value:
+                raise DigestMismatch(algorithm)
+
+    def stored(self) -> Dict[str, str]:
+        # Hex digests of the configured algorithms, as persisted and returned in JSON
+        return {algorithm: hasher.digest().hex() for algorithm, hasher in self.hashers.items()
+                if algorithm in DIGEST_ALGORITHMS}
+
+
+def new_digester(expected: Optional[Dict[str, bytes]] = None) -> Optional[Digester]:
+    # None when there is nothing to compute
+    algorithms = (DIGEST_ALGORITHMS if DIGESTS_ENABLED else []) + list(expected or {})
+    return Digester(algorithms) if algorithms else None
+
+
+def decode_digest_value(value: str) -> bytes:
+    value = value.strip()
+    if value.startswith(":") and value.endswith(":") and len(value) >= 2:
+        value = value[1:-1]
+    try:
+        return base64.b64decode(value, validate=True)
+    except ValueError:
+        raise ValueError(f"Invalid digest value: {value}")
+
+
+def parse_digest_field(value: str) -> Dict[str, bytes]:
+    # Repr-Digest/Content-Digest (RFC 9530, "sha-256=:<base64>:") and the older Digest
+    # header (RFC 3230, "SHA-256=<base64>"). Unsupported algorithms are ignored.
+    digests = {}
+    for member in value.split(","):
+        member = member.split(";", 1)[0].strip()
+        if not member:
+            continue
+        algorithm, sep, encoded = member.partition("=")
+        if not sep:
+            raise ValueError(f"Invalid digest field: {member}")
+        algorithm = algorithm.strip().lower()
+        if algorithm == "sha256":
+            algorithm = "sha-256"
+        if is_supported(algorithm):
+            digests[algorithm] = decode_digest_value(encoded)
+    return digests
+
+
+def expected_digests(headers) -> Dict[str, bytes]:
+    # Digests a client sent along with a body; they always refer to the bytes as sent,
+    # i.e. before any Content-Encoding is decoded. Raises ValueError when malformed.
+    expected = {}
+    for name in ("digest", "content-digest", "repr-digest"):
+        value = headers.get(name)
+        if value:
+            expected.update(parse_digest_field(value))
+    content_md5 = headers.get("content-md5")
+    if content_md5:
+        expected["md5"] = decode_digest_value(content_md5)
+    return expected
+
+
+def digest_headers(digests: Dict[str, str]) -> Dict[str, str]:
+    # Response headers for stored hex digests: Repr-Digest and the older Digest
+    encoded = {algorithm: base64.b64encode(bytes.fromhex(value)).decode() for algorithm, value in digests.items()}
+    return {
+        "repr-digest": ", ".join(f"{algorithm}=:{value}:" for algorithm, value in encoded.items()),
+        "digest": ",".join(f"{algorithm}={value}" for algorithm, value in encoded.items()),
+    }
+
+
+def decode_row(encoded: str) -> Dict[str, str]:
+    return dict(item.split("=", 1) for item in encoded.split(",") if item)
+
+
+async def digest_stream(chunks: AsyncIterator[bytes], digester: Digester, executor: IOExecutor = io_executor,
+                        expected: Optional[Dict[str, bytes]] = None) -> AsyncIterator[bytes]:
+    # Passes chunks through, coalesced to WRITE_BUFFER_SIZE, while hashing them on the
+    # executor. A buffer is hashed while the consumer writes it, so hashing overlaps
+    # the disk write instead of adding to it. A mismatch with expected is raised after
+    # the last chunk, which aborts the consumer's write before anything is published.
+    pending = None
+    buffer = bytearray()
+    try:
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            buffer += chunk
+            if len(buffer) >= WRITE_BUFFER_SIZE:
+                data = bytes(buffer)
+                buffer.clear()
+                if pending is not None:
+                    await pending
+                pending = asyncio.ensure_future(executor.run(digester.update, data))
+                yield data
+        if pending is not None:
+            await pending
+            pending = None
+        if buffer:
+            data = bytes(buffer)
+            await executor.run(digester.update, data)
+            if expected:
+                digester.verify(expected)
+            yield data
+        elif expected:
+            digester.verify(expected)
+    finally:
+        if pending is not None:
+            await asyncio.gather(pending, return_exceptions=True)
+
+
+class DigestingReader:
+    # File object wrapper for write_fileobj: hashes what the backend reads and checks
+    # expected at EOF, before the backend renames the copy into place
+    def __init__(self, source: BinaryIO, digester: Digester, expected: Optional[Dict[str, bytes]] = None):
+        self.source = source
+        self.digester = digester
+        self.expected = expected
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.source.read(size)
+        if data:
+            self.digester.update(data)
+        elif self.expected:
+            self.digester.verify(self.expected)
+        return data
+
+
+class DigestStore:
+    # Digests of stored files in SQLite (WAL mode, one connection per thread). Every row
+    # carries the size and mtime the file had when it was hashed, and is only returned
+    # while the file still has both, so files changed behind the services' back simply
+    # have no digest. Keys are relative to the data root; root_key works as in
+    # MetadataIndex.
+
+    def __init__(self, path: str = DIGEST_DB_PATH, root_key: str = "", executor: IOExecutor = io_executor):
+        self.path = path
+        self.root_key = normalize_key(root_key)
+        self.executor = executor
+        self.local = threading.local()
+        self.schema_lock = threading.Lock()
+        self.schema_ready = False
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, cached_statements=64)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            with self.schema_lock:
+                if not self.schema_ready:
+                    for statement in SCHEMA:
+                        conn.execute(statement)
+                    self.schema_ready = True
+            self.local.conn = conn
+        return conn
+
+    def index_key(self, key: str) -> str:
+        key = normalize_key(key)
+        if not self.root_key:
+            return key
+        return posixpath.join(self.root_key, key) if key else self.root_key
+
+    def put(self, key: str, file_stat: FileStat, digests: Dict[str, str]):
+        index_key = self.index_key(key)
+        encoded = ",".join(f"{algorithm}={value}" for algorithm, value in digests.items())
+        conn = self.connection()
+        conn.execute(UPSERT_DIGESTS, (index_key, posixpath.dirname(index_key), file_stat.size, file_stat.mtime, encoded))
+
+    def get(self, key: str, size: int, mtime: float) -> Optional[Dict[str, str]]:
+        row = self.connection().execute(
+            "SELECT size, mtime, digests FROM digests WHERE key = ?", (self.index_key(key),)
+        ).fetchone()
+        if row is None or row[0] != size or row[1] != mtime:
+            return None
+        return decode_row(row[2])
+
+    def get_directory(self, key: str, files: List[dict]) -> Dict[str, Dict[str, str]]:
+        # Digests of the listed files of one directory, by name, in a single query
+        current = {entry["name"]: (entry["size"], entry.get("mtime")) for entry in files}
+        rows = self.connection().execute(
+            "SELECT key, size, mtime, digests FROM digests WHERE parent = ?", (self.index_key(key),)
+        )
+        found = {}
+        for index_key, size, mtime, encoded in rows:
+            name = posixpath.basename(index_key)
+            if current.get(name) == (size, mtime):
+                found[name] = decode_row(encoded)
+        return found
+
+    def remove(self, keys: List[str]):
+        # Keys and, for directories, everything below them
+        conn = self.connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for key in keys:
+                index_key = self.index_key(key)
+                conn.execute("DELETE FROM digests WHERE key = ?", (index_key,))
+                conn.execute("DELETE FROM digests WHERE key >= ? AND key < ?",
+                             (index_key + "/", index_key + "/\U0010ffff"))
+
+    async def record(self, key: str, file_stat: Optional[FileStat], digests: Dict[str, str]):
+        # file_stat is taken right after the write; should another write of the same key
+        # land in between, the next write of that key corrects the row
+        if file_stat is not None and not file_stat.is_dir and digests:
+            await self.executor.run(self.put, key, file_stat, digests)
+
+    async def lookup(self, key: str, file_stat: FileStat) -> Optional[Dict[str, str]]:
+        return await self.executor.run(self.get, key, file_stat.size, file_stat.mtime)
+
+    async def lookup_directory(self, key: str, files: List[dict]) -> Dict[str, Dict[str, str]]:
+        if not files:
+            return {}
+        return await self.executor.run(self.get_directory, key, files)
+
+    async def forget(self, *keys: str):
+        keys = [key for key in dict.fromkeys(normalize_key(key) for key in keys) if key]
+        if keys:
+            await self.executor.run(self.remove, keys)
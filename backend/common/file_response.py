@@ -0,0 +1,342 @@
+# backend/common/file_response.py
+
+import os
+import secrets
+from email.utils import formatdate, parsedate_to_datetime
+from mimetypes import guess_type
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+from backend.common.storage import StorageBackend, FileStat
+from backend.common.compression import CompressionCache
+from backend.common.digests import digest_headers
+
+# Requests asking for more ranges than this are answered with the full file
+MAX_RANGES = 16
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+
+def make_etag(file_stat: FileStat) -> str:
+    # Backends provide a strong validator; the fallback changes with every rewrite too
+    if file_stat.etag:
+        return file_stat.etag
+    return f'"{int(file_stat.mtime * 1e9):x}-{file_stat.size:x}"'
+
+
+def parse_range_header(range_header: str, file_size: int) -> Optional[List[Tuple[int, int]]]:
+    # Returns half-open (start, end) ranges, [] when no range is satisfiable and
+    # None when the header is malformed and must be ignored (RFC 9110 14.2).
+    units, _, specs = range_header.partition("=")
+    if units.strip().lower() != "bytes" or not specs:
+        return None
+
+    ranges = []
+    for spec in specs.split(","):
+        spec = spec.strip()
+        if not spec:
+            continue
+        first, sep, last = spec.partition("-")
+        first, last = first.strip(), last.strip()
+        if not sep or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+
+        if not first:
+            if not last:
+                return None
+            suffix = int(last)
+            if suffix == 0:
+                continue
+            ranges.append((max(0, file_size - suffix), file_size))
+            continue
+
+        start = int(first)
+        end = int(last) + 1 if last else file_size
+        if last and end <= start:
+            return None
+        if start >= file_size:
+            continue
+        ranges.append((start, min(end, file_size)))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    # Coalesce overlapping or adjacent ranges so we never send the same bytes twice
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def etag_matches(header_value: str, etag: str, weak: bool) -> bool:
+    for candidate in header_value.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if weak and candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def not_modified_since(header_value: str, file_stat: FileStat) -> bool:
+    try:
+        since = parsedate_to_datetime(header_value).timestamp()
+    except (TypeError, ValueError):
+        return False
+    return int(file_stat.mtime) <= since
+
+
+# FileResponse replacement shared by the download endpoints: strong ETags, 304 for
+# If-None-Match/If-Modified-Since, Range/If-Range with single and multipart/byteranges
+# answers. Files of a local backend go through os.sendfile via the ASGI zero-copy
+# extension when the server offers it, or os.pread on the storage I/O executor; other
+# backends are streamed with ranged reads. With a CompressionCache, compressible files
+# are sent in the best encoding the client accepts, from the cache when possible.
+# Stored digests of the file go out as Repr-Digest/Digest on identity responses only,
+# since they describe the uncompressed bytes.
+class RangeFileResponse(Response):
+    chunk_size = 1024 * 1024
+
+    def __init__(
+            self,
+            storage: StorageBackend,
+            key: str,
+            file_stat: Optional[FileStat] = None,
+            filename: Optional[str] = None,
+            media_type: Optional[str] = None,
+            headers: Optional[dict] = None,
+            background=None,
+            compression: Optional[CompressionCache] = None,
+            digests: Optional[dict] = None
+    ):
+        self.storage = storage
+        self.key = key
+        self.filename = filename
+        self.media_type = media_type or guess_type(filename or key)[0] or "application/octet-stream"
+        self.status_code = 200
+        self.file_stat = file_stat
+        self.background = background
+        self.compression = compression
+        self.digests = digests
+        self.init_headers(headers)
+
+    def base_headers(self, file_stat: FileStat, etag: str) -> List[Tuple[bytes, bytes]]:
+        headers = [(k, v) for k, v in self.raw_headers if k not in (b"content-type", b"content-length")]
+        headers.append((b"accept-ranges", b"bytes"))
+        headers.append((b"etag", etag.encode("latin-1")))
+        headers.append((b"last-modified", formatdate(file_stat.mtime, usegmt=True).encode("latin-1")))
+        if self.filename is not None:
+            quoted = quote(self.filename)
+            if quoted != self.filename:
+                disposition = f"attachment; filename*=utf-8''{quoted}"
+            else:
+                disposition = f'attachment; filename="{self.filename}"'
+            headers.append((b"content-disposition", disposition.encode("latin-1")))
+        return headers
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        file_stat = self.file_stat
+        if file_stat is None:
+            file_stat = await self.storage.stat(self.key)
+        if file_stat is None or file_stat.is_dir:
+            raise RuntimeError(f"File {self.key} is not a file.")
+
+        request_headers = Headers(scope=scope)
+        header_only = scope["method"].upper() == "HEAD"
+        file_size = file_stat.size
+        etag = make_etag(file_stat)
+        headers = self.base_headers(file_stat, etag)
+
+        if self.compression is not None:
+            varies, encoding = self.compression.negotiate(request_headers.get("accept-encoding"), self.media_type, file_size)
+            if varies:
+                headers.append((b"vary", b"Accept-Encoding"))
+            if encoding is not None and await self.send_encoded(scope, receive, send, request_headers, file_stat, etag, encoding):
+                if self.background is not None:
+                    await self.background()
+                return
+
+        if self.digests:
+            headers.extend((name.encode("latin-1"), value.encode("latin-1"))
+                           for name, value in digest_headers(self.digests).items())
+
+        if_none_match = request_headers.get("if-none-match")
+        if_modified_since = request_headers.get("if-modified-since")
+        if (if_none_match is not None and etag_matches(if_none_match, etag, weak=True)) or (
+                if_none_match is None and if_modified_since and not_modified_since(if_modified_since, file_stat)):
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        ranges = None
+        range_header = request_headers.get("range")
+        if range_header is not None and self.if_range_allows(request_headers.get("if-range"), etag, file_stat):
+            ranges = parse_range_header(range_header, file_size)
+            if ranges == []:
+                headers.append((b"content-range", f"bytes */{file_size}".encode("latin-1")))
+                headers.append((b"content-length", b"0"))
+                await send({"type": "http.response.start", "status": 416, "headers": headers})
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+
+        content_type = self.media_type.encode("latin-1")
+        if not ranges:
+            headers.append((b"content-type", content_type))
+            headers.append((b"content-length", str(file_size).encode("latin-1")))
+            await send({"type": "http.response.start", "status": 200, "headers": headers})
+            segments = [(None, 0, file_size)]
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            headers.append((b"content-type", content_type))
+            headers.append((b"content-range", f"bytes {start}-{end - 1}/{file_size}".encode("latin-1")))
+            headers.append((b"content-length", str(end - start).encode("latin-1")))
+            await send({"type": "http.response.start", "status": 206, "headers": headers})
+            segments = [(None, start, end)]
+        else:
+            boundary = secrets.token_hex(13)
+            segments = []
+            for start, end in ranges:
+                part_header = (
+                    f"--{boundary}\r\n"
+                    f"Content-Type: {self.media_type}\r\n"
+                    f"Content-Range: bytes {start}-{end - 1}/{file_size}\r\n\r\n"
+                ).encode("latin-1")
+                segments.append((part_header, start, end))
+            trailer = f"\r\n--{boundary}--\r\n".encode("latin-1")
+            content_length = sum(len(h) + (e - s) for h, s, e in segments) + 2 * (len(segments) - 1) + len(trailer)
+            headers.append((b"content-type", f"multipart/byteranges; boundary={boundary}".encode("latin-1")))
+            headers.append((b"content-length", str(content_length).encode("latin-1")))
+            await send({"type": "http.response.start", "status": 206, "headers": headers})
+            # Each part after the first is separated from the previous body by CRLF
+            segments = [
+                ((b"\r\n" if i else b"") + h, s, e) for i, (h, s, e) in enumerate(segments)
+            ] + [(trailer, 0, 0)]
+
+        if header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        else:
+            zerocopy = ZEROCOPY_EXTENSION in scope.get("extensions", {})
+            await self.send_segments(send, segments, zerocopy)
+
+        if self.background is not None:
+            await self.background()
+
+    async def send_encoded(self, scope: Scope, receive: Receive, send: Send, request_headers: Headers,
+                           file_stat: FileStat, etag: str, encoding: str) -> bool:
+        # Sends the compressed representation, which has its own strong ETag. Returns
+        # False when it has to be sent uncompressed instead: ranges are only served
+        # from a cached copy, since offsets refer to the compressed bytes.
+        encoded_etag = f'{etag[:-1]}-{encoding}"' if etag.endswith('"') else f'"{etag}-{encoding}"'
+        extra_headers = {
+            key.decode("latin-1"): value.decode("latin-1")
+            for key, value in self.raw_headers if key not in (b"content-type", b"content-length")
+        }
+        extra_headers.update({"content-encoding": encoding, "vary": "Accept-Encoding"})
+
+        cached = await self.compression.lookup(self.key, etag, encoding)
+        if cached is not None:
+            entry, cached_stat = cached
+            response = RangeFileResponse(
+                self.compression.storage,
+                entry,
+                cached_stat._replace(etag=encoded_etag, mtime=file_stat.mtime),
+                filename=self.filename,
+                media_type=self.media_type,
+                headers=extra_headers,
+            )
+            await response(scope, receive, send)
+            return True
+
+        if request_headers.get("range") is not None:
+            return False
+
+        headers = self.base_headers(file_stat, encoded_etag)
+        headers.extend([(b"content-encoding", encoding.encode("latin-1")), (b"vary", b"Accept-Encoding")])
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None and etag_matches(if_none_match, encoded_etag, weak=True):
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return True
+
+        # Length unknown until compressed, so the body goes out chunked
+        headers.append((b"content-type", self.media_type.encode("latin-1")))
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return True
+
+        stream = self.compression.compress_stream(self.key, etag, encoding, self.storage.open_read(self.key))
+        try:
+            async for data in stream:
+                if data:
+                    await send({"type": "http.response.body", "body": data, "more_body": True})
+        finally:
+            await stream.aclose()
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+        return True
+
+    @staticmethod
+    def if_range_allows(if_range: Optional[str], etag: str, file_stat: FileStat) -> bool:
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            # If-Range requires a strong comparison
+            return if_range == etag
+        try:
+            return parsedate_to_datetime(if_range).timestamp() == int(file_stat.mtime)
+        except (TypeError, ValueError):
+            return False
+
+    async def send_segments(self, send: Send, segments, zerocopy: bool) -> None:
+        path = self.storage.local_path(self.key)
+        if path is None:
+            await self.send_streamed_segments(send, segments)
+            return
+
+        fd = await self.storage.run(os.open, path, os.O_RDONLY)
+        try:
+            for prefix, start, end in segments:
+                if prefix:
+                    await send({"type": "http.response.body", "body": prefix, "more_body": True})
+                if zerocopy and end > start:
+                    # Let the server hand the range to os.sendfile
+                    await send({
+                        "type": ZEROCOPY_EXTENSION,
+                        "file": fd,
+                        "offset": start,
+                        "count": end - start,
+                        "more_body": True,
+                    })
+                    continue
+                position = start
+                while position < end:
+                    chunk = await self.storage.run(os.pread, fd, min(self.chunk_size, end - position), position)
+                    if not chunk:
+                        raise RuntimeError(f"File {self.key} was truncated while sending.")
+                    position += len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            os.close(fd)
+
+    async def send_streamed_segments(self, send: Send, segments) -> None:
+        for prefix, start, end in segments:
+            if prefix:
+                await send({"type": "http.response.body", "body": prefix, "more_body": True})
+            if end <= start:
+                continue
+            sent = 0
+            async for chunk in self.storage.open_read(self.key, start, end, self.chunk_size):
+                sent += len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            if sent != end - start:
+                raise RuntimeError(f"File {self.key} was truncated while sending.")
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
@@ -0,0 +1,388 @@
+# backend/common/job_queue.py
+
+import os
+import json
+import time
+import random
+import socket
+import asyncio
+import logging
+import sqlite3
+import threading
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from backend.common.storage import IOExecutor, io_executor
+from backend.common.metrics import jobs_enqueued, jobs_processed, jobs_running, job_duration, job_queue_lag
+
+logger = logging.getLogger("common.job_queue")
+
+# Set to 0 to run post-receive work as plain background tasks: no retries, lost on restart
+JOB_QUEUE_ENABLED = os.environ.get("JOB_QUEUE_ENABLED", "1") != "0"
+# Shared by all worker processes of the service; each claims jobs from it
+JOB_QUEUE_PATH = os.environ.get("JOB_QUEUE_PATH", os.path.join("./data", ".internal", "jobs.db"))
+# Jobs running at the same time per worker process
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+# Attempts per job, including the first one, before it is marked failed
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 5))
+# Delay before the first retry in seconds, doubled per attempt up to JOB_RETRY_MAX_DELAY
+JOB_RETRY_DELAY = float(os.environ.get("JOB_RETRY_DELAY", 2))
+JOB_RETRY_MAX_DELAY = float(os.environ.get("JOB_RETRY_MAX_DELAY", 600))
+# A running job is extended every third of this; when its process dies, the job is
+# claimed again once the lease has run out
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", 120))
+# How often idle workers look for jobs enqueued by other processes or due for a retry;
+# jobs enqueued in the same process start right away
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 1))
+# Finished and failed jobs are kept this long for the /jobs API
+JOB_RETENTION_SECONDS = float(os.environ.get("JOB_RETENTION_SECONDS", 7 * 24 * 3600))
+PURGE_INTERVAL = 3600
+MAX_ERROR_LENGTH = 2000
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        dedupe_key TEXT,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        run_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        lease_until REAL,
+        worker TEXT,
+        last_error TEXT,
+        result TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, run_at)",
+    "CREATE INDEX IF NOT EXISTS jobs_dedupe ON jobs (kind, dedupe_key) WHERE status = 'queued'",
+)
+
+JOB_COLUMNS = ("id, kind, payload, status, attempts, max_attempts, created_at, run_at, started_at, finished_at, "
+               "last_error, result")
+JOB_STATUSES = ("queued", "running", "done", "failed")
+
+Handler = Callable[[dict], Awaitable[Optional[dict]]]
+
+
+class PermanentJobError(Exception):
+    # Raised by handlers for failures a retry cannot fix; the job fails right away
+    pass
+
+
+def retry_delay(attempts: int) -> float:
+    # Exponential backoff with jitter, so jobs that failed together do not retry together
+    delay = min(JOB_RETRY_MAX_DELAY, JOB_RETRY_DELAY * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def decode_job(row: tuple) -> dict:
+    job = dict(zip((column.strip() for column in JOB_COLUMNS.split(",")), row))
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+    return job
+
+
+class JobQueue:
+    # Durable job queue in SQLite (WAL mode, one connection per thread, like the digest
+    # store). Jobs are claimed in a write transaction and leased to one worker, so any
+    # number of processes can work on the same database. Each process only claims the
+    # kinds it has a handler for. A job whose handler raises is retried with backoff
+    # until max_attempts; a job whose process dies is claimed again after its lease.
+
+    def __init__(self, path: str = JOB_QUEUE_PATH, workers: int = JOB_WORKERS, executor: IOExecutor = io_executor):
+        self.path = path
+        self.workers = max(1, workers)
+        self.executor = executor
+        self.handlers: Dict[str, Handler] = {}
+        self.local = threading.local()
+        self.schema_lock = threading.Lock()
+        self.schema_ready = False
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.tasks: List[asyncio.Task] = []
+        self.wakeup: Optional[asyncio.Event] = None
+        self.running = 0
+        self.last_purge = 0.0
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, cached_statements=64)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            with self.schema_lock:
+                if not self.schema_ready:
+                    for statement in SCHEMA:
+                        conn.execute(statement)
+                    self.schema_ready = True
+            self.local.conn = conn
+        return conn
+
+    def register(self, kind: str, handler: Handler):
+        self.handlers[kind] = handler
+
+    def insert(self, kind: str, payload: dict, dedupe_key: Optional[str], max_attempts: int, delay: float) -> int:
+        # A job still waiting with the same kind and dedupe_key covers the new one
+        now = time.time()
+        conn = self.connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if dedupe_key is not None:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE kind = ? AND dedupe_key = ? AND status = 'queued'", (kind, dedupe_key)
+                ).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE jobs SET payload = ? WHERE id = ?", (json.dumps(payload), row[0]))
+                    return row[0]
+            cursor = conn.execute(
+                "INSERT INTO jobs (kind, dedupe_key, payload, status, max_attempts, created_at, run_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (kind, dedupe_key, json.dumps(payload), max_attempts, now, now + delay),
+            )
+            return cursor.lastrowid
+
+    def due(self, kinds: Tuple[str, ...], now: float) -> bool:
+        # Read-only check, so idle workers of all processes polling do not take the write lock
+        marks = ",".join("?" * len(kinds))
+        row = self.connection().execute(
+            f"SELECT 1 FROM jobs WHERE kind IN ({marks}) AND "
+            f"((status = 'queued' AND run_at <= ?) OR (status = 'running' AND lease_until < ?)) LIMIT 1",
+            (*kinds, now, now),
+        ).fetchone()
+        return row is not None
+
+    def claim(self, kinds: Tuple[str, ...]) -> Optional[Tuple[int, str, dict, int, int, float]]:
+        # Next due job as (id, kind, payload, attempt, max_attempts, waited seconds)
+        now = time.time()
+        if not self.due(kinds, now):
+            return None
+        marks = ",".join("?" * len(kinds))
+        lease_until = now + JOB_LEASE_SECONDS
+        conn = self.connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Jobs that took their process down on every attempt are not claimed again
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, lease_until = NULL, "
+                "last_error = 'Worker lost while running the job' "
+                "WHERE status = 'running' AND lease_until < ? AND attempts >= max_attempts",
+                (now, now),
+            )
+            row = conn.execute(
+                f"SELECT id, kind, payload, attempts, max_attempts, "
+                f"CASE status WHEN 'queued' THEN run_at ELSE lease_until END FROM jobs "
+                f"WHERE kind IN ({marks}) AND ((status = 'queued' AND run_at <= ?) OR "
+                f"(status = 'running' AND lease_until < ?)) ORDER BY run_at, id LIMIT 1",
+                (*kinds, now, now),
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, kind, payload, attempts, max_attempts, since = row
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = ?, started_at = ?, lease_until = ?, worker = ? "
+                "WHERE id = ?",
+                (attempts + 1, now, lease_until, self.worker_id, job_id),
+            )
+        return job_id, kind, json.loads(payload), attempts + 1, max_attempts, max(0.0, now - since)
+
+    def renew(self, job_id: int):
+        self.connection().execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running' AND worker = ?",
+            (time.time() + JOB_LEASE_SECONDS, job_id, self.worker_id),
+        )
+
+    def complete(self, job_id: int, result: Optional[dict]):
+        self.connection().execute(
+            "UPDATE jobs SET status = 'done', finished_at = ?, lease_until = NULL, result = ? WHERE id = ?",
+            (time.time(), json.dumps(result, default=str) if result is not None else None, job_id),
+        )
+
+    def fail(self, job_id: int, error: str, retry_at: Optional[float]):
+        # Back to queued until retry_at, or failed for good when retry_at is None
+        if retry_at is not None:
+            self.connection().execute(
+                "UPDATE jobs SET status = 'queued', run_at = ?, lease_until = NULL, last_error = ? WHERE id = ?",
+                (retry_at, error[:MAX_ERROR_LENGTH], job_id),
+            )
+        else:
+            self.connection().execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, lease_until = NULL, last_error = ? WHERE id = ?",
+                (time.time(), error[:MAX_ERROR_LENGTH], job_id),
+            )
+
+    def release(self, job_id: int):
+        # Interrupted by shutdown: queued again without using up an attempt
+        self.connection().execute(
+            "UPDATE jobs SET status = 'queued', attempts = attempts - 1, run_at = ?, lease_until = NULL "
+            "WHERE id = ? AND status = 'running' AND worker = ?",
+            (time.time(), job_id, self.worker_id),
+        )
+
+    def purge(self, before: float) -> int:
+        cursor = self.connection().execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (before,))
+        return cursor.rowcount
+
+    def get(self, job_id: int) -> Optional[dict]:
+        row = self.connection().execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return decode_job(row) if row is not None else None
+
+    def select(self, status: Optional[str], kind: Optional[str], before_id: Optional[int], limit: int) -> List[dict]:
+        # Newest first; before_id continues a previous page
+        conditions, params = [], []
+        if status is not None:
+            conditions.append("status = ?")
+            params.append(status)
+        if kind is not None:
+            conditions.append("kind = ?")
+            params.append(kind)
+        if before_id is not None:
+            conditions.append("id < ?")
+            params.append(before_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self.connection().execute(
+            f"SELECT {JOB_COLUMNS} FROM jobs {where} ORDER BY id DESC LIMIT ?", (*params, limit))
+        return [decode_job(row) for row in rows]
+
+    def summarize(self, window: float) -> dict:
+        now = time.time()
+        conn = self.connection()
+        counts = {status: {} for status in JOB_STATUSES}
+        for status, kind, count in conn.execute("SELECT status, kind, COUNT(*) FROM jobs GROUP BY status, kind"):
+            counts.setdefault(status, {})[kind] = count
+        oldest_due = conn.execute("SELECT MIN(run_at) FROM jobs WHERE status = 'queued' AND run_at <= ?",
+                                  (now,)).fetchone()[0]
+        finished = dict(conn.execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE status IN ('done', 'failed') AND finished_at >= ? GROUP BY status",
+            (now - window,)))
+        return {
+            "counts": counts,
+            # How long the oldest job that could run has been waiting for a worker
+            "lag_seconds": round(now - oldest_due, 3) if oldest_due is not None else 0.0,
+            "window_seconds": window,
+            "done_in_window": finished.get("done", 0),
+            "failed_in_window": finished.get("failed", 0),
+        }
+
+    async def enqueue(self, kind: str, payload: dict, dedupe_key: Optional[str] = None,
+                      max_attempts: int = JOB_MAX_ATTEMPTS, delay: float = 0.0) -> int:
+        job_id = await self.executor.run(self.insert, kind, payload, dedupe_key, max_attempts, delay)
+        jobs_enqueued.inc(1, kind)
+        if self.wakeup is not None and not delay:
+            self.wakeup.set()
+        return job_id
+
+    async def lookup(self, job_id: int) -> Optional[dict]:
+        return await self.executor.run(self.get, job_id)
+
+    async def list(self, status: Optional[str] = None, kind: Optional[str] = None,
+                   before_id: Optional[int] = None, limit: int = 50) -> List[dict]:
+        return await self.executor.run(self.select, status, kind, before_id, limit)
+
+    async def stats(self, window: float = 60.0) -> dict:
+        stats = await self.executor.run(self.summarize, window)
+        stats["workers"] = {"per_process": self.workers, "running_here": self.running}
+        return stats
+
+    async def run_job(self, job_id: int, kind: str, payload: dict, attempt: int, max_attempts: int):
+        started = time.perf_counter()
+        task = asyncio.ensure_future(self.handlers[kind](payload))
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=JOB_LEASE_SECONDS / 3)
+                if done:
+                    break
+                try:
+                    await self.executor.run(self.renew, job_id)
+                except sqlite3.Error as e:
+                    # Not the handler's failure: it keeps running and the next interval
+                    # tries again. Failing the job here would let another worker claim
+                    # it while this one is still at it.
+                    logger.warning("Failed to renew the lease of job %s: %s", job_id, e)
+            result = task.result()
+        except asyncio.CancelledError:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await self.executor.run(self.release, job_id)
+            raise
+        except Exception as e:
+            job_duration.observe(time.perf_counter() - started, kind)
+            error = f"{type(e).__name__}: {e}"
+            if isinstance(e, PermanentJobError) or attempt >= max_attempts:
+                logger.error("Job %s (%s) failed after %s attempts: %s", job_id, kind, attempt, error)
+                jobs_processed.inc(1, kind, "failed")
+                await self.executor.run(self.fail, job_id, error, None)
+            else:
+                delay = retry_delay(attempt)
+                logger.warning("Job %s (%s) attempt %s failed, retrying in %.1fs: %s", job_id, kind, attempt, delay, error)
+                jobs_processed.inc(1, kind, "retried")
+                await self.executor.run(self.fail, job_id, error, time.time() + delay)
+            return
+        job_duration.observe(time.perf_counter() - started, kind)
+        jobs_processed.inc(1, kind, "done")
+        await self.executor.run(self.complete, job_id, result)
+
+    async def work(self):
+        kinds = tuple(self.handlers)
+        while True:
+            try:
+                claimed = await self.executor.run(self.claim, kinds)
+            except sqlite3.Error as e:
+                logger.error("Failed to claim a job: %s", e)
+                claimed = None
+            if claimed is None:
+                await self.idle()
+                continue
+            job_id, kind, payload, attempt, max_attempts, waited = claimed
+            job_queue_lag.observe(waited, kind)
+            logger.debug("Running job %s (%s), attempt %s, waited %.3fs", job_id, kind, attempt, waited)
+            self.running += 1
+            jobs_running.inc(1, kind)
+            try:
+                await self.run_job(job_id, kind, payload, attempt, max_attempts)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # The job itself is handled; this is the database failing, the lease recovers the job
+                logger.error("Failed to record the outcome of job %s: %s", job_id, e)
+            finally:
+                self.running -= 1
+                jobs_running.dec(1, kind)
+
+    async def idle(self):
+        now = time.time()
+        if now - self.last_purge >= PURGE_INTERVAL:
+            self.last_purge = now
+            try:
+                removed = await self.executor.run(self.purge, now - JOB_RETENTION_SECONDS)
+                if removed:
+                    logger.info("Removed %s finished jobs older than %ss", removed, JOB_RETENTION_SECONDS)
+            except sqlite3.Error as e:
+                logger.error("Failed to purge finished jobs: %s", e)
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), JOB_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            return
+        self.wakeup.clear()
+
+    def start(self):
+        if self.tasks or not self.handlers:
+            return
+        self.wakeup = asyncio.Event()
+        self.tasks = [asyncio.create_task(self.work(), name=f"job-worker-{n}") for n in range(self.workers)]
+        logger.info("Job queue started: %s workers for %s (%s)", self.workers, ", ".join(self.handlers), self.path)
+
+    async def stop(self):
+        # Running jobs are put back and picked up again after the restart
+        tasks, self.tasks = self.tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
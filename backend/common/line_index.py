@@ -0,0 +1,212 @@
+# backend/common/line_index.py
+
+import os
+import mmap
+import uuid
+import shutil
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+from typing import AsyncIterator, Optional, Tuple
+
+from backend.common.storage import StorageBackend, normalize_key, remove_if_exists, COPY_CHUNK_SIZE
+
+# Set to 0 to always scan line windows from the start of the file
+LINE_INDEX_ENABLED = os.environ.get("LINE_INDEX_ENABLED", "1") != "0"
+# One index file per indexed data file, at the file's key plus ".idx"
+LINE_INDEX_DIR = os.environ.get("LINE_INDEX_DIR", os.path.join("./data", ".internal", "line-index"))
+# Lines between two indexed offsets, so a window starts at most this many lines after one
+LINE_INDEX_STRIDE = int(os.environ.get("LINE_INDEX_STRIDE", 4096))
+# Indexes kept in memory per process
+LINE_INDEX_CACHE_SIZE = int(os.environ.get("LINE_INDEX_CACHE_SIZE", 256))
+# Bytes of the mapping copied and searched per step; small enough that finding the next
+# checkpoint does not count far past it
+SCAN_BLOCK_SIZE = 64 * 1024
+
+# magic, file size, file mtime, stride, line count (-1 while the file is not fully indexed)
+HEADER = struct.Struct("<8sqdqq")
+MAGIC = b"LINEIDX1"
+
+
+def skip_lines(data: bytes, lines: int) -> Tuple[int, int]:
+    # Position just past the lines-th newline in data and how many lines are still to go
+    # after data; split() finds that newline in C rather than one find() per line
+    newlines = data.count(b"\n")
+    if newlines < lines:
+        return len(data), lines - newlines
+    rest = data.split(b"\n", lines)[-1]
+    return len(data) - len(rest), 0
+
+
+def count_lines(mm: mmap.mmap, position: int, lines: int) -> Tuple[int, int]:
+    # Like skip_lines over the mapped file from position, one block at a time
+    size = len(mm)
+    while lines and position < size:
+        skipped, lines = skip_lines(mm[position:position + SCAN_BLOCK_SIZE], lines)
+        position += skipped
+    return position, lines
+
+
+async def line_slice(storage: StorageBackend, key: str, offset: int, limit: Optional[int],
+                     chunk_size: int = COPY_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    # Lines offset .. offset + limit of a file, 0-based, in one pass from its start. Works
+    # on every backend; LineIndex.window() finds the same bytes without the pass.
+    chunks = storage.open_read(key, 0, None, chunk_size)
+    try:
+        async for chunk in chunks:
+            if offset:
+                position, offset = skip_lines(chunk, offset)
+                if offset:
+                    continue
+                chunk = chunk[position:]
+            if limit is None:
+                if chunk:
+                    yield chunk
+                continue
+            position, limit = skip_lines(chunk, limit)
+            if position:
+                yield chunk[:position]
+            if not limit:
+                return
+    finally:
+        await chunks.aclose()
+
+
+class IndexedFile:
+    # checkpoints[k] is the byte offset of line k * stride; total is the number of lines,
+    # known once the scan has reached the end of the file
+
+    def __init__(self, size: int, mtime: float, checkpoints: Optional[array] = None, total: Optional[int] = None):
+        self.size = size
+        self.mtime = mtime
+        self.checkpoints = checkpoints if checkpoints is not None else array("Q", [0])
+        self.total = total
+        self.lock = threading.Lock()
+        self.dirty = False
+
+
+class LineIndex:
+    # Sparse line offsets of local text files, built lazily with a memory-mapped scan: a
+    # window only extends the index as far as the window itself, and later windows seek
+    # to the nearest checkpoint instead of scanning from the start. Indexes live in
+    # LINE_INDEX_DIR, mirroring the data keys, and in a small per-process LRU; both are
+    # only used while the file keeps the size and mtime it was indexed with.
+
+    def __init__(self, directory: str = LINE_INDEX_DIR, stride: int = LINE_INDEX_STRIDE,
+                 cache_size: int = LINE_INDEX_CACHE_SIZE):
+        self.directory = directory
+        self.stride = max(1, stride)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def index_path(self, key: str) -> str:
+        return os.path.join(self.directory, normalize_key(key) + ".idx")
+
+    def load(self, key: str, size: int, mtime: float) -> Optional[IndexedFile]:
+        try:
+            with open(self.index_path(key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if len(data) < HEADER.size:
+            return None
+        magic, stored_size, stored_mtime, stride, total = HEADER.unpack_from(data)
+        if magic != MAGIC or stored_size != size or stored_mtime != mtime or stride != self.stride:
+            return None
+        checkpoints = array("Q")
+        checkpoints.frombytes(data[HEADER.size:len(data) - (len(data) - HEADER.size) % checkpoints.itemsize])
+        if not checkpoints:
+            return None
+        return IndexedFile(size, mtime, checkpoints, None if total < 0 else total)
+
+    def save(self, key: str, indexed: IndexedFile):
+        path = self.index_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        total = -1 if indexed.total is None else indexed.total
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, indexed.size, indexed.mtime, self.stride, total))
+                f.write(indexed.checkpoints.tobytes())
+            os.replace(temp_path, path)
+        except BaseException:
+            remove_if_exists(temp_path)
+            raise
+
+    def get(self, key: str, size: int, mtime: float) -> IndexedFile:
+        with self.lock:
+            indexed = self.cache.get(key)
+            if indexed is not None and indexed.size == size and indexed.mtime == mtime:
+                self.cache.move_to_end(key)
+                return indexed
+        indexed = self.load(key, size, mtime) or IndexedFile(size, mtime)
+        with self.lock:
+            current = self.cache.get(key)
+            if current is not None and current.size == size and current.mtime == mtime:
+                return current
+            self.cache[key] = indexed
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return indexed
+
+    def extend(self, mm: mmap.mmap, indexed: IndexedFile):
+        # Adds the next checkpoint, or the line count when the end of the file comes first
+        checkpoints = indexed.checkpoints
+        position, missing = count_lines(mm, checkpoints[-1], self.stride)
+        if not missing and position < indexed.size:
+            checkpoints.append(position)
+        else:
+            newlines = (len(checkpoints) - 1) * self.stride + self.stride - missing
+            indexed.total = newlines + (1 if mm[-1:] != b"\n" else 0)
+        indexed.dirty = True
+
+    def locate(self, mm: mmap.mmap, indexed: IndexedFile, line: int) -> int:
+        # Byte offset where the line starts, the file size for lines past the end
+        checkpoint = line // self.stride
+        while checkpoint >= len(indexed.checkpoints) and indexed.total is None:
+            self.extend(mm, indexed)
+        if indexed.total is not None and line >= indexed.total:
+            return indexed.size
+        checkpoint = min(checkpoint, len(indexed.checkpoints) - 1)
+        lines = line - checkpoint * self.stride
+        position, missing = count_lines(mm, indexed.checkpoints[checkpoint], lines)
+        if position >= indexed.size and indexed.total is None:
+            # This scan reached the end of the file, so it has counted all of its lines
+            newlines = checkpoint * self.stride + lines - missing
+            indexed.total = newlines + (1 if mm[-1:] != b"\n" else 0)
+            indexed.dirty = True
+        return indexed.size if missing else position
+
+    def find_window(self, path: str, key: str, first: int, count: Optional[int]) -> Tuple[int, int, Optional[int]]:
+        # Byte range of lines first .. first + count and the file's line count if known
+        with open(path, "rb") as f:
+            file_stat = os.fstat(f.fileno())
+            if not file_stat.st_size:
+                return 0, 0, 0
+            indexed = self.get(normalize_key(key), file_stat.st_size, file_stat.st_mtime)
+            with indexed.lock, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                start = self.locate(mm, indexed, first)
+                end = indexed.size if count is None else self.locate(mm, indexed, first + count)
+                if indexed.dirty:
+                    self.save(key, indexed)
+                    indexed.dirty = False
+                return start, end, indexed.total
+
+    def forget(self, key: str):
+        # Index of a removed file or of everything below a removed directory
+        key = normalize_key(key)
+        with self.lock:
+            for cached in [cached for cached in self.cache if cached == key or cached.startswith(key + "/")]:
+                del self.cache[cached]
+        remove_if_exists(self.index_path(key))
+        shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+
+    async def window(self, storage: StorageBackend, key: str, first: int,
+                     count: Optional[int]) -> Optional[Tuple[int, int, Optional[int]]]:
+        # None when the file is not a plain local file (S3, compressed at rest)
+        path = storage.local_path(key)
+        if path is None:
+            return None
+        return await storage.run(self.find_window, path, key, first, count)
@@ -1,9 +1,15 @@
 # backend/common/logging_utils.py
 
-import logging
 import os
 import sys
-from typing import Optional, Dict, Any
+import json
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional, Dict, Any, Tuple
 
 DEFAULT_LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 DETAILED_LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s"
@@ -16,17 +22,166 @@ LOG_LEVELS = {
     "critical": logging.CRITICAL
 }
 
+# Records waiting for the background writer; when it falls behind further, new records are dropped
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+# "text" or "json" (one JSON object per line)
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()
+
 
 def get_log_level_from_env() -> int:
     log_level = os.environ.get("LOG_LEVEL", "info").lower()
     return LOG_LEVELS.get(log_level, logging.INFO)
 
 
+def use_json_format(json_format: Optional[bool]) -> bool:
+    return LOG_FORMAT == "json" if json_format is None else json_format
+
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line for log shippers; extra attributes passed with extra={...}
+    # are included as top-level fields
+    RESERVED = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "target"}
+
+    def __init__(self, detailed: bool = False):
+        super().__init__()
+        self.detailed = detailed
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if self.detailed:
+            entry["file"] = record.filename
+            entry["line"] = record.lineno
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        for key, value in record.__dict__.items():
+            if key not in self.RESERVED and not key.startswith("_"):
+                entry[key] = value
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def create_formatter(detailed_format: bool = False, json_format: Optional[bool] = None) -> logging.Formatter:
+    if use_json_format(json_format):
+        return JsonFormatter(detailed=detailed_format)
+    return logging.Formatter(DETAILED_LOG_FORMAT if detailed_format else DEFAULT_LOG_FORMAT)
+
+
+class DispatchingListener(QueueListener):
+    # A single writer thread for all handlers of the process. Queue items carry the
+    # handler they are meant for, so loggers with different outputs share one queue.
+
+    def handle(self, item):
+        target, record = item
+        if record.levelno >= target.level:
+            target.handle(record)
+
+    def enqueue_sentinel(self):
+        # Blocking put, so stop() still gets through when the queue is full
+        self.queue.put(self._sentinel)
+
+
+class LogPipeline:
+    # Log calls only put the record on a bounded queue; formatting and the actual
+    # stream/file writes happen on the listener thread, so a slow disk or a blocked
+    # stdout never stalls the event loop or the request threads. Records that do not
+    # fit in the queue are dropped and counted instead of blocking the caller.
+
+    def __init__(self, capacity: int = LOG_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=max(1, capacity))
+        self.listener = DispatchingListener(self.queue)
+        self.lock = threading.Lock()
+        self.started = False
+        self.dropped = 0
+
+    def start(self):
+        with self.lock:
+            if not self.started:
+                self.listener.start()
+                self.started = True
+                atexit.register(self.stop)
+
+    def stop(self):
+        # Flushes the records still queued, then stops the writer thread
+        with self.lock:
+            if not self.started:
+                return
+            self.started = False
+        self.listener.stop()
+
+    def put(self, target: logging.Handler, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait((target, record))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"queued": self.queue.qsize(), "capacity": self.queue.maxsize, "dropped": self.dropped}
+
+
+log_pipeline = LogPipeline()
+
+
+class AsyncLogHandler(QueueHandler):
+    # Stands in for target on a logger and hands its records to the background writer
+
+    def __init__(self, target: logging.Handler, pipeline: LogPipeline = log_pipeline):
+        super().__init__(pipeline.queue)
+        self.target = target
+        self.pipeline = pipeline
+        self.setLevel(target.level)
+        pipeline.start()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only the message arguments are merged here, because they may be mutated by the
+        # caller after the call returns; the formatter runs later on the writer thread
+        message = record.getMessage()
+        if record.args or message is not record.msg:
+            record = logging.makeLogRecord(record.__dict__)
+            record.msg = message
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        self.pipeline.put(self.target, record)
+
+    def close(self):
+        self.target.close()
+        super().close()
+
+
+def create_handler(
+        target: logging.Handler,
+        level: int,
+        detailed_format: bool = False,
+        json_format: Optional[bool] = None
+) -> AsyncLogHandler:
+    target.setLevel(level)
+    target.setFormatter(create_formatter(detailed_format, json_format))
+    return AsyncLogHandler(target)
+
+
+def console_handler(level: int = logging.NOTSET, detailed_format: bool = False,
+                    json_format: Optional[bool] = None) -> AsyncLogHandler:
+    return create_handler(logging.StreamHandler(sys.stdout), level, detailed_format, json_format)
+
+
+def file_handler(filename: str, level: int = logging.NOTSET, detailed_format: bool = False,
+                 json_format: Optional[bool] = None) -> AsyncLogHandler:
+    return create_handler(logging.FileHandler(filename, delay=True), level, detailed_format, json_format)
+
+
 def setup_logger(
         name: str,
         level: Optional[str] = None,
         log_file: Optional[str] = None,
-        detailed_format: bool = False
+        detailed_format: bool = False,
+        json_format: Optional[bool] = None
 ) -> logging.Logger:
 
     log_level = LOG_LEVELS.get(level.lower(), None) if level else get_log_level_from_env()
@@ -37,18 +192,11 @@ def setup_logger(
     if logger.handlers:
         logger.handlers.clear()
 
-    log_format = DETAILED_LOG_FORMAT if detailed_format else DEFAULT_LOG_FORMAT
-    formatter = logging.Formatter(log_format)
-
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    logger.addHandler(console_handler(detailed_format=detailed_format, json_format=json_format))
 
     if log_file:
         os.makedirs(os.path.dirname(log_file), exist_ok=True)
-        file_handler = logging.FileHandler(log_file)
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        logger.addHandler(file_handler(log_file, detailed_format=detailed_format, json_format=json_format))
 
     return logger
 
@@ -58,27 +206,20 @@ class LogConfig:
     def get_config(
             app_name: str,
             log_level: Optional[str] = None,
-            log_file: Optional[str] = None
+            log_file: Optional[str] = None,
+            json_format: Optional[bool] = None,
+            extra_loggers: Tuple[str, ...] = ()
     ) -> Dict[str, Any]:
         level = LOG_LEVELS.get(log_level.lower(), None) if log_level else get_log_level_from_env()
 
         config = {
             "version": 1,
             "disable_existing_loggers": False,
-            "formatters": {
-                "default": {
-                    "format": DEFAULT_LOG_FORMAT,
-                },
-                "detailed": {
-                    "format": DETAILED_LOG_FORMAT,
-                },
-            },
             "handlers": {
                 "console": {
-                    "formatter": "default",
-                    "class": "logging.StreamHandler",
-                    "stream": "ext://sys.stdout",
+                    "()": console_handler,
                     "level": level,
+                    "json_format": json_format,
                 },
             },
             "loggers": {
@@ -87,17 +228,23 @@ class LogConfig:
                 "uvicorn.access": {"handlers": ["console"], "level": level},
             },
         }
+        # Other services' routers mounted by this one log under their own names
+        for name in extra_loggers:
+            config["loggers"][name] = {"handlers": ["console"], "level": level, "propagate": False}
 
         if log_file:
             os.makedirs(os.path.dirname(log_file), exist_ok=True)
             config["handlers"]["file"] = {
-                "formatter": "detailed",
-                "class": "logging.FileHandler",
+                "()": file_handler,
                 "filename": log_file,
                 "level": level,
+                "detailed_format": True,
+                "json_format": json_format,
             }
             config["loggers"][app_name]["handlers"].append("file")
             config["loggers"]["uvicorn"]["handlers"].append("file")
             config["loggers"]["uvicorn.access"]["handlers"].append("file")
+            for name in extra_loggers:
+                config["loggers"][name]["handlers"].append("file")
 
-        return config
\ No newline at end of file
+        return config
@@ -0,0 +1,379 @@
+# backend/common/metadata_index.py
+
+import os
+import json
+import time
+import base64
+import asyncio
+import sqlite3
+import posixpath
+import threading
+from mimetypes import guess_type
+from typing import Iterable, List, Optional, Tuple
+
+from backend.common.storage import StorageBackend, FileStat, IOExecutor, io_executor, normalize_key
+
+# Set to 0 to disable the index and its search endpoints
+METADATA_INDEX_ENABLED = os.environ.get("METADATA_INDEX_ENABLED", "1") != "0"
+# One database for the whole data root, shared by both services and all their workers
+METADATA_INDEX_PATH = os.environ.get("METADATA_INDEX_PATH", os.path.join("./data", ".internal", "metadata.db"))
+# Directories listed at the same time while reconciling
+INDEX_RECONCILE_CONCURRENCY = int(os.environ.get("INDEX_RECONCILE_CONCURRENCY", 16))
+# A startup reconciliation of the same tree is skipped when another process did one this recently (seconds)
+INDEX_RECONCILE_INTERVAL = float(os.environ.get("INDEX_RECONCILE_INTERVAL", 60))
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY NOT NULL,
+        parent TEXT NOT NULL,
+        name TEXT NOT NULL,
+        is_dir INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        mtime REAL NOT NULL,
+        content_type TEXT,
+        seen REAL NOT NULL
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent, name)",
+    "CREATE INDEX IF NOT EXISTS entries_size ON entries (size, key)",
+    "CREATE INDEX IF NOT EXISTS entries_mtime ON entries (mtime, key)",
+    "CREATE INDEX IF NOT EXISTS entries_content_type ON entries (content_type, key)",
+    "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY NOT NULL, value REAL NOT NULL) WITHOUT ROWID",
+)
+
+UPSERT_ENTRY = """
+INSERT INTO entries (key, parent, name, is_dir, size, mtime, content_type, seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (key) DO UPDATE SET
+    is_dir = excluded.is_dir, size = excluded.size, mtime = excluded.mtime,
+    content_type = excluded.content_type, seen = excluded.seen
+"""
+# Parents of a new entry, without overwriting what is already known about them
+INSERT_PARENT = """
+INSERT INTO entries (key, parent, name, is_dir, size, mtime, content_type, seen) VALUES (?, ?, ?, 1, 0, ?, NULL, ?)
+ON CONFLICT (key) DO UPDATE SET is_dir = 1, seen = excluded.seen
+"""
+
+SORT_COLUMNS = {"path": "key", "name": "name", "size": "size", "mtime": "mtime"}
+
+
+def key_range(prefix: str) -> Tuple[str, str]:
+    # Bounds of every key starting with prefix, so the primary key index answers prefix queries
+    return prefix, prefix + "\U0010ffff"
+
+
+def encode_search_cursor(value, key: str) -> str:
+    raw = json.dumps([value, key], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_search_cursor(cursor: str) -> tuple:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        value, key = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (TypeError, ValueError):
+        raise ValueError("invalid cursor")
+    if not isinstance(key, str) or isinstance(value, (list, dict)):
+        raise ValueError("invalid cursor")
+    return value, key
+
+
+class MetadataIndex:
+    # Path, size, mtime and content type of every file and directory under a storage
+    # root, in SQLite (WAL mode, one connection per thread), so searches and recursive
+    # listings are index lookups instead of directory walks. Handlers refresh the keys
+    # they change right after changing them; reconcile() brings the index in line with
+    # whatever changed on disk while the services were down.
+    #
+    # The database is keyed by paths relative to the data root. A service whose storage
+    # root is a subtree of it (the sink's "received") passes that subtree as root_key,
+    # and all keys going in and out of this class are relative to its own storage.
+
+    def __init__(self, path: str = METADATA_INDEX_PATH, root_key: str = "", excluded: Iterable[str] = (),
+                 executor: IOExecutor = io_executor):
+        self.path = path
+        self.root_key = normalize_key(root_key)
+        self.excluded = frozenset(normalize_key(k) for k in excluded)
+        self.executor = executor
+        self.local = threading.local()
+        self.schema_lock = threading.Lock()
+        self.schema_ready = False
+        self.reconciling = False
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, cached_statements=64)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            with self.schema_lock:
+                if not self.schema_ready:
+                    for statement in SCHEMA:
+                        conn.execute(statement)
+                    self.schema_ready = True
+            self.local.conn = conn
+        return conn
+
+    async def run(self, func, *args):
+        return await self.executor.run(func, *args)
+
+    def index_key(self, key: str) -> str:
+        key = normalize_key(key)
+        if not self.root_key:
+            return key
+        return posixpath.join(self.root_key, key) if key else self.root_key
+
+    def storage_key(self, index_key: str) -> str:
+        if not self.root_key:
+            return index_key
+        return index_key[len(self.root_key) + 1:]
+
+    def is_excluded(self, key: str) -> bool:
+        return any(key == excluded or key.startswith(excluded + "/") for excluded in self.excluded)
+
+    def entry_row(self, key: str, is_dir: bool, size: int, mtime: Optional[float], seen: float) -> tuple:
+        index_key = self.index_key(key)
+        name = posixpath.basename(index_key)
+        content_type = None if is_dir else guess_type(name)[0] or "application/octet-stream"
+        return index_key, posixpath.dirname(index_key), name, int(is_dir), size, mtime or 0.0, content_type, seen
+
+    def parent_rows(self, index_key: str, seen: float) -> List[tuple]:
+        rows = []
+        parent = posixpath.dirname(index_key)
+        while parent and parent != self.root_key:
+            rows.append((parent, posixpath.dirname(parent), posixpath.basename(parent), 0.0, seen))
+            parent = posixpath.dirname(parent)
+        return rows
+
+    # Write path
+
+    def apply(self, changes: List[Tuple[str, Optional[FileStat]]]):
+        # Records (key, current stat) pairs in one transaction; a missing stat removes the
+        # key and, for directories, everything below it
+        now = time.time()
+        conn = self.connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for key, file_stat in changes:
+                if file_stat is None:
+                    index_key = self.index_key(key)
+                    low, high = key_range(index_key + "/")
+                    conn.execute("DELETE FROM entries WHERE key = ?", (index_key,))
+                    conn.execute("DELETE FROM entries WHERE key >= ? AND key < ?", (low, high))
+                else:
+                    row = self.entry_row(key, file_stat.is_dir, file_stat.size, file_stat.mtime, now)
+                    conn.executemany(INSERT_PARENT, self.parent_rows(row[0], now))
+                    conn.execute(UPSERT_ENTRY, row)
+
+    async def refresh(self, storage: StorageBackend, *keys: str):
+        # Records the current state of keys after a handler changed them
+        keys = [key for key in dict.fromkeys(normalize_key(key) for key in keys) if key and not self.is_excluded(key)]
+        if not keys:
+            return
+        stats = await asyncio.gather(*(storage.stat(key) for key in keys))
+        await self.run(self.apply, list(zip(keys, stats)))
+
+    # Reconciliation
+
+    def claim_reconcile(self, started: float, interval: float) -> bool:
+        # Only one process reconciles a tree at a time; the others rely on its result
+        name = f"reconciled:{self.root_key}"
+        conn = self.connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES (?, 0)", (name,))
+            cursor = conn.execute("UPDATE meta SET value = ? WHERE name = ? AND value < ?",
+                                  (started, name, started - interval))
+            return cursor.rowcount == 1
+
+    def store_rows(self, rows: List[tuple]):
+        conn = self.connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(UPSERT_ENTRY, rows)
+
+    def remove_unseen(self, started: float) -> int:
+        # Entries neither found by the scan nor written by a handler since it started
+        conn = self.connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if self.root_key:
+                low, high = key_range(self.root_key + "/")
+                cursor = conn.execute("DELETE FROM entries WHERE key >= ? AND key < ? AND seen < ?", (low, high, started))
+            else:
+                cursor = conn.execute("DELETE FROM entries WHERE seen < ?", (started,))
+            return cursor.rowcount
+
+    async def reconcile(self, storage: StorageBackend, force: bool = False,
+                        concurrency: int = INDEX_RECONCILE_CONCURRENCY) -> Optional[dict]:
+        # Lists the whole tree with up to `concurrency` directory listings in flight and
+        # replaces the index content of the tree with what was found
+        started = time.time()
+        if self.reconciling:
+            return None
+        if not await self.run(self.claim_reconcile, started, 0 if force else INDEX_RECONCILE_INTERVAL):
+            return None
+        self.reconciling = True
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        counts = {"directories": 0, "files": 0}
+
+        async def scan(key: str):
+            async with semaphore:
+                directories, files = await storage.list(key)
+            children = []
+            rows = []
+            for name in directories:
+                child = posixpath.join(key, name) if key else name
+                if not self.is_excluded(child):
+                    children.append(child)
+                    rows.append(self.entry_row(child, True, 0, None, started))
+            for entry in files:
+                child = posixpath.join(key, entry["name"]) if key else entry["name"]
+                if not self.is_excluded(child):
+                    rows.append(self.entry_row(child, False, entry["size"], entry.get("mtime"), started))
+            counts["directories"] += len(children)
+            counts["files"] += len(rows) - len(children)
+            if rows:
+                await self.run(self.store_rows, rows)
+            await asyncio.gather(*(scan(child) for child in children))
+
+        try:
+            await scan("")
+            counts["removed"] = await self.run(self.remove_unseen, started)
+        finally:
+            self.reconciling = False
+        counts["seconds"] = round(time.time() - started, 3)
+        return counts
+
+    # Queries
+
+    def search(
+            self,
+            directory: str = "",
+            recursive: bool = True,
+            prefix: Optional[str] = None,
+            glob: Optional[str] = None,
+            min_size: Optional[int] = None,
+            max_size: Optional[int] = None,
+            modified_after: Optional[float] = None,
+            modified_before: Optional[float] = None,
+            content_type: Optional[str] = None,
+            entry_type: str = "file",
+            sort: str = "path",
+            descending: bool = False,
+            cursor: Optional[tuple] = None,
+            limit: int = 1000,
+    ) -> Tuple[List[dict], Optional[tuple]]:
+        # Returns (entries, cursor of the next page or None). Pagination is by keyset on
+        # (sort column, key), so deep pages cost the same as the first one.
+        column = SORT_COLUMNS[sort]
+        conditions = []
+        params = []
+
+        base = self.index_key(directory)
+        if recursive:
+            # prefix is a plain string prefix of the path below directory, e.g. "2024/report-"
+            scope = (base + "/" if base else "") + (prefix or "").lstrip("/")
+            if scope:
+                conditions.append("key >= ? AND key < ?")
+                params += list(key_range(scope))
+        else:
+            conditions.append("parent = ?")
+            params.append(base)
+            if prefix:
+                conditions.append("name >= ? AND name < ?")
+                params += list(key_range(prefix))
+        if glob:
+            # Patterns with a "/" match the whole path below the storage root, others the name
+            if "/" in glob:
+                conditions.append("key GLOB ?")
+                params.append((self.root_key + "/" if self.root_key else "") + glob.lstrip("/"))
+            else:
+                conditions.append("name GLOB ?")
+                params.append(glob)
+        if entry_type != "any":
+            conditions.append("is_dir = ?")
+            params.append(1 if entry_type == "dir" else 0)
+        if min_size is not None:
+            conditions.append("size >= ?")
+            params.append(min_size)
+        if max_size is not None:
+            conditions.append("size <= ?")
+            params.append(max_size)
+        if modified_after is not None:
+            conditions.append("mtime >= ?")
+            params.append(modified_after)
+        if modified_before is not None:
+            conditions.append("mtime < ?")
+            params.append(modified_before)
+        if content_type:
+            if content_type.endswith("/*"):
+                conditions.append("content_type >= ? AND content_type < ?")
+                params += list(key_range(content_type[:-1]))
+            else:
+                conditions.append("content_type = ?")
+                params.append(content_type)
+        if cursor is not None:
+            value, key = cursor
+            operator = "<" if descending else ">"
+            if column == "key":
+                conditions.append(f"key {operator} ?")
+                params.append(self.index_key(key))
+            else:
+                conditions.append(f"({column}, key) {operator} (?, ?)")
+                params += [value, self.index_key(key)]
+
+        direction = "DESC" if descending else "ASC"
+        order = "key " + direction if column == "key" else f"{column} {direction}, key {direction}"
+        where = " AND ".join(conditions) or "1"
+        sql = (f"SELECT key, name, is_dir, size, mtime, content_type FROM entries WHERE {where} "
+               f"ORDER BY {order} LIMIT ?")
+        params.append(limit + 1)
+        rows = self.connection().execute(sql, params).fetchall()
+
+        entries = [
+            {
+                "path": self.storage_key(key),
+                "name": name,
+                "is_dir": bool(is_dir),
+                "size": size,
+                "mtime": mtime,
+                "content_type": content_type,
+            }
+            for key, name, is_dir, size, mtime, content_type in rows[:limit]
+        ]
+        next_cursor = None
+        if len(rows) > limit:
+            last = entries[-1]
+            next_cursor = (last[sort] if column != "key" else None, last["path"])
+        return entries, next_cursor
+
+    async def query(self, **criteria) -> Tuple[List[dict], Optional[tuple]]:
+        return await self.run(lambda: self.search(**criteria))
+
+    def count(self) -> int:
+        return self.connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+
+def search_criteria(query, directory: str, cursor: Optional[tuple]) -> dict:
+    # Keyword arguments of MetadataIndex.search for a SearchQuery
+    return {
+        "directory": directory,
+        "recursive": query.recursive,
+        "prefix": query.prefix,
+        "glob": query.glob,
+        "min_size": query.min_size,
+        "max_size": query.max_size,
+        "modified_after": query.modified_after.timestamp() if query.modified_after else None,
+        "modified_before": query.modified_before.timestamp() if query.modified_before else None,
+        "content_type": query.content_type,
+        "entry_type": query.type,
+        "sort": query.sort,
+        "descending": query.order == "desc",
+        "cursor": cursor,
+        "limit": query.limit,
+    }
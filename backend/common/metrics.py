@@ -0,0 +1,421 @@
+# backend/common/metrics.py
+
+import os
+import json
+import time
+import bisect
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Set to 0 to disable the /metrics endpoint and the request middleware
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+# When set, every worker process publishes a snapshot of its metrics here and /metrics
+# reports the sum over all live workers of the service
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 1))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    # Values live in a plain dict keyed by label tuple. Updates take a per-metric lock
+    # that is only contended when I/O threads and the event loop update the same
+    # metric at the same instant; there is no global registry lock on the hot path.
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def samples(self) -> List[Tuple[tuple, object]]:
+        with self.lock:
+            return list(self.values.items())
+
+    def snapshot(self) -> dict:
+        return {
+            "kind": self.kind,
+            "help": self.help,
+            "labelnames": list(self.labelnames),
+            "samples": [[list(labels), value] for labels, value in self.samples()],
+        }
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, *labels: str):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 callback: Optional[Callable[[], Dict[tuple, float]]] = None):
+        super().__init__(name, help_text, labelnames)
+        # Callback gauges are read at collection time, e.g. queue depths
+        self.callback = callback
+
+    def inc(self, amount: float = 1, *labels: str):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, amount: float = 1, *labels: str):
+        self.inc(-amount, *labels)
+
+    def set(self, value: float, *labels: str):
+        with self.lock:
+            self.values[labels] = value
+
+    def samples(self) -> List[Tuple[tuple, object]]:
+        if self.callback is not None:
+            try:
+                return list(self.callback().items())
+            except Exception:
+                return []
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self) -> List[Tuple[tuple, object]]:
+        with self.lock:
+            return [(labels, [list(counts), total, count]) for labels, (counts, total, count) in self.values.items()]
+
+    def snapshot(self) -> dict:
+        data = super().snapshot()
+        data["buckets"] = list(self.buckets)
+        return data
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), callback=None) -> Gauge:
+        return self.register(Gauge(name, help_text, labelnames, callback))
+
+    def histogram(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def snapshot(self) -> dict:
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+
+def merge_snapshots(snapshots: List[dict]) -> dict:
+    # Counters, gauges and histogram buckets of the workers add up
+    merged = {}
+    for snapshot in snapshots:
+        for name, data in snapshot.items():
+            target = merged.setdefault(name, {**data, "samples": {}})
+            samples = target["samples"]
+            for labels, value in data["samples"]:
+                key = tuple(labels)
+                if data["kind"] == "histogram":
+                    current = samples.get(key)
+                    if current is None:
+                        samples[key] = [list(value[0]), value[1], value[2]]
+                    else:
+                        current[0] = [a + b for a, b in zip(current[0], value[0])]
+                        current[1] += value[1]
+                        current[2] += value[2]
+                else:
+                    samples[key] = samples.get(key, 0) + value
+    return merged
+
+
+def render(merged: dict) -> str:
+    lines = []
+    for name, data in merged.items():
+        lines.append(f"# HELP {name} {data['help']}")
+        lines.append(f"# TYPE {name} {data['kind']}")
+        labelnames = data["labelnames"]
+        for labels, value in sorted(data["samples"].items()):
+            if data["kind"] == "histogram":
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(list(data["buckets"]) + [float("inf")], counts):
+                    cumulative += bucket_count
+                    le = f'le="{format_value(bound)}"'
+                    lines.append(f"{name}_bucket{format_labels(labelnames, labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labelnames, labels)} {format_value(total)}")
+                lines.append(f"{name}_count{format_labels(labelnames, labels)} {count}")
+            else:
+                lines.append(f"{name}{format_labels(labelnames, labels)} {format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests_in_flight = registry.gauge(
+    "http_requests_in_flight", "Requests currently being processed", ("method",))
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "Request latency by route template", ("method", "route", "status"))
+http_received_bytes = registry.counter(
+    "http_received_bytes_total", "Request body bytes received", ("route",))
+http_sent_bytes = registry.counter(
+    "http_sent_bytes_total", "Response body bytes sent, including zero-copy sends", ("route",))
+auth_failures = registry.counter(
+    "auth_failures_total", "Rejected authentication attempts", ("reason",))
+admission_rejections = registry.counter(
+    "admission_rejections_total", "Requests turned away by rate, concurrency or quota limits", ("reason",))
+
+# Queue lag reaches minutes when retries back off, so the buckets go further than for requests
+JOB_LAG_BUCKETS = LATENCY_BUCKETS + (900.0, 3600.0)
+jobs_enqueued = registry.counter(
+    "jobs_enqueued_total", "Background jobs enqueued", ("kind",))
+jobs_processed = registry.counter(
+    "jobs_processed_total", "Background job attempts by outcome (done, retried, failed)", ("kind", "outcome"))
+jobs_running = registry.gauge(
+    "jobs_running", "Background jobs currently running", ("kind",))
+job_duration = registry.histogram(
+    "job_duration_seconds", "Run time of background job attempts", ("kind",), JOB_LAG_BUCKETS)
+job_queue_lag = registry.histogram(
+    "job_queue_lag_seconds", "Time a job was due before a worker claimed it", ("kind",), JOB_LAG_BUCKETS)
+
+
+def io_executor_gauges() -> Dict[tuple, float]:
+    from backend.common.storage import io_executor
+    stats = io_executor.stats()
+    return {("storage_io", "queued"): stats["queued"], ("storage_io", "active"): stats["active"]}
+
+
+def anyio_threadpool_gauges() -> Dict[tuple, float]:
+    import anyio.to_thread
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    statistics = limiter.statistics()
+    return {("anyio", "queued"): statistics.tasks_waiting, ("anyio", "active"): limiter.borrowed_tokens}
+
+
+def password_pool_gauges() -> Dict[tuple, float]:
+    from backend.common.passwords import password_hasher
+    return {("password", "queued"): max(0, password_hasher.pending - password_hasher.workers),
+            ("password", "active"): min(password_hasher.pending, password_hasher.workers)}
+
+
+def pool_gauges() -> Dict[tuple, float]:
+    values = {}
+    for source in (io_executor_gauges, anyio_threadpool_gauges, password_pool_gauges):
+        try:
+            values.update(source())
+        except Exception:
+            continue
+    return values
+
+
+registry.gauge("worker_pool_tasks", "Tasks queued or running per worker pool", ("pool", "state"), callback=pool_gauges)
+
+
+def log_queue_gauges() -> Dict[tuple, float]:
+    from backend.common.logging_utils import log_pipeline
+    stats = log_pipeline.stats()
+    return {("queued",): stats["queued"], ("dropped",): stats["dropped"]}
+
+
+registry.gauge("log_queue_records", "Log records waiting for the writer thread and dropped since start", ("state",),
+               callback=log_queue_gauges)
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware: wraps receive/send to count body bytes and the status,
+    # and reads the matched route template from the scope once the router has run.
+    # Paths that match no route are reported as "unmatched" to bound label cardinality.
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        started = time.perf_counter()
+        received = 0
+        sent = 0
+        status = 500
+
+        async def counting_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message: Message) -> None:
+            nonlocal sent, status
+            message_type = message["type"]
+            if message_type == "http.response.body":
+                sent += len(message.get("body", b""))
+            elif message_type == "http.response.start":
+                status = message["status"]
+            elif message_type == "http.response.zerocopysend":
+                sent += message.get("count") or 0
+            await send(message)
+
+        http_requests_in_flight.inc(1, method)
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            http_requests_in_flight.dec(1, method)
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            http_request_duration.observe(time.perf_counter() - started, method, template, str(status))
+            if received:
+                http_received_bytes.inc(received, template)
+            if sent:
+                http_sent_bytes.inc(sent, template)
+
+
+def snapshot_path(pid: int) -> str:
+    return os.path.join(METRICS_DIR, f"{pid}.json")
+
+
+def write_snapshot():
+    path = snapshot_path(os.getpid())
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(tmp_path, path)
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_worker_snapshots() -> List[dict]:
+    snapshots = []
+    own_pid = os.getpid()
+    for entry in os.scandir(METRICS_DIR):
+        if not entry.name.endswith(".json"):
+            continue
+        try:
+            pid = int(entry.name[:-len(".json")])
+        except ValueError:
+            continue
+        if pid == own_pid:
+            continue
+        if not pid_alive(pid):
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+            continue
+        try:
+            with open(entry.path, "r") as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+class SnapshotWriter:
+    # Background thread publishing this worker's snapshot to METRICS_DIR
+
+    def __init__(self, interval: float = METRICS_FLUSH_INTERVAL):
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if not METRICS_DIR or self.thread is not None:
+            return
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        self.thread = threading.Thread(target=self.run, name="metrics-writer", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                write_snapshot()
+            except OSError:
+                continue
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join(timeout=self.interval * 2)
+        self.thread = None
+        try:
+            os.remove(snapshot_path(os.getpid()))
+        except FileNotFoundError:
+            pass
+
+
+snapshot_writer = SnapshotWriter()
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    snapshots = [registry.snapshot()]
+    if METRICS_DIR:
+        from backend.common.storage import io_executor
+        snapshots.extend(await io_executor.run(read_worker_snapshots))
+    return Response(render(merge_snapshots(snapshots)), media_type=CONTENT_TYPE)
+
+
+def setup_metrics(app):
+    if not METRICS_ENABLED:
+        return
+    app.add_middleware(MetricsMiddleware)
+    app.add_route("/metrics", metrics_endpoint, methods=["GET"], include_in_schema=False)
+    app.add_event_handler("startup", snapshot_writer.start)
+    app.add_event_handler("shutdown", snapshot_writer.stop)
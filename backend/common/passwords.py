@@ -0,0 +1,128 @@
+# backend/common/passwords.py
+
+import os
+import time
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Callable, Optional, Tuple
+
+# bcrypt cost factor for new hashes; stored hashes with another cost are rehashed on login
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+# Processes doing bcrypt work, kept apart from the I/O threads and the event loop
+PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", max(1, (os.cpu_count() or 1) // 2)))
+# Hash/verify calls queued or running before new ones are rejected
+PASSWORD_MAX_PENDING = int(os.environ.get("PASSWORD_MAX_PENDING", PASSWORD_WORKERS * 16))
+
+
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    # passlib is only needed in the worker processes, so the services do not import it at startup
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+class PasswordPoolSaturated(Exception):
+    pass
+
+
+# Executed in the worker processes; they also return their own run time so the
+# parent can split latency into queue wait and bcrypt time
+def hash_password_task(password: str) -> Tuple[str, float]:
+    started = time.perf_counter()
+    hashed = get_pwd_context().hash(password)
+    return hashed, time.perf_counter() - started
+
+
+def verify_password_task(password: str, hashed: str) -> Tuple[Tuple[bool, Optional[str]], float]:
+    started = time.perf_counter()
+    result = get_pwd_context().verify_and_update(password, hashed)
+    return result, time.perf_counter() - started
+
+
+class PasswordHasher:
+    # Process pool for bcrypt. bcrypt holds the GIL for its whole run, so doing it in
+    # threads still stalls the event loop and every I/O thread of the service.
+    # Workers are started lazily with "spawn", which is safe from a threaded server.
+
+    def __init__(self, workers: int = PASSWORD_WORKERS, max_pending: int = PASSWORD_MAX_PENDING):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.pool = None
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.max_pending_seen = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+        self.run_seconds_total = 0.0
+        self.max_wait_seconds = 0.0
+
+    def get_pool(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self.pool
+
+    async def submit(self, func: Callable, *args):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise PasswordPoolSaturated(f"{self.pending} password operations pending")
+            self.pending += 1
+            if self.pending > self.max_pending_seen:
+                self.max_pending_seen = self.pending
+
+        submitted = time.perf_counter()
+        try:
+            result, run_seconds = await asyncio.get_running_loop().run_in_executor(self.get_pool(), func, *args)
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+        wait = max(0.0, time.perf_counter() - submitted - run_seconds)
+        with self.lock:
+            self.completed += 1
+            self.run_seconds_total += run_seconds
+            self.wait_seconds_total += wait
+            if wait > self.max_wait_seconds:
+                self.max_wait_seconds = wait
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self.submit(hash_password_task, password)
+
+    async def verify(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        # Returns (valid, new hash or None); a new hash is produced when the stored one
+        # uses an outdated scheme or cost factor
+        return await self.submit(verify_password_task, password, hashed)
+
+    def stats(self) -> dict:
+        with self.lock:
+            completed = self.completed or 1
+            return {
+                "workers": self.workers,
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "max_pending_seen": self.max_pending_seen,
+                "saturation": self.pending / self.workers,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_wait_seconds": self.wait_seconds_total / completed,
+                "avg_run_seconds": self.run_seconds_total / completed,
+                "max_wait_seconds": self.max_wait_seconds,
+            }
+
+    def shutdown(self):
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,315 @@
+# backend/common/s3_storage.py
+
+import os
+import asyncio
+import posixpath
+import tempfile
+from typing import AsyncIterator, Optional
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from backend.common.storage import (
+    StorageBackend, FileStat, IOExecutor, io_executor, normalize_key,
+    PayloadTooLarge, EmptyPayload, COPY_CHUNK_SIZE
+)
+
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
+S3_BUCKET = os.environ.get("S3_BUCKET", "data")
+S3_PREFIX = os.environ.get("S3_PREFIX", "")
+S3_REGION = os.environ.get("S3_REGION", "us-east-1")
+S3_ACCESS_KEY_ID = os.environ.get("S3_ACCESS_KEY_ID")
+S3_SECRET_ACCESS_KEY = os.environ.get("S3_SECRET_ACCESS_KEY")
+# Part size of streamed multipart uploads and number of parts in flight per upload
+S3_PART_SIZE = int(os.environ.get("S3_PART_SIZE", 8 * 1024 * 1024))
+S3_MAX_CONCURRENCY = int(os.environ.get("S3_MAX_CONCURRENCY", 4))
+# Size of the client's HTTP connection pool, shared by all requests of the process
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get("S3_MAX_POOL_CONNECTIONS", 32))
+# Parts of resumable uploads are spooled to disk above this size before being sent
+PART_SPOOL_SIZE = 8 * 1024 * 1024
+
+NOT_FOUND_CODES = ("404", "NoSuchKey", "NotFound")
+# Most keys one DeleteObjects call accepts
+DELETE_BATCH_SIZE = 1000
+
+
+def is_not_found(error: ClientError) -> bool:
+    return error.response.get("Error", {}).get("Code") in NOT_FOUND_CODES
+
+
+class S3StorageBackend(StorageBackend):
+    # Objects in one bucket under a key prefix. Directories are common prefixes plus
+    # an optional empty "dir/" marker object created by mkdir. The boto3 client is
+    # thread-safe and its calls run on the shared I/O executor.
+
+    min_part_size = 5 * 1024 * 1024
+    max_parts = 10000
+
+    def __init__(
+            self,
+            client,
+            bucket: str,
+            prefix: str = "",
+            part_size: int = S3_PART_SIZE,
+            max_concurrency: int = S3_MAX_CONCURRENCY,
+            executor: IOExecutor = io_executor
+    ):
+        super().__init__(executor)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = normalize_key(prefix)
+        self.part_size = max(part_size, self.min_part_size)
+        self.max_concurrency = max(1, max_concurrency)
+
+    @classmethod
+    def from_env(cls, prefix: str = "") -> "S3StorageBackend":
+        client = boto3.client(
+            "s3",
+            endpoint_url=S3_ENDPOINT_URL,
+            region_name=S3_REGION,
+            aws_access_key_id=S3_ACCESS_KEY_ID,
+            aws_secret_access_key=S3_SECRET_ACCESS_KEY,
+            config=Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS, retries={"mode": "standard"}),
+        )
+        return cls(client, S3_BUCKET, posixpath.join(normalize_key(S3_PREFIX), normalize_key(prefix)))
+
+    def object_key(self, key: str) -> str:
+        key = normalize_key(key)
+        if self.prefix and key:
+            return f"{self.prefix}/{key}"
+        return self.prefix or key
+
+    def dir_prefix(self, key: str) -> str:
+        object_key = self.object_key(key)
+        return f"{object_key}/" if object_key else ""
+
+    async def stat(self, key: str) -> Optional[FileStat]:
+        key = normalize_key(key)
+        if not key:
+            return FileStat(name="", size=0, mtime=0.0, is_dir=True)
+        try:
+            head = await self.run(lambda: self.client.head_object(Bucket=self.bucket, Key=self.object_key(key)))
+            return FileStat(
+                name=posixpath.basename(key),
+                size=head["ContentLength"],
+                mtime=head["LastModified"].timestamp(),
+                is_dir=False,
+                etag=head.get("ETag"),
+            )
+        except ClientError as e:
+            if not is_not_found(e):
+                raise
+
+        listing = await self.run(lambda: self.client.list_objects_v2(
+            Bucket=self.bucket, Prefix=self.dir_prefix(key), MaxKeys=1
+        ))
+        if listing.get("KeyCount", 0) > 0:
+            return FileStat(name=posixpath.basename(key), size=0, mtime=0.0, is_dir=True)
+        return None
+
+    def list_sync(self, key: str) -> tuple:
+        dir_prefix = self.dir_prefix(key)
+        directories = []
+        files = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=dir_prefix, Delimiter="/"):
+            for common_prefix in page.get("CommonPrefixes", []):
+                directories.append(common_prefix["Prefix"][len(dir_prefix):].rstrip("/"))
+            for obj in page.get("Contents", []):
+                name = obj["Key"][len(dir_prefix):]
+                if not name:
+                    continue
+                files.append({"name": name, "size": obj["Size"], "mtime": obj["LastModified"].timestamp(),
+                              "etag": obj.get("ETag")})
+        return directories, files
+
+    async def list(self, key: str) -> tuple:
+        return await self.run(self.list_sync, key)
+
+    async def open_read(self, key: str, start: int = 0, end: Optional[int] = None,
+                        chunk_size: int = COPY_CHUNK_SIZE):
+        if end is not None and end <= start:
+            return
+        byte_range = f"bytes={start}-{'' if end is None else end - 1}"
+        response = await self.run(lambda: self.client.get_object(
+            Bucket=self.bucket, Key=self.object_key(key), Range=byte_range
+        ))
+        body = response["Body"]
+        try:
+            while True:
+                chunk = await self.run(body.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            await self.run(body.close)
+
+    async def write_stream(self, key: str, chunks: AsyncIterator[bytes],
+                           max_size: Optional[int] = None, allow_empty: bool = True) -> int:
+        # Parts are uploaded concurrently while the stream is still being read. At most
+        # max_concurrency parts are in flight, so memory stays bounded and a slow bucket
+        # pushes back on the producer. Small payloads become a single PutObject.
+        object_key = self.object_key(key)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        upload_id = None
+        uploads = []
+        in_flight = []
+        size = 0
+        part_number = 0
+        buffer = bytearray()
+
+        async def upload_part(number: int, data: bytes):
+            try:
+                response = await self.run(lambda: self.client.upload_part(
+                    Bucket=self.bucket, Key=object_key, UploadId=upload_id, PartNumber=number, Body=data
+                ))
+                return {"PartNumber": number, "ETag": response["ETag"]}
+            finally:
+                semaphore.release()
+
+        async def flush_part():
+            nonlocal upload_id, part_number
+            if upload_id is None:
+                created = await self.run(lambda: self.client.create_multipart_upload(Bucket=self.bucket, Key=object_key))
+                upload_id = created["UploadId"]
+            part_number += 1
+            await semaphore.acquire()
+            # A failed part fails the upload now, not after the rest of the body has been
+            # read and sent. At most max_concurrency parts are unfinished, so this stays cheap.
+            for task in in_flight:
+                if task.done() and task.exception() is not None:
+                    semaphore.release()
+                    raise task.exception()
+            in_flight[:] = [task for task in in_flight if not task.done()]
+            task = asyncio.ensure_future(upload_part(part_number, bytes(buffer[:self.part_size])))
+            uploads.append(task)
+            in_flight.append(task)
+            del buffer[:self.part_size]
+
+        try:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if max_size and size > max_size:
+                    raise PayloadTooLarge(f"Payload exceeds {max_size} bytes")
+                buffer += chunk
+                while len(buffer) >= self.part_size:
+                    await flush_part()
+
+            if size == 0 and not allow_empty:
+                raise EmptyPayload("No data received")
+
+            if upload_id is None:
+                data = bytes(buffer)
+                await self.run(lambda: self.client.put_object(Bucket=self.bucket, Key=object_key, Body=data))
+                return size
+
+            if buffer:
+                await flush_part()
+            parts = await asyncio.gather(*uploads)
+            await self.run(lambda: self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=object_key, UploadId=upload_id, MultipartUpload={"Parts": list(parts)}
+            ))
+            return size
+        except BaseException:
+            for task in uploads:
+                task.cancel()
+            await asyncio.gather(*uploads, return_exceptions=True)
+            if upload_id is not None:
+                await self.run(lambda: self.client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=object_key, UploadId=upload_id
+                ))
+            raise
+
+    async def delete(self, key: str):
+        if not await self.isfile(key):
+            raise FileNotFoundError(key)
+        await self.run(lambda: self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key)))
+
+    async def mkdir(self, key: str, exist_ok: bool = True):
+        if not exist_ok and await self.exists(key):
+            raise FileExistsError(key)
+        marker = self.dir_prefix(key)
+        if marker:
+            await self.run(lambda: self.client.put_object(Bucket=self.bucket, Key=marker, Body=b""))
+
+    async def rmdir(self, key: str):
+        if not await self.is_empty_dir(key):
+            raise OSError(f"Directory not empty: {key}")
+        marker = self.dir_prefix(key)
+        await self.run(lambda: self.client.delete_object(Bucket=self.bucket, Key=marker))
+
+    async def is_empty_dir(self, key: str) -> bool:
+        marker = self.dir_prefix(key)
+        listing = await self.run(lambda: self.client.list_objects_v2(Bucket=self.bucket, Prefix=marker, MaxKeys=2))
+        return all(obj["Key"] == marker for obj in listing.get("Contents", []))
+
+    def delete_tree_sync(self, key: str) -> int:
+        # Each listed page (at most 1000 keys) is removed with a single DeleteObjects call
+        marker = self.dir_prefix(key)
+        if not marker:
+            raise ValueError("Refusing to delete the storage root")
+        removed = 0
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=marker, PaginationConfig={"PageSize": DELETE_BATCH_SIZE}):
+            objects = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+            if not objects:
+                continue
+            response = self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True})
+            errors = response.get("Errors", [])
+            if errors:
+                raise OSError(f"Failed to delete {len(errors)} objects under {key}: {errors[0].get('Message')}")
+            removed += sum(1 for obj in objects if obj["Key"] != marker)
+        return removed
+
+    async def delete_tree(self, key: str) -> int:
+        return await self.run(self.delete_tree_sync, key)
+
+    async def create_multipart(self, key: str, size: int, part_size: int) -> dict:
+        object_key = self.object_key(key)
+        created = await self.run(lambda: self.client.create_multipart_upload(Bucket=self.bucket, Key=object_key))
+        return {"upload_id": created["UploadId"], "object_key": object_key, "part_size": part_size}
+
+    async def write_part(self, token: dict, offset: int, data_chunks: AsyncIterator[bytes], length: int):
+        # A part must be sent with a known length, so it is spooled first (in memory for
+        # typical part sizes, on disk above PART_SPOOL_SIZE)
+        part_number = offset // token["part_size"] + 1
+        spool = tempfile.SpooledTemporaryFile(max_size=PART_SPOOL_SIZE)
+        try:
+            async for chunk in data_chunks:
+                await self.run(spool.write, chunk)
+            await self.run(spool.seek, 0)
+            await self.run(lambda: self.client.upload_part(
+                Bucket=self.bucket, Key=token["object_key"], UploadId=token["upload_id"],
+                PartNumber=part_number, Body=spool, ContentLength=length
+            ))
+        finally:
+            spool.close()
+
+    def complete_multipart_sync(self, token: dict):
+        # Part ETags are looked up from S3, so parts may have been sent by any worker
+        parts = []
+        paginator = self.client.get_paginator("list_parts")
+        for page in paginator.paginate(Bucket=self.bucket, Key=token["object_key"], UploadId=token["upload_id"]):
+            for part in page.get("Parts", []):
+                parts.append({"PartNumber": part["PartNumber"], "ETag": part["ETag"]})
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=token["object_key"], UploadId=token["upload_id"],
+            MultipartUpload={"Parts": sorted(parts, key=lambda p: p["PartNumber"])}
+        )
+
+    async def complete_multipart(self, token: dict, key: str):
+        if token["object_key"] != self.object_key(key):
+            raise ValueError("Multipart upload was created for a different key")
+        await self.run(self.complete_multipart_sync, token)
+
+    async def abort_multipart(self, token: dict):
+        try:
+            await self.run(lambda: self.client.abort_multipart_upload(
+                Bucket=self.bucket, Key=token["object_key"], UploadId=token["upload_id"]
+            ))
+        except ClientError as e:
+            if not is_not_found(e) and e.response.get("Error", {}).get("Code") != "NoSuchUpload":
+                raise
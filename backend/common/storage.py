@@ -0,0 +1,501 @@
+# backend/common/storage.py
+
+import os
+import stat
+import time
+import uuid
+import asyncio
+import posixpath
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, BinaryIO, Callable, NamedTuple, Optional
+
+# Size of the dedicated disk I/O pool, separate from Starlette's default threadpool
+IO_WORKERS = int(os.environ.get("IO_WORKERS", min(32, (os.cpu_count() or 1) * 4)))
+# Writes of streamed bodies are coalesced up to this size before hitting the executor
+WRITE_BUFFER_SIZE = 1024 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+# Prefix of in-progress temp files; listings skip these
+TEMP_PREFIX = ".storage-tmp-"
+
+# "local" (default) or "s3"
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "local").lower()
+
+
+class PayloadTooLarge(Exception):
+    pass
+
+
+class EmptyPayload(Exception):
+    pass
+
+
+class FileStat(NamedTuple):
+    name: str
+    size: int
+    mtime: float
+    is_dir: bool
+    etag: Optional[str] = None
+
+
+class IOExecutor:
+    # Thread pool for blocking filesystem calls that keeps queue depth and latency
+    # counters, so disk stalls show up as numbers instead of a frozen event loop.
+
+    def __init__(self, max_workers: int, name: str = "storage-io"):
+        self.max_workers = max_workers
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_seconds_total = 0.0
+        self.run_seconds_total = 0.0
+        self.max_wait_seconds = 0.0
+        self.max_run_seconds = 0.0
+
+    async def run(self, func: Callable, *args):
+        submitted = time.perf_counter()
+        with self.lock:
+            self.queued += 1
+
+        def task():
+            started = time.perf_counter()
+            wait = started - submitted
+            with self.lock:
+                self.queued -= 1
+                self.active += 1
+                self.wait_seconds_total += wait
+                if wait > self.max_wait_seconds:
+                    self.max_wait_seconds = wait
+            ok = False
+            try:
+                result = func(*args)
+                ok = True
+                return result
+            finally:
+                elapsed = time.perf_counter() - started
+                with self.lock:
+                    self.active -= 1
+                    self.completed += 1
+                    if not ok:
+                        self.failed += 1
+                    self.run_seconds_total += elapsed
+                    if elapsed > self.max_run_seconds:
+                        self.max_run_seconds = elapsed
+
+        return await asyncio.get_running_loop().run_in_executor(self.pool, task)
+
+    def stats(self) -> dict:
+        with self.lock:
+            completed = self.completed or 1
+            return {
+                "workers": self.max_workers,
+                "queued": self.queued,
+                "active": self.active,
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_wait_seconds": self.wait_seconds_total / completed,
+                "avg_run_seconds": self.run_seconds_total / completed,
+                "max_wait_seconds": self.max_wait_seconds,
+                "max_run_seconds": self.max_run_seconds,
+                "wait_seconds_total": self.wait_seconds_total,
+                "run_seconds_total": self.run_seconds_total,
+            }
+
+
+io_executor = IOExecutor(IO_WORKERS)
+
+
+def normalize_key(key: Optional[str]) -> str:
+    # "/"-separated path relative to the storage root, "" for the root itself
+    key = (key or "").replace("\\", "/").lstrip("/")
+    normalized = posixpath.normpath(key) if key else ""
+    if normalized in ("", "."):
+        return ""
+    if normalized == ".." or normalized.startswith("../"):
+        raise ValueError(f"Key outside of storage root: {key}")
+    return normalized
+
+
+def local_etag(stat_result: os.stat_result) -> str:
+    # Strong validator: any rewrite changes the mtime or the inode (atomic rename)
+    return f'"{stat_result.st_ino:x}-{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+async def iterate_fileobj(source: BinaryIO, executor: IOExecutor, chunk_size: int = COPY_CHUNK_SIZE):
+    while True:
+        chunk = await executor.run(source.read, chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+class StorageBackend(ABC):
+    # Interface every router depends on. Keys are normalized "/"-separated paths
+    # relative to the backend root. Multipart uploads are addressed by an opaque,
+    # JSON-serializable token so they can be resumed from another worker process.
+
+    # Smallest part size the backend accepts for every part but the last, and the
+    # largest number of parts of one multipart upload (None for no limit)
+    min_part_size = 1
+    max_parts = None
+
+    def __init__(self, executor: IOExecutor = io_executor):
+        self.executor = executor
+
+    async def run(self, func: Callable, *args):
+        return await self.executor.run(func, *args)
+
+    def local_path(self, key: str) -> Optional[str]:
+        # Filesystem path of key when the backend is local, which enables zero-copy sends
+        return None
+
+    async def dir_version(self, key: str) -> Optional[int]:
+        # Cheap change marker of a directory, None when the backend cannot provide one
+        return None
+
+    async def isdir(self, key: str) -> bool:
+        file_stat = await self.stat(key)
+        return file_stat is not None and file_stat.is_dir
+
+    async def isfile(self, key: str) -> bool:
+        file_stat = await self.stat(key)
+        return file_stat is not None and not file_stat.is_dir
+
+    async def exists(self, key: str) -> bool:
+        return await self.stat(key) is not None
+
+    async def write_fileobj(self, key: str, source: BinaryIO) -> int:
+        return await self.write_stream(key, iterate_fileobj(source, self.executor))
+
+    @abstractmethod
+    async def stat(self, key: str) -> Optional[FileStat]:
+        ...
+
+    @abstractmethod
+    async def list(self, key: str) -> tuple:
+        # Returns (directory names, file dicts with name/size/mtime/etag) of one level
+        ...
+
+    @abstractmethod
+    def open_read(self, key: str, start: int = 0, end: Optional[int] = None,
+                  chunk_size: int = COPY_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        ...
+
+    @abstractmethod
+    async def write_stream(self, key: str, chunks: AsyncIterator[bytes],
+                           max_size: Optional[int] = None, allow_empty: bool = True) -> int:
+        # Atomic: readers see either the previous object or the complete new one
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    async def mkdir(self, key: str, exist_ok: bool = True):
+        ...
+
+    @abstractmethod
+    async def rmdir(self, key: str):
+        # Removes an empty directory
+        ...
+
+    @abstractmethod
+    async def is_empty_dir(self, key: str) -> bool:
+        ...
+
+    async def delete_tree(self, key: str) -> int:
+        # Removes a directory with everything below it, returns the number of files removed.
+        # Generic version on top of list/delete/rmdir, backends override it with bulk calls.
+        directories, files = await self.list(key)
+        results = await asyncio.gather(
+            *(self.delete_tree(posixpath.join(key, name)) for name in directories),
+            *(self.delete(posixpath.join(key, entry["name"])) for entry in files),
+        )
+        await self.rmdir(key)
+        return sum(results[:len(directories)]) + len(files)
+
+    @abstractmethod
+    async def create_multipart(self, key: str, size: int, part_size: int) -> dict:
+        ...
+
+    @abstractmethod
+    async def write_part(self, token: dict, offset: int, data_chunks: AsyncIterator[bytes], length: int):
+        # Writes the part starting at offset (a multiple of part_size) durably
+        ...
+
+    @abstractmethod
+    async def complete_multipart(self, token: dict, key: str):
+        ...
+
+    @abstractmethod
+    async def abort_multipart(self, token: dict):
+        ...
+
+
+def copy_fileobj_to_path(source: BinaryIO, path: str) -> int:
+    size = 0
+    with open(path, "wb") as out:
+        while True:
+            chunk = source.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            out.write(chunk)
+            size += len(chunk)
+    return size
+
+
+def replace_with_fileobj(source: BinaryIO, tmp_path: str, target: str) -> int:
+    # Copy, rename and cleanup as one blocking call, i.e. one executor hop per file
+    try:
+        size = copy_fileobj_to_path(source, tmp_path)
+        os.replace(tmp_path, target)
+        return size
+    finally:
+        remove_if_exists(tmp_path)
+
+
+def write_all(fd: int, data: bytes):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def pwrite_all(fd: int, data: bytes, offset: int):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def remove_if_exists(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def scan_local_directory(path: str) -> tuple:
+    directories = []
+    files = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.startswith(TEMP_PREFIX):
+                continue
+            if entry.is_dir():
+                directories.append(entry.name)
+            else:
+                # DirEntry.stat() is cached on the entry, no extra getsize() syscall
+                st = entry.stat()
+                files.append({"name": entry.name, "size": st.st_size, "mtime": st.st_mtime, "etag": local_etag(st)})
+    return directories, files
+
+
+def remove_local_tree(path: str) -> int:
+    # Bottom-up, so every directory is empty by the time it is removed. Entries removed
+    # concurrently by someone else are skipped.
+    removed = 0
+    for directory, dirnames, filenames in os.walk(path, topdown=False):
+        for filename in filenames:
+            try:
+                os.remove(os.path.join(directory, filename))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        for dirname in dirnames:
+            dir_path = os.path.join(directory, dirname)
+            try:
+                if os.path.islink(dir_path):
+                    os.remove(dir_path)
+                else:
+                    os.rmdir(dir_path)
+            except FileNotFoundError:
+                pass
+    try:
+        os.rmdir(path)
+    except FileNotFoundError:
+        pass
+    return removed
+
+
+def finalize_local_multipart(staging_path: str, target: str):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.isdir(target):
+        raise IsADirectoryError(f"A directory exists at {target}")
+    os.replace(staging_path, target)
+
+
+class LocalStorageBackend(StorageBackend):
+    # Directory tree on the local filesystem; every blocking call runs on the executor.
+    # Multipart uploads are a preallocated staging file written in place with os.pwrite.
+
+    def __init__(self, root: str, staging_dir: Optional[str] = None, executor: IOExecutor = io_executor):
+        super().__init__(executor)
+        self.root = os.path.abspath(root)
+        self.staging_dir = os.path.abspath(staging_dir) if staging_dir else self.root
+
+    def path(self, key: str = "") -> str:
+        key = normalize_key(key)
+        return os.path.join(self.root, *key.split("/")) if key else self.root
+
+    def local_path(self, key: str) -> Optional[str]:
+        return self.path(key)
+
+    def key(self, path: str) -> str:
+        relative = os.path.relpath(os.path.abspath(path), self.root)
+        return "" if relative == "." else normalize_key(relative.replace(os.sep, "/"))
+
+    def temp_path(self, key: str) -> str:
+        return os.path.join(os.path.dirname(self.path(key)), f"{TEMP_PREFIX}{uuid.uuid4().hex}")
+
+    def staging_path(self, token: dict) -> str:
+        staging_id = uuid.UUID(token["staging_id"]).hex
+        return os.path.join(self.staging_dir, f"{TEMP_PREFIX}{staging_id}.part")
+
+    async def dir_version(self, key: str) -> Optional[int]:
+        try:
+            return (await self.run(os.stat, self.path(key))).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    async def stat(self, key: str) -> Optional[FileStat]:
+        key = normalize_key(key)
+        try:
+            st = await self.run(os.stat, self.path(key))
+        except FileNotFoundError:
+            return None
+        return FileStat(
+            name=posixpath.basename(key),
+            size=st.st_size,
+            mtime=st.st_mtime,
+            is_dir=stat.S_ISDIR(st.st_mode),
+            etag=local_etag(st),
+        )
+
+    async def list(self, key: str) -> tuple:
+        return await self.run(scan_local_directory, self.path(key))
+
+    async def open_read(self, key: str, start: int = 0, end: Optional[int] = None,
+                        chunk_size: int = COPY_CHUNK_SIZE):
+        fd = await self.run(os.open, self.path(key), os.O_RDONLY)
+        try:
+            if end is None:
+                end = (await self.run(os.fstat, fd)).st_size
+            position = start
+            while position < end:
+                chunk = await self.run(os.pread, fd, min(chunk_size, end - position), position)
+                if not chunk:
+                    break
+                position += len(chunk)
+                yield chunk
+        finally:
+            await self.run(os.close, fd)
+
+    async def write_fileobj(self, key: str, source: BinaryIO) -> int:
+        # Copies a sync file object (e.g. UploadFile.file) to a temp file and renames it
+        # over the target in a single executor task.
+        return await self.run(replace_with_fileobj, source, self.temp_path(key), self.path(key))
+
+    async def write_stream(self, key: str, chunks: AsyncIterator[bytes],
+                           max_size: Optional[int] = None, allow_empty: bool = True) -> int:
+        # Consumes chunks into a temp file next to the target and atomically renames it
+        # on success. The next chunk is only pulled once the previous buffer is written,
+        # which bounds memory and pushes back on the producer.
+        target = self.path(key)
+        tmp_path = self.temp_path(key)
+        fd = await self.run(os.open, tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        size = 0
+        buffer = bytearray()
+        try:
+            try:
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    size += len(chunk)
+                    if max_size and size > max_size:
+                        raise PayloadTooLarge(f"Payload exceeds {max_size} bytes")
+                    buffer += chunk
+                    if len(buffer) >= WRITE_BUFFER_SIZE:
+                        await self.run(write_all, fd, bytes(buffer))
+                        buffer.clear()
+                if buffer:
+                    await self.run(write_all, fd, bytes(buffer))
+            finally:
+                await self.run(os.close, fd)
+
+            if size == 0 and not allow_empty:
+                raise EmptyPayload("No data received")
+            await self.run(os.replace, tmp_path, target)
+            return size
+        finally:
+            await self.run(remove_if_exists, tmp_path)
+
+    async def delete(self, key: str):
+        await self.run(os.remove, self.path(key))
+
+    async def mkdir(self, key: str, exist_ok: bool = True):
+        await self.run(os.makedirs, self.path(key), 0o777, exist_ok)
+
+    async def rmdir(self, key: str):
+        await self.run(os.rmdir, self.path(key))
+
+    async def is_empty_dir(self, key: str) -> bool:
+        return not await self.run(os.listdir, self.path(key))
+
+    async def delete_tree(self, key: str) -> int:
+        # One executor task for the whole walk instead of one per entry
+        if not normalize_key(key):
+            raise ValueError("Refusing to delete the storage root")
+        return await self.run(remove_local_tree, self.path(key))
+
+    async def create_multipart(self, key: str, size: int, part_size: int) -> dict:
+        token = {"staging_id": uuid.uuid4().hex, "part_size": part_size}
+        staging_path = self.staging_path(token)
+
+        def preallocate():
+            os.makedirs(self.staging_dir, exist_ok=True)
+            with open(staging_path, "wb") as f:
+                f.truncate(size)
+
+        await self.run(preallocate)
+        return token
+
+    async def write_part(self, token: dict, offset: int, data_chunks: AsyncIterator[bytes], length: int):
+        # Each part only touches its own byte range, so parts can be written in parallel
+        fd = await self.run(os.open, self.staging_path(token), os.O_WRONLY)
+        try:
+            written = 0
+            buffer = bytearray()
+            async for chunk in data_chunks:
+                buffer += chunk
+                if len(buffer) >= WRITE_BUFFER_SIZE:
+                    await self.run(pwrite_all, fd, bytes(buffer), offset + written)
+                    written += len(buffer)
+                    buffer.clear()
+            if buffer:
+                await self.run(pwrite_all, fd, bytes(buffer), offset + written)
+            await self.run(os.fdatasync, fd)
+        finally:
+            await self.run(os.close, fd)
+
+    async def complete_multipart(self, token: dict, key: str):
+        await self.run(finalize_local_multipart, self.staging_path(token), self.path(key))
+
+    async def abort_multipart(self, token: dict):
+        await self.run(remove_if_exists, self.staging_path(token))
+
+
+def create_storage(root: str, prefix: str = "", staging_dir: Optional[str] = None) -> StorageBackend:
+    # root is used by the local backend, prefix (relative to S3_PREFIX) by the S3 backend;
+    # both address the same logical tree so the services agree on where files live.
+    if STORAGE_BACKEND == "s3":
+        from backend.common.s3_storage import S3StorageBackend
+        return S3StorageBackend.from_env(prefix)
+    if STORAGE_BACKEND != "local":
+        raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+    return LocalStorageBackend(root, staging_dir=staging_dir)
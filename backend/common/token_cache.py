@@ -0,0 +1,91 @@
+# backend/common/token_cache.py
+
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import jwt
+
+# Maximum number of verified tokens kept per process
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 10000))
+# Upper bound (seconds) on how long verified claims are reused, also for tokens without exp
+TOKEN_CACHE_TTL = float(os.environ.get("TOKEN_CACHE_TTL", 300))
+
+
+class TokenCache:
+    # LRU of verified JWT claims keyed by the SHA-256 of the raw token, so the
+    # tokens themselves are never kept in memory. An entry is dropped at the
+    # token's exp (or after ttl, whichever comes first), so a cached token can
+    # never outlive its signature check.
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE, ttl: float = TOKEN_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def token_key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = self.token_key(token)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                claims, expires_at = entry
+                if now < expires_at:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return claims
+                del self.entries[key]
+            self.misses += 1
+        return None
+
+    def put(self, token: str, claims: dict):
+        if self.max_size <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        exp = claims.get("exp")
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, exp)
+        key = self.token_key(token)
+        with self.lock:
+            self.entries[key] = (claims, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+def decode_token(token: str, secret: str, algorithm: str, cache: Optional[TokenCache] = None,
+                 require_exp: bool = False) -> dict:
+    # Verifies signature and exp once per token; later requests with the same token only
+    # pay for a hash and a dict lookup. Raises the usual jwt exceptions on failure.
+    # The cache is shared by callers with and without require_exp, so a token cached
+    # by one that allows a missing exp is still rejected here for one that requires it.
+    if cache is not None:
+        claims = cache.get(token)
+        if claims is not None:
+            if require_exp and "exp" not in claims:
+                raise jwt.MissingRequiredClaimError("exp")
+            return claims
+
+    options = {"require": ["exp"]} if require_exp else None
+    claims = jwt.decode(token, secret, algorithms=[algorithm], options=options)
+    if cache is not None:
+        cache.put(token, claims)
+    return claims
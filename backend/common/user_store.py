@@ -0,0 +1,152 @@
+# backend/common/user_store.py
+
+import os
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+USER_DB_PATH = os.environ.get("USER_DB_PATH", os.path.join("./data", ".internal", "users.db"))
+# Positive lookups are reused for this long (seconds); other processes' writes become
+# visible after at most this delay, this process' own writes immediately
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 5))
+# Unknown usernames are remembered for this long, so logins and registrations for names
+# that do not exist do not each cost a SQLite query
+USER_NEGATIVE_CACHE_TTL = float(os.environ.get("USER_NEGATIVE_CACHE_TTL", 1))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 1024))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY NOT NULL,
+    password_hash TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+) WITHOUT ROWID
+"""
+
+SELECT_HASH = "SELECT password_hash FROM users WHERE username = ?"
+INSERT_USER = "INSERT INTO users (username, password_hash, created_at, updated_at) VALUES (?, ?, ?, ?)"
+UPDATE_HASH = "UPDATE users SET password_hash = ?, updated_at = ? WHERE username = ? AND password_hash = ?"
+COUNT_USERS = "SELECT COUNT(*) FROM users"
+
+
+class UserExists(Exception):
+    pass
+
+
+class UserStore(ABC):
+
+    @abstractmethod
+    def get_password_hash(self, username: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def create_user(self, username: str, password_hash: str):
+        # Raises UserExists when the username is taken
+        ...
+
+    @abstractmethod
+    def update_password_hash(self, username: str, old_hash: str, new_hash: str) -> bool:
+        # Compare-and-swap, False when the stored hash is no longer old_hash
+        ...
+
+    def cached(self, username: str) -> Tuple[bool, Optional[str]]:
+        # (True, hash or None) when the answer is known without a query, else (False, None)
+        return False, None
+
+    def exists(self, username: str) -> bool:
+        return self.get_password_hash(username) is not None
+
+    def __contains__(self, username: str) -> bool:
+        return self.exists(username)
+
+
+class SQLiteUserStore(UserStore):
+    # Users in a SQLite database in WAL mode, shared by every service and worker
+    # process. Readers never block the writer and vice versa; concurrent writers wait
+    # on busy_timeout. Each thread gets its own connection, whose statement cache keeps
+    # the parameterized queries prepared. username is the primary key of a WITHOUT
+    # ROWID table, so a lookup is a single B-tree search.
+
+    def __init__(self, path: str = USER_DB_PATH, cache_ttl: float = USER_CACHE_TTL, cache_size: int = USER_CACHE_SIZE,
+                 negative_cache_ttl: float = USER_NEGATIVE_CACHE_TTL):
+        self.path = path
+        self.cache_ttl = cache_ttl
+        self.negative_cache_ttl = negative_cache_ttl
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.local = threading.local()
+        self.schema_lock = threading.Lock()
+        self.schema_ready = False
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, cached_statements=64)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            with self.schema_lock:
+                if not self.schema_ready:
+                    conn.execute(SCHEMA)
+                    self.schema_ready = True
+            self.local.conn = conn
+        return conn
+
+    def cached(self, username: str) -> Tuple[bool, Optional[str]]:
+        with self.cache_lock:
+            entry = self.cache.get(username)
+            if entry is None:
+                return False, None
+            password_hash, expires_at = entry
+            if time.monotonic() > expires_at:
+                del self.cache[username]
+                return False, None
+            self.cache.move_to_end(username)
+            return True, password_hash
+
+    def remember(self, username: str, password_hash: Optional[str]):
+        # None remembers that the user does not exist, for the shorter negative TTL
+        ttl = self.cache_ttl if password_hash is not None else self.negative_cache_ttl
+        if self.cache_size <= 0 or ttl <= 0:
+            return
+        with self.cache_lock:
+            self.cache[username] = (password_hash, time.monotonic() + ttl)
+            self.cache.move_to_end(username)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def forget(self, username: str):
+        with self.cache_lock:
+            self.cache.pop(username, None)
+
+    def get_password_hash(self, username: str) -> Optional[str]:
+        hit, password_hash = self.cached(username)
+        if hit:
+            return password_hash
+        row = self.connection().execute(SELECT_HASH, (username,)).fetchone()
+        password_hash = row[0] if row is not None else None
+        self.remember(username, password_hash)
+        return password_hash
+
+    def create_user(self, username: str, password_hash: str):
+        now = time.time()
+        try:
+            self.connection().execute(INSERT_USER, (username, password_hash, now, now))
+        except sqlite3.IntegrityError:
+            raise UserExists(username)
+        self.remember(username, password_hash)
+
+    def update_password_hash(self, username: str, old_hash: str, new_hash: str) -> bool:
+        cursor = self.connection().execute(UPDATE_HASH, (new_hash, time.time(), username, old_hash))
+        self.forget(username)
+        return cursor.rowcount == 1
+
+    def count(self) -> int:
+        return self.connection().execute(COUNT_USERS).fetchone()[0]
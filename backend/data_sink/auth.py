@@ -3,41 +3,43 @@
 import os
 import jwt
 import sys
-from datetime import datetime
+import logging
 from fastapi import Depends, HTTPException, Request, Header
 from fastapi.security import OAuth2PasswordBearer
 from typing import Optional, Tuple, Dict, Any
-from backend.common.logging_utils import setup_logger
 from backend.common.auth_store import JWT_SECRET_KEY, JWT_ALGORITHM
+from backend.common.token_cache import TokenCache, decode_token
+from backend.common.metrics import auth_failures
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 backend_dir = os.path.dirname(current_dir)
 if backend_dir not in sys.path:
     sys.path.append(backend_dir)
 
-logger = setup_logger("data_sink.auth")
+logger = logging.getLogger("data_sink.auth")
 
 SECRET_KEY = os.environ.get("JWT_SECRET_KEY", JWT_SECRET_KEY)
 ALGORITHM = os.environ.get("JWT_ALGORITHM", JWT_ALGORITHM)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
+token_cache = TokenCache()
 
-def get_current_user(token: str = Depends(oauth2_scheme)) -> str:
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> str:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token, SECRET_KEY, ALGORITHM, token_cache, require_exp=True)
         username: str = payload.get("sub")
         if username is None:
+            auth_failures.inc(1, "invalid_token")
             raise HTTPException(status_code=401, detail="Invalid token")
 
-        exp = payload.get("exp")
-        if exp is None or datetime.utcnow() > datetime.fromtimestamp(exp):
-            raise HTTPException(status_code=401, detail="Token has expired")
-
         return username
     except jwt.ExpiredSignatureError:
+        auth_failures.inc(1, "expired_token")
         raise HTTPException(status_code=401, detail="Token has expired")
     except jwt.PyJWTError:
+        auth_failures.inc(1, "invalid_token")
         raise HTTPException(status_code=401, detail="Could not validate credentials")
 
 
@@ -50,30 +52,30 @@ def validate_auth(
         effective_token = authorization.replace("Bearer ", "")
 
         try:
-            payload = jwt.decode(effective_token, SECRET_KEY, algorithms=[ALGORITHM])
+            # exp stays optional here, jwt.decode rejects it when present and past
+            payload = decode_token(effective_token, SECRET_KEY, ALGORITHM, token_cache)
             username = payload.get("sub")
-            exp = payload.get("exp")
 
             if not username:
+                auth_failures.inc(1, "invalid_token")
                 logger.warning("Omission 'sub' claim in JWT Token")
                 return False, auth_info
 
-            if exp and datetime.utcnow() > datetime.fromtimestamp(exp):
-                logger.warning(f"{username}'s token is expired")
-                return False, auth_info
-
-            logger.debug(f"Successfully validated {username}'s token")
+            logger.debug("Successfully validated %s's token", username)
             auth_info["method"] = "jwt_token"
             auth_info["user"] = username
             return True, auth_info
 
         except jwt.ExpiredSignatureError:
+            auth_failures.inc(1, "expired_token")
             logger.warning("JWT token expired")
             return False, auth_info
         except jwt.PyJWTError as e:
-            logger.warning(f"JWT validation error: {str(e)}")
+            auth_failures.inc(1, "invalid_token")
+            logger.warning("JWT validation error: %s", e)
             return False, auth_info
 
+    auth_failures.inc(1, "missing_token")
     logger.warning("Failed to validate JWT token")
     return False, auth_info
 
@@ -85,7 +87,7 @@ async def validate_request_auth(
     is_valid, auth_info = validate_auth(authorization)
 
     if not is_valid:
-        logger.warning(f"Invalid access from IP {request.client.host}.")
+        logger.warning("Invalid access from IP %s.", request.client.host)
         raise HTTPException(
             status_code=401,
             detail="Failed to validate JWT token"
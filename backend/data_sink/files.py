@@ -2,60 +2,245 @@
 
 import os
 import sys
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import FileResponse
+import logging
+from typing import Annotated, Optional
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse
 from backend.data_sink.auth import get_current_user
-from backend.data_source.models import FileInfo, DirectoryContents, DATA_DIR
+from backend.data_source.models import FileInfo, DirectoryContents, DATA_DIR, SearchQuery
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 backend_dir = os.path.dirname(current_dir)
 if backend_dir not in sys.path:
     sys.path.append(backend_dir)
 
-from backend.common.logging_utils import setup_logger
+from backend.common.file_response import RangeFileResponse
+from backend.common.storage import create_storage, normalize_key
+from backend.common.content_store import ContentStore, CONTENT_ADDRESSED, CAS_DIR
+from backend.common.compression import compression_cache, with_compression_at_rest
+from backend.common.metadata_index import (
+    MetadataIndex, METADATA_INDEX_ENABLED, search_criteria, encode_search_cursor, decode_search_cursor,
+)
+from backend.common.digests import DigestStore, DIGESTS_ENABLED
+from backend.common.columnar import ColumnarStore, COLUMNAR_FORMAT, columnar_supported
+from backend.common.admission import QuotaStore, QUOTAS_ENABLED
 
-logger = setup_logger("data_sink.files")
+logger = logging.getLogger("data_sink.files")
 
 router = APIRouter(prefix="/received")
 
 RECEIVED_DIR = os.path.join(DATA_DIR, "received")
-os.makedirs(RECEIVED_DIR, exist_ok=True)
-logger.debug(f"File directory received: {RECEIVED_DIR}")
+
+# Same tree as the data source sees it: DATA_DIR/received, or the "received/" prefix on S3
+storage = create_storage(RECEIVED_DIR, prefix="received")
+
+# Received payloads stored once per content, with the file names as hardlinks to the
+# blobs; needs a local filesystem
+content_store = None
+if CONTENT_ADDRESSED:
+    if storage.local_path("") is None:
+        logger.warning("CONTENT_ADDRESSED requires local storage, storing received files as-is")
+    else:
+        content_store = ContentStore(CAS_DIR)
+
+# Content-addressed blobs are stored as received, so at-rest compression only applies without them
+if content_store is None:
+    storage = with_compression_at_rest(storage)
+
+# Shared with the data source, which indexes the rest of the data root
+metadata_index = MetadataIndex(root_key="received") if METADATA_INDEX_ENABLED else None
+digest_store = DigestStore(root_key="received") if DIGESTS_ENABLED else None
+# Received bytes count against the quota of the connector (JWT sub) that pushed them
+quota_store = QuotaStore(root_key="received") if QUOTAS_ENABLED else None
+
+# Parquet/Arrow copies of received CSV and JSON payloads, kept next to the originals
+columnar_store = None
+if COLUMNAR_FORMAT != "none":
+    if not columnar_supported():
+        logger.warning("COLUMNAR_FORMAT=%s needs pyarrow and parquet or arrow, storing received files as-is", COLUMNAR_FORMAT)
+    else:
+        columnar_store = ColumnarStore()
+
+
+def received_key(name: str) -> str:
+    try:
+        key = normalize_key(name)
+    except ValueError:
+        key = ""
+    # Received files are stored flat; nested names have no directory to go to
+    if not key or "/" in key:
+        logger.warning("Invalid received file name: %s", name)
+        raise HTTPException(status_code=400, detail="Invalid file name")
+    return key
+
+
+async def update_index(key: str):
+    if metadata_index is None:
+        return
+    try:
+        await metadata_index.refresh(storage, key)
+    except Exception as e:
+        logger.error("Failed to update metadata index for '%s': %s", key, e)
+
+
+async def record_digests(key: str, digests: dict):
+    if digest_store is None or not digests:
+        return
+    try:
+        await digest_store.record(key, await storage.stat(key), digests)
+    except Exception as e:
+        logger.error("Failed to store digests of '%s': %s", key, e)
+
+
+async def record_usage(key: str, user: str, size: int):
+    if quota_store is None:
+        return
+    try:
+        await quota_store.record(key, user, size)
+    except Exception as e:
+        logger.error("Failed to record storage usage of '%s': %s", key, e)
+
+
+async def lookup_digests(key: str, file_stat) -> Optional[dict]:
+    if digest_store is None:
+        return None
+    try:
+        return await digest_store.lookup(key, file_stat)
+    except Exception as e:
+        logger.error("Failed to read digests of '%s': %s", key, e)
+        return None
+
+
+async def reconcile_index():
+    if metadata_index is None:
+        return
+    try:
+        result = await metadata_index.reconcile(storage)
+    except Exception as e:
+        logger.error("Metadata index reconciliation failed: %s", e)
+        return
+    if result is not None:
+        logger.info("Metadata index of received files reconciled: %s", result)
+
 
 @router.get("/", response_model=DirectoryContents)
-def list_received_files(user: str = Depends(get_current_user)):
-    logger.debug(f"Request file list (User: {user})")
+async def list_received_files(digests: bool = False, user: str = Depends(get_current_user)):
+    logger.debug("Request file list (User: %s)", user)
 
-    if not os.path.isdir(RECEIVED_DIR):
-        logger.error(f"Received files directory not found: {RECEIVED_DIR}")
+    if not await storage.isdir(""):
+        logger.error("Received files directory not found: %s", RECEIVED_DIR)
         raise HTTPException(status_code=500, detail="Received files directory not found")
 
     try:
-        files = []
-        for entry in os.scandir(RECEIVED_DIR):
-            if entry.is_file():
-                file_size = os.path.getsize(entry.path)
-                files.append(FileInfo(name=entry.name, size=file_size))
+        _, entries = await storage.list("")
+        found = await digest_store.lookup_directory("", entries) if digests and digest_store is not None else {}
+        converted = await columnar_store.lookup_directory("", entries) if columnar_store is not None else {}
+        files = [
+            FileInfo(name=entry["name"], size=entry["size"], digests=found.get(entry["name"]),
+                     columnar=converted.get(entry["name"]))
+            for entry in entries
+        ]
 
-        logger.info(f"Successfully listed received file : {len(files)} files")
+        logger.info("Successfully listed received file : %s files", len(files))
         return {"path": "received", "directories": [], "files": files}
     except Exception as e:
-        logger.error(f"Error occurred during list received files: {str(e)}")
+        logger.error("Error occurred during list received files: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to list received files: {str(e)}")
 
-@router.get("/download")
-def download_received_file(name: str, user: str = Depends(get_current_user)):
-    logger.debug(f"Request to download received file: '{name}' (User: {user})")
+@router.get("/search")
+async def search_received_files(query: Annotated[SearchQuery, Query()], user: str = Depends(get_current_user)):
+    logger.debug("Received file search request: %s (User: %s)", query, user)
+
+    if metadata_index is None:
+        raise HTTPException(status_code=404, detail="Metadata index is disabled")
+    try:
+        directory = normalize_key(query.dir) if query.dir else ""
+        cursor = decode_search_cursor(query.cursor) if query.cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid directory or cursor")
+
+    try:
+        entries, next_cursor = await metadata_index.query(**search_criteria(query, directory, cursor))
+    except Exception as e:
+        logger.error("Error occurred during received file search: %s", e)
+        raise HTTPException(status_code=500, detail=f"Failed to search received files: {str(e)}")
+    return JSONResponse({
+        "path": directory,
+        "entries": entries,
+        "next_cursor": encode_search_cursor(*next_cursor) if next_cursor is not None else None,
+    })
+
+@router.api_route("/download", methods=["GET", "HEAD"])
+async def download_received_file(
+        name: str,
+        format: Optional[str] = Query(None, pattern="^(parquet|arrow)$"),
+        user: str = Depends(get_current_user)
+):
+    # format=parquet or format=arrow downloads the columnar copy instead of the original
+    logger.debug("Request to download received file: '%s' (User: %s)", name, user)
+
+    key = received_key(name)
+    file_stat = await storage.stat(key)
+    if file_stat is None or file_stat.is_dir:
+        logger.warning("Error : Tried to download not-exist file: %s", name)
+        raise HTTPException(status_code=404, detail="File not found")
+
+    if format is not None:
+        artifact_stat = None
+        if columnar_store is not None and columnar_store.format == format:
+            artifact_stat = await columnar_store.lookup(key, file_stat)
+        if artifact_stat is None:
+            raise HTTPException(status_code=404, detail=f"No {format} copy of this file")
+        logger.info("Started to download %s copy of received file: '%s' (%s bytes)", format, name, artifact_stat.size)
+        return RangeFileResponse(columnar_store.storage, columnar_store.artifact_key(key), artifact_stat,
+                                 filename=file_stat.name + columnar_store.suffix, media_type=columnar_store.media_type)
+
+    try:
+        logger.info("Started to download received file: '%s' (%s bytes)", name, file_stat.size)
+        return RangeFileResponse(storage, key, file_stat, filename=file_stat.name, compression=compression_cache,
+                                 digests=await lookup_digests(key, file_stat))
+    except Exception as e:
+        logger.error("Error occured during download received file: %s", e)
+        raise HTTPException(status_code=500, detail=f"Failed to download file: {str(e)}")
+
+
+@router.delete("/")
+async def delete_received_file(name: str, background_tasks: BackgroundTasks, user: str = Depends(get_current_user)):
+    logger.debug("Request to delete received file: '%s' (User: %s)", name, user)
 
-    file_path = os.path.join(RECEIVED_DIR, name)
-    if not os.path.isfile(file_path):
-        logger.warning(f"Error : Tried to download not-exist file: {name}")
+    key = received_key(name)
+    file_stat = await storage.stat(key)
+    if file_stat is None or file_stat.is_dir:
+        logger.warning("Attempt to delete non-existent received file: %s", name)
         raise HTTPException(status_code=404, detail="File not found")
 
     try:
-        file_size = os.path.getsize(file_path)
-        logger.info(f"Started to download received file: '{name}' ({file_size} bytes)")
-        return FileResponse(file_path, filename=name)
+        await storage.delete(key)
+        await update_index(key)
+        if digest_store is not None:
+            await digest_store.forget(key)
+        if columnar_store is not None:
+            await columnar_store.forget(key)
+        if quota_store is not None:
+            await quota_store.forget(key)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    except Exception as e:
+        logger.error("Error occurred during received file deletion: %s", e)
+        raise HTTPException(status_code=500, detail=f"Failed to delete file: {str(e)}")
+
+    if content_store is not None:
+        # Frees the blob once no other name refers to the same content
+        background_tasks.add_task(collect_garbage)
+    logger.info("Received file deleted: '%s'", name)
+    return {"msg": "File is successfully deleted", "filename": name}
+
+
+async def collect_garbage(force: bool = False):
+    try:
+        result = await content_store.maybe_collect(force)
     except Exception as e:
-        logger.error(f"Error occured during download received file: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to download file: {str(e)}")
\ No newline at end of file
+        logger.error("Error occurred during blob garbage collection: %s", e)
+        return
+    if result and result["removed"]:
+        logger.info("Removed %s unreferenced blobs (%s bytes)", result["removed"], result["removed_bytes"])
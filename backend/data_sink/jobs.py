@@ -0,0 +1,159 @@
+# backend/data_sink/jobs.py
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import urllib.error
+import urllib.request
+from typing import Dict, Optional
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from backend.data_sink.auth import get_current_user
+from backend.data_sink.files import storage, columnar_store
+from backend.common.columnar import tabular_type
+from backend.common.job_queue import JobQueue, PermanentJobError, JOB_QUEUE_ENABLED
+
+logger = logging.getLogger("data_sink.jobs")
+
+router = APIRouter(prefix="/jobs")
+
+# Receives a JSON POST for every stored payload, e.g. to start processing downstream
+RECEIVE_WEBHOOK_URL = os.environ.get("RECEIVE_WEBHOOK_URL")
+# Sent as "Authorization: Bearer <token>" when set
+RECEIVE_WEBHOOK_TOKEN = os.environ.get("RECEIVE_WEBHOOK_TOKEN")
+RECEIVE_WEBHOOK_TIMEOUT = float(os.environ.get("RECEIVE_WEBHOOK_TIMEOUT", 10))
+
+# Work that follows a stored payload runs here instead of in the receive request, so
+# an EDC transfer is answered as soon as its data is safely written
+job_queue = JobQueue() if JOB_QUEUE_ENABLED else None
+
+
+async def convert_job(payload: dict) -> Optional[dict]:
+    if columnar_store is None:
+        raise PermanentJobError("Columnar conversion is disabled")
+    key = payload["key"]
+    try:
+        result = await columnar_store.convert(storage, key, payload.get("content_type"))
+    except ValueError as e:
+        # Not parseable as CSV/JSON, another attempt would fail the same way
+        raise PermanentJobError(str(e)) from e
+    if result is not None:
+        logger.info("Converted '%s' (%s) to %s: %s rows, %s columns",
+                    key, result["source_type"], result["format"], result["rows"], result["columns"])
+    return result
+
+
+def post_webhook(document: dict) -> dict:
+    headers = {"Content-Type": "application/json"}
+    if RECEIVE_WEBHOOK_TOKEN:
+        headers["Authorization"] = f"Bearer {RECEIVE_WEBHOOK_TOKEN}"
+    request = urllib.request.Request(RECEIVE_WEBHOOK_URL, data=json.dumps(document).encode(), headers=headers,
+                                     method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=RECEIVE_WEBHOOK_TIMEOUT) as response:
+            return {"status": response.status}
+    except urllib.error.HTTPError as e:
+        # Client errors other than timeouts and rate limits will not go away by retrying
+        if 400 <= e.code < 500 and e.code not in (408, 429):
+            raise PermanentJobError(f"Webhook answered {e.code}") from e
+        raise
+
+
+async def notify_job(payload: dict) -> Optional[dict]:
+    if not RECEIVE_WEBHOOK_URL:
+        raise PermanentJobError("RECEIVE_WEBHOOK_URL is not set")
+    return await storage.run(post_webhook, payload)
+
+
+JOB_HANDLERS = {"convert": convert_job, "notify": notify_job}
+
+
+def register_handlers(queue: JobQueue):
+    # Only the kinds schedule_post_receive can enqueue; with neither enabled the queue
+    # has no handlers and start() runs no workers polling the database
+    if columnar_store is not None:
+        queue.register("convert", convert_job)
+    if RECEIVE_WEBHOOK_URL:
+        queue.register("notify", notify_job)
+
+
+if job_queue is not None:
+    register_handlers(job_queue)
+
+
+async def run_once(kind: str, payload: dict):
+    # Without the queue: a single attempt after the response, as a background task
+    try:
+        await JOB_HANDLERS[kind](payload)
+    except Exception as e:
+        logger.warning("Post-receive %s of '%s' failed: %s", kind, payload.get("key"), e)
+
+
+async def schedule_post_receive(key: str, content_type: str, size: int, digests: Dict[str, str],
+                                background_tasks: BackgroundTasks) -> Dict[str, Optional[int]]:
+    # Jobs for a stored payload by kind, with their ids (None when run as a background task)
+    jobs = {}
+    if columnar_store is not None and tabular_type(key, content_type) is not None:
+        jobs["convert"] = {"key": key, "content_type": content_type}
+    if RECEIVE_WEBHOOK_URL:
+        jobs["notify"] = {"event": "file.received", "key": key, "size": size, "content_type": content_type,
+                          "digests": digests, "received_at": time.time()}
+
+    scheduled = {}
+    for kind, payload in jobs.items():
+        if job_queue is not None:
+            try:
+                # A conversion of the same file still waiting converts the latest payload anyway
+                scheduled[kind] = await job_queue.enqueue(kind, payload, dedupe_key=key if kind == "convert" else None)
+                continue
+            except sqlite3.Error as e:
+                logger.error("Failed to enqueue %s of '%s', running it once instead: %s", kind, key, e)
+        background_tasks.add_task(run_once, kind, payload)
+        scheduled[kind] = None
+    return scheduled
+
+
+def start_workers():
+    if job_queue is not None:
+        job_queue.start()
+
+
+async def stop_workers():
+    if job_queue is not None:
+        await job_queue.stop()
+
+
+def require_queue() -> JobQueue:
+    if job_queue is None:
+        raise HTTPException(status_code=404, detail="Job queue is disabled")
+    return job_queue
+
+
+@router.get("/")
+async def list_jobs(
+        status: Optional[str] = Query(None, pattern="^(queued|running|done|failed)$"),
+        kind: Optional[str] = None,
+        before: Optional[int] = Query(None, ge=1),
+        limit: int = Query(50, ge=1, le=500),
+        user: str = Depends(get_current_user)
+):
+    # Newest first; pass next_before as before for the next page
+    logger.debug("Job list request: status=%s, kind=%s (User: %s)", status, kind, user)
+    jobs = await require_queue().list(status, kind, before, limit)
+    return {"jobs": jobs, "next_before": jobs[-1]["id"] if len(jobs) == limit else None}
+
+
+@router.get("/stats")
+async def job_stats(window: float = Query(60.0, gt=0, le=86400), user: str = Depends(get_current_user)):
+    # Jobs per status and kind, jobs finished within the last window seconds, and the
+    # queue lag: how long the oldest due job has been waiting for a worker
+    return await require_queue().stats(window)
+
+
+@router.get("/{job_id}")
+async def get_job(job_id: int, user: str = Depends(get_current_user)):
+    job = await require_queue().lookup(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
@@ -1,98 +1,152 @@
 # backend/data_sink/main.py
 
 import os
+import asyncio
 import logging.config
 import sys
-
-from backend.data_sink import files as files_router
-from backend.data_sink import receive as receive_router
-from backend.data_source.auth import router as auth_router
+from typing import Any, Dict, Optional
 
 from fastapi import FastAPI, Request
 
 from fastapi.middleware.cors import CORSMiddleware
 from backend.common.logging_utils import setup_logger, LogConfig
-from backend.common.cli_parser import get_service_settings
+from backend.common.cli_parser import get_service_settings, get_uvicorn_options, load_service_settings, export_settings
+from backend.common.metrics import setup_metrics
+from backend.common.admission import setup_admission
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 backend_dir = os.path.dirname(current_dir)
 if backend_dir not in sys.path:
     sys.path.append(backend_dir)
 
-settings = get_service_settings("data_sink")
-
-logger = setup_logger(
-    "data_sink",
-    level=settings.get("log_level"),
-    log_file=settings.get("log_file"),
-    detailed_format=settings.get("detailed_logs", False)
-)
-
-logging_config = LogConfig.get_config(
-    "data_sink",
-    log_level=settings.get("log_level"),
-    log_file=settings.get("log_file")
-)
-logging.config.dictConfig(logging_config)
-
-app = FastAPI(title="Data Sink API")
-
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    logger.debug(f"Request: {request.method} {request.url.path}")
-    response = await call_next(request)
-    logger.debug(f"Response: {request.method} {request.url.path} - Status: {response.status_code}")
-    return response
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "http://localhost:4200",  # Local development for provider frontend
-        "http://localhost:4201",  # Local development for consumer frontend
-        "http://host.docker.internal:4200",  # Docker internal access for provider frontend
-        "http://host.docker.internal:4201",  # Docker internal access for consumer frontend
-        "http://provider-frontend:4200",  # Docker service name for provider frontend
-        "http://consumer-frontend:4200",  # Docker service name for consumer frontend (internal port)
-        "http://provider:11000",  # Caddy proxy for provider
-        "http://consumer:22000",  # Caddy proxy for consumer
-    ],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-@app.on_event("startup")
-async def startup_event():
-    logger.info("Data Sink API service started.")
-    logger.info(f"Host: {settings.get('host')}, Port: {settings.get('port')}")
-    logger.info(f"Log level: {settings.get('log_level')}")
-
-    received_dir = os.path.join("./data", "received")
-    if not os.path.isdir(received_dir):
-        os.makedirs(received_dir, exist_ok=True)
-        logger.info(f"File directory generated: {received_dir}")
-    else:
-        logger.debug(f"File directory check: {received_dir}")
-
-    my_files_dir = os.path.join("./data", "uploaded")
-    if not os.path.isdir(my_files_dir):
-        os.makedirs(my_files_dir, exist_ok=True)
-        logger.info(f"File directory generated: {my_files_dir}")
-    else:
-        logger.debug(f"File directory check: {my_files_dir}")
-
-app.include_router(receive_router.router)
-app.include_router(files_router.router)
-app.include_router(auth_router)
+CORS_ORIGINS = [
+    "http://localhost:4200",  # Local development for provider frontend
+    "http://localhost:4201",  # Local development for consumer frontend
+    "http://host.docker.internal:4200",  # Docker internal access for provider frontend
+    "http://host.docker.internal:4201",  # Docker internal access for consumer frontend
+    "http://provider-frontend:4200",  # Docker service name for provider frontend
+    "http://consumer-frontend:4200",  # Docker service name for consumer frontend (internal port)
+    "http://provider:11000",  # Caddy proxy for provider
+    "http://consumer:22000",  # Caddy proxy for consumer
+]
+
+
+def create_app(settings: Optional[Dict[str, Any]] = None) -> FastAPI:
+    # Importing this module has no side effects; logging, the storage backends and the
+    # routers are set up here, once per worker process
+    if settings is None:
+        settings = load_service_settings("data_sink")
+
+    logger = setup_logger(
+        "data_sink",
+        level=settings.get("log_level"),
+        log_file=settings.get("log_file"),
+        detailed_format=settings.get("detailed_logs", False),
+        json_format=settings.get("json_logs")
+    )
+
+    # The sink also serves the data source's auth router, whose logger lives under data_source
+    logging_config = LogConfig.get_config(
+        "data_sink",
+        log_level=settings.get("log_level"),
+        log_file=settings.get("log_file"),
+        json_format=settings.get("json_logs"),
+        extra_loggers=("data_source",)
+    )
+    logging.config.dictConfig(logging_config)
+
+    from backend.data_sink import files as files_router
+    from backend.data_sink import receive as receive_router
+    from backend.data_sink import jobs as jobs_router
+    from backend.data_source.auth import router as auth_router
+
+    app = FastAPI(title="Data Sink API")
+
+    # Only installed for debug logging: an http middleware costs an extra task per request
+    # even when its log lines are filtered out
+    if logger.isEnabledFor(logging.DEBUG):
+        @app.middleware("http")
+        async def log_requests(request: Request, call_next):
+            logger.debug("Request: %s %s", request.method, request.url.path)
+            response = await call_next(request)
+            logger.debug("Response: %s %s - Status: %s", request.method, request.url.path, response.status_code)
+            return response
+
+    from backend.data_sink.auth import SECRET_KEY, ALGORITHM
+
+    # Inside CORS, so rejections still carry the CORS headers the frontend needs to read them
+    setup_admission(
+        app, SECRET_KEY, ALGORITHM,
+        transfers=[("POST", "/receive-file"), ("GET", "/received/download")],
+        uploads=[("POST", "/receive-file")],
+        quota_store=files_router.quota_store,
+    )
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=CORS_ORIGINS,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["Retry-After"],
+    )
+
+    # Outermost middleware, so its latency covers the whole stack
+    setup_metrics(app)
+
+    @app.on_event("startup")
+    async def startup_event():
+        logger.info("Data Sink API service started.")
+        logger.info("Host: %s, Port: %s", settings.get('host'), settings.get('port'))
+        logger.info("Log level: %s", settings.get('log_level'))
+
+        received_dir = os.path.join("./data", "received")
+        if not os.path.isdir(received_dir):
+            os.makedirs(received_dir, exist_ok=True)
+            logger.info("File directory generated: %s", received_dir)
+        else:
+            logger.debug("File directory check: %s", received_dir)
+
+        my_files_dir = os.path.join("./data", "uploaded")
+        if not os.path.isdir(my_files_dir):
+            os.makedirs(my_files_dir, exist_ok=True)
+            logger.info("File directory generated: %s", my_files_dir)
+        else:
+            logger.debug("File directory check: %s", my_files_dir)
+
+        if files_router.content_store is not None:
+            logger.info("Content-addressed storage enabled: %s (%s)", files_router.content_store.root,
+                        files_router.content_store.algorithm)
+            # A full walk of the blob store, so it runs next to serving rather than before it
+            app.state.garbage_collector = asyncio.create_task(files_router.collect_garbage(force=True))
+
+        # Picks up changes made while the service was down, without delaying startup
+        app.state.index_reconciler = asyncio.create_task(files_router.reconcile_index())
+        jobs_router.start_workers()
+
+    @app.on_event("shutdown")
+    async def shutdown_event():
+        await jobs_router.stop_workers()
+
+    app.include_router(receive_router.router)
+    app.include_router(files_router.router)
+    app.include_router(jobs_router.router)
+    app.include_router(auth_router)
+    return app
+
+
+def __getattr__(name: str):
+    # "backend.data_sink.main:app" still works and builds the app on first access
+    if name == "app":
+        app = globals()["app"] = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == "__main__":
     import uvicorn
 
-    logger.info(f"Data Sink API service started with uvicorn...")
-    uvicorn.run(
-        "backend.data_sink.main:app",
-        host="0.0.0.0",
-        port=settings.get("port"),
-        reload=True,
-        log_level=settings.get("log_level")
-    )
\ No newline at end of file
+    settings = get_service_settings("data_sink")
+    # The workers build their own app from these through create_app()
+    export_settings(settings)
+    uvicorn.run("backend.data_sink.main:create_app", factory=True, **get_uvicorn_options(settings))
@@ -1,11 +1,20 @@
 import os
 import sys
+import logging
 import uuid
 from datetime import datetime
-from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi import APIRouter, BackgroundTasks, Header, HTTPException, Request
+from starlette.requests import ClientDisconnect
 from backend.data_sink.auth import validate_request_auth
-from backend.data_sink.files import RECEIVED_DIR
-from backend.common.logging_utils import setup_logger
+from backend.data_sink.files import (
+    storage, received_key, content_store, collect_garbage, update_index, record_digests, columnar_store,
+    quota_store, record_usage,
+)
+from backend.data_sink.jobs import schedule_post_receive
+from backend.common.storage import PayloadTooLarge, EmptyPayload
+from backend.common.compression import create_decoder, decode_stream, UnsupportedEncoding, DecodingError
+from backend.common.digests import Digester, DigestMismatch, digest_stream, expected_digests, new_digester
+from backend.common.admission import QuotaExceeded
 
 # Set directory path to use common module
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -13,31 +22,60 @@ backend_dir = os.path.dirname(current_dir)
 if backend_dir not in sys.path:
     sys.path.append(backend_dir)
 
-logger = setup_logger("data_sink.receive")
+logger = logging.getLogger("data_sink.receive")
 router = APIRouter()
 
+# Maximum accepted payload in bytes (default 1gb). Set to 0 to disable the limit.
+MAX_RECEIVE_SIZE = int(os.environ.get("MAX_RECEIVE_SIZE", 1024 * 1024 * 1024))
+
+
 @router.post("/receive-file")
 async def receive_file(
         request: Request,
+        background_tasks: BackgroundTasks,
         authorization: str = Header(default=None)
 ):
 
-    logger.debug(f"Received authorization token: authorization={authorization}")
-    logger.debug(f"All headers: {dict(request.headers)}")
+    logger.debug("Received authorization token: authorization=%s", authorization)
+    logger.debug("All headers: %s", request.headers)
 
     auth_info = await validate_request_auth(request, authorization)
-    logger.info(f"Authentication success: method={auth_info.get('method')}, user={auth_info.get('user')}")
+    logger.info("Authentication success: method=%s, user=%s", auth_info.get('method'), auth_info.get('user'))
 
     content_type = request.headers.get("content-type", "application/octet-stream")
-    logger.debug(f"Received content-type: {content_type}")
+    logger.debug("Received content-type: %s", content_type)
 
-    body = await request.body()
-    if not body:
-        raise HTTPException(status_code=400, detail="CANNOT FIND ANY FILE DATA")
+    # Compressed bodies are decoded while streaming, so files are stored (and size-limited) uncompressed
+    content_encoding = request.headers.get("content-encoding")
+    try:
+        decoder = create_decoder(content_encoding)
+    except UnsupportedEncoding:
+        logger.warning("Rejected payload with unsupported content-encoding: %s", content_encoding)
+        raise HTTPException(status_code=415, detail="UNSUPPORTED CONTENT ENCODING")
+
+    # Repr-Digest, Content-Digest, Digest or Content-MD5 of the body as sent
+    try:
+        expected = expected_digests(request.headers)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    content_length = request.headers.get("content-length")
+    if MAX_RECEIVE_SIZE and content_length and content_length.isdigit() and int(content_length) > MAX_RECEIVE_SIZE:
+        logger.warning("Rejected payload larger than limit: %s bytes", content_length)
+        raise HTTPException(status_code=413, detail="FILE IS TOO BIG")
 
-    # File size limit code(1gb). Activate if you need :)
-    # if len(body) > 1024 * 1024 * 1024:
-    #     raise HTTPException(status_code=413, detail="FILE IS TOO BIG")
+    # The admission middleware already turned away bodies declared larger than the remaining
+    # quota; bodies without a length are cut off once they reach it
+    max_size = MAX_RECEIVE_SIZE
+    quota_remaining = None
+    if quota_store is not None:
+        try:
+            quota_remaining = await quota_store.remaining(auth_info["user"])
+        except QuotaExceeded as e:
+            logger.warning("Rejected payload from %s: %s", auth_info["user"], e)
+            raise HTTPException(status_code=413, detail=str(e))
+        if quota_remaining is not None and (not max_size or quota_remaining < max_size):
+            max_size = quota_remaining
 
     filename = None
     content_disposition = request.headers.get("content-disposition")
@@ -45,7 +83,7 @@ async def receive_file(
         try:
             filename = content_disposition.split("filename=")[1].strip('"\'')
         except Exception as e:
-            logger.warning(f"content-disposition parse failed: {e}")
+            logger.warning("content-disposition parse failed: %s", e)
 
     # If failed to parse filename then generate unique filename with timestamp and uuid
     if not filename:
@@ -62,20 +100,78 @@ async def receive_file(
 
         filename = f"edc_data_{timestamp}_{unique_id}.{extension}"
 
-    save_path = os.path.join(RECEIVED_DIR, filename)
+    key = received_key(filename)
+    # Both digests are computed while the body streams to storage. Expected digests
+    # refer to the encoded bytes, the stored ones to the decoded file; without a
+    # Content-Encoding one pass serves both.
+    raw = request.stream()
+    if decoder is not None and expected:
+        raw = digest_stream(raw, Digester(expected), storage.executor, expected)
+        expected = None
+    body = decode_stream(raw, decoder, storage.executor)
+    digester = new_digester(expected)
+    if digester is not None:
+        body = digest_stream(body, digester, storage.executor, expected)
     try:
-        os.makedirs(RECEIVED_DIR, exist_ok=True)
-
-        with open(save_path, "wb") as f:
-            f.write(body)
-        logger.info(f"File saved in: {save_path}")
+        # Only published under its final name once the whole payload has been stored
+        if content_store is not None:
+            stored = await content_store.write_stream(storage.local_path(key), body,
+                                                      max_size=max_size, allow_empty=False)
+            size = stored.size
+            logger.info("File saved as: %s (%s bytes, %s, deduplicated=%s)", key, size, stored.digest, stored.deduplicated)
+        else:
+            stored = None
+            size = await storage.write_stream(key, body, max_size=max_size, allow_empty=False)
+            logger.info("File saved as: %s (%s bytes)", key, size)
+    except PayloadTooLarge:
+        if max_size != MAX_RECEIVE_SIZE:
+            logger.warning("Payload for '%s' exceeded the remaining quota of %s", filename, auth_info["user"])
+            raise HTTPException(status_code=413, detail=f"Storage quota exceeded: {quota_remaining} bytes left")
+        logger.warning("Payload for '%s' exceeded limit of %s bytes", filename, MAX_RECEIVE_SIZE)
+        raise HTTPException(status_code=413, detail="FILE IS TOO BIG")
+    except EmptyPayload:
+        raise HTTPException(status_code=400, detail="CANNOT FIND ANY FILE DATA")
+    except DigestMismatch as e:
+        logger.warning("Payload for '%s' rejected: %s", filename, e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except DecodingError as e:
+        logger.warning("Invalid %s payload for '%s': %s", decoder.encoding, filename, e)
+        raise HTTPException(status_code=400, detail="INVALID COMPRESSED DATA")
+    except ClientDisconnect:
+        logger.warning("Client disconnected while receiving '%s', partial file discarded", filename)
+        raise HTTPException(status_code=400, detail="CLIENT DISCONNECTED")
     except Exception as e:
-        logger.error(f"Failed to save file: {e}")
+        logger.error("Failed to save file: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
+    await update_index(key)
+    await record_usage(key, auth_info["user"], size)
+    # The copy of a previous payload under this name must not outlive it, even when the
+    # new one was deduplicated to an older blob and so looks older than the copy
+    if columnar_store is not None:
+        await columnar_store.forget(key)
+    digests = digester.stored() if digester is not None else {}
+    await record_digests(key, digests)
 
-    return {
+    result = {
         "msg": "File is successfully transferred",
-        "size": len(body),
+        "size": size,
         "filename": filename,
         "content_type": content_type
-    }
\ No newline at end of file
+    }
+    if decoder is not None:
+        result["content_encoding"] = decoder.encoding
+    if digests:
+        result["digests"] = digests
+    # Conversion and notification are queued; the transfer does not wait for them
+    scheduled = await schedule_post_receive(key, content_type, size, digests, background_tasks)
+    if "convert" in scheduled:
+        result["columnar"] = columnar_store.format
+    job_ids = {kind: job_id for kind, job_id in scheduled.items() if job_id is not None}
+    if job_ids:
+        result["jobs"] = job_ids
+    if stored is not None:
+        result["digest"] = stored.digest
+        result["deduplicated"] = stored.deduplicated
+        # Replacing an existing name may have released the last reference to a blob
+        background_tasks.add_task(collect_garbage)
+    return result
@@ -2,11 +2,13 @@
 
 import os
 import sys
-from fastapi import APIRouter, HTTPException, Depends, status
+import logging
+import time
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Header, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from datetime import datetime, timedelta
 import jwt
-from passlib.context import CryptContext
 from backend.data_source.models import UserCreate, UserLogin
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -14,84 +16,169 @@ backend_dir = os.path.dirname(current_dir)
 if backend_dir not in sys.path:
     sys.path.append(backend_dir)
 
-from backend.common.logging_utils import setup_logger
-from backend.common.auth_store import users_db, JWT_SECRET_KEY, JWT_ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from backend.common.auth_store import user_store, JWT_SECRET_KEY, JWT_ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from backend.common.token_cache import TokenCache, decode_token
+from backend.common.passwords import password_hasher, PasswordPoolSaturated
+from backend.common.storage import io_executor
+from backend.common.user_store import UserExists
+from backend.common.metrics import auth_failures
 
-logger = setup_logger("data_source.auth")
+logger = logging.getLogger("data_source.auth")
 
 router = APIRouter(prefix="/auth")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 SECRET_KEY = os.environ.get("JWT_SECRET_KEY", JWT_SECRET_KEY)
 ALGORITHM = JWT_ALGORITHM
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
+token_cache = TokenCache()
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+login_stats = {
+    "attempts": 0,
+    "succeeded": 0,
+    "failed": 0,
+    "rehashed": 0,
+    "rejected": 0,
+    "latency_seconds_total": 0.0,
+    "max_latency_seconds": 0.0,
+}
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def get_password_hash(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordPoolSaturated as e:
+        logger.warning("Password hashing pool saturated: %s", e)
+        raise HTTPException(status_code=503, detail="Server busy, try again later", headers={"Retry-After": "1"})
 
 
-def get_current_user(token: str = Depends(oauth2_scheme)) -> str:
+async def verify_password(plain_password: str, hashed_password: str):
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except PasswordPoolSaturated as e:
+        login_stats["rejected"] += 1
+        logger.warning("Password hashing pool saturated: %s", e)
+        raise HTTPException(status_code=503, detail="Server busy, try again later", headers={"Retry-After": "1"})
+
+
+def record_login(started: float, succeeded: bool):
+    elapsed = time.perf_counter() - started
+    if not succeeded:
+        auth_failures.inc(1, "bad_credentials")
+    login_stats["succeeded" if succeeded else "failed"] += 1
+    login_stats["latency_seconds_total"] += elapsed
+    if elapsed > login_stats["max_latency_seconds"]:
+        login_stats["max_latency_seconds"] = elapsed
+
+
+async def lookup_password_hash(username: str) -> Optional[str]:
+    # Cached answers on the event loop; SQLite (and a new thread's connection setup, which
+    # can wait on busy_timeout) only ever on the I/O executor
+    hit, password_hash = user_store.cached(username)
+    if hit:
+        return password_hash
+    return await io_executor.run(user_store.get_password_hash, username)
+
+
+# async so the dependency runs on the event loop instead of a threadpool hop; a cache hit
+# is a hash plus a dict lookup and a miss is a single HS256 verification
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> str:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        # jwt.decode verifies exp, cached claims are evicted at exp
+        payload = decode_token(token, SECRET_KEY, ALGORITHM, token_cache, require_exp=True)
         username: str = payload.get("sub")
-        if username is None or username not in users_db:
-            logger.warning(f"Invalid username in token or user not found: {username}")
+        if username is None or await lookup_password_hash(username) is None:
+            auth_failures.inc(1, "unknown_user")
+            logger.warning("Invalid username in token or user not found: %s", username)
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
 
-        exp = payload.get("exp")
-        if exp is None or datetime.utcnow() > datetime.fromtimestamp(exp):
-            logger.warning(f"Token expired for user: {username}")
-            raise HTTPException(status_code=401, detail="Token has expired")
-
-        logger.debug(f"Authenticated user: {username}")
+        logger.debug("Authenticated user: %s", username)
         return username
     except jwt.ExpiredSignatureError:
+        auth_failures.inc(1, "expired_token")
         logger.warning("Token has expired")
         raise HTTPException(status_code=401, detail="Token has expired")
     except jwt.PyJWTError as e:
-        logger.error(f"JWT validation error: {str(e)}")
+        auth_failures.inc(1, "invalid_token")
+        logger.error("JWT validation error: %s", e)
         raise HTTPException(status_code=401, detail="Could not validate credentials")
 
 
+# Connector pulls authenticate like pushes to the sink (validate_auth there): any
+# "Authorization: Bearer <JWT>" signed with the shared key and carrying a sub claim,
+# exp optional. The sub is the connector, not an account in the user store.
+async def get_connector(request: Request, authorization: str = Header(default=None)) -> str:
+    if not authorization or not authorization.startswith("Bearer "):
+        auth_failures.inc(1, "missing_token")
+        logger.warning("Pull without bearer token from IP %s", request.client.host)
+        raise HTTPException(status_code=401, detail="Failed to validate JWT token")
+
+    try:
+        payload = decode_token(authorization[len("Bearer "):], SECRET_KEY, ALGORITHM, token_cache)
+    except jwt.ExpiredSignatureError:
+        auth_failures.inc(1, "expired_token")
+        logger.warning("Expired pull token from IP %s", request.client.host)
+        raise HTTPException(status_code=401, detail="Failed to validate JWT token")
+    except jwt.PyJWTError as e:
+        auth_failures.inc(1, "invalid_token")
+        logger.warning("Invalid pull token from IP %s: %s", request.client.host, e)
+        raise HTTPException(status_code=401, detail="Failed to validate JWT token")
+
+    connector = payload.get("sub")
+    if not connector:
+        auth_failures.inc(1, "invalid_token")
+        logger.warning("Omission 'sub' claim in pull token")
+        raise HTTPException(status_code=401, detail="Failed to validate JWT token")
+    return connector
+
+
 @router.post("/register", status_code=201)
-def register_user(user: UserCreate):
-    logger.info(f"Registration attempt for username: {user.username}")
+async def register_user(user: UserCreate):
+    logger.info("Registration attempt for username: %s", user.username)
 
-    if user.username in users_db:
-        logger.warning(f"Registration failed: Username already exists: {user.username}")
+    if await lookup_password_hash(user.username) is not None:
+        logger.warning("Registration failed: Username already exists: %s", user.username)
         raise HTTPException(status_code=400, detail="Username already registered")
 
     if len(user.password) < 6:
-        logger.warning(f"Registration failed: Password too short for user: {user.username}")
+        logger.warning("Registration failed: Password too short for user: %s", user.username)
         raise HTTPException(status_code=400, detail="Password must be at least 6 characters")
 
-    hashed_password = get_password_hash(user.password)
-    users_db[user.username] = hashed_password
+    hashed_password = await get_password_hash(user.password)
+    try:
+        # The primary key settles concurrent registrations of the same name
+        await io_executor.run(user_store.create_user, user.username, hashed_password)
+    except UserExists:
+        logger.warning("Registration failed: Username already exists: %s", user.username)
+        raise HTTPException(status_code=400, detail="Username already registered")
 
-    logger.info(f"User registered successfully: {user.username}")
+    logger.info("User registered successfully: %s", user.username)
     return {"msg": f"User '{user.username}' registered successfully."}
 
 
 @router.post("/login")
-def login(user: UserLogin):
-    logger.info(f"Login attempt for username: {user.username}")
+async def login(user: UserLogin):
+    logger.info("Login attempt for username: %s", user.username)
+    started = time.perf_counter()
+    login_stats["attempts"] += 1
 
-    stored_pwd_hash = users_db.get(user.username)
+    stored_pwd_hash = await lookup_password_hash(user.username)
     if stored_pwd_hash is None:
-        logger.warning(f"Login failed: User not found: {user.username}")
+        record_login(started, False)
+        logger.warning("Login failed: User not found: %s", user.username)
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
-    if not verify_password(user.password, stored_pwd_hash):
-        logger.warning(f"Login failed: Invalid password for user: {user.username}")
+    valid, new_hash = await verify_password(user.password, stored_pwd_hash)
+    if not valid:
+        record_login(started, False)
+        logger.warning("Login failed: Invalid password for user: %s", user.username)
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
+    if new_hash is not None and await io_executor.run(user_store.update_password_hash, user.username, stored_pwd_hash, new_hash):
+        login_stats["rehashed"] += 1
+        logger.info("Password hash upgraded for user: %s", user.username)
+
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     payload = {
         "sub": user.username,
@@ -100,11 +187,25 @@ def login(user: UserLogin):
     }
     token = jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
-    logger.info(f"User logged in successfully: {user.username}")
-    logger.debug(f"Token issued for user: {user.username}, expires in {ACCESS_TOKEN_EXPIRE_MINUTES} minutes")
+    record_login(started, True)
+    logger.info("User logged in successfully: %s", user.username)
+    logger.debug("Token issued for user: %s, expires in %s minutes", user.username, ACCESS_TOKEN_EXPIRE_MINUTES)
 
     return {
         "token": token,
         "token_type": "bearer",
         "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60
-    }
\ No newline at end of file
+    }
+
+
+@router.get("/stats")
+async def auth_stats(user: str = Depends(get_current_user)):
+    completed = login_stats["succeeded"] + login_stats["failed"]
+    return {
+        "login": {
+            **login_stats,
+            "avg_latency_seconds": login_stats["latency_seconds_total"] / (completed or 1),
+        },
+        "password_pool": password_hasher.stats(),
+        "token_cache": token_cache.stats(),
+    }
@@ -1,154 +1,531 @@
 import os
 import sys
-import shutil
-from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException
-from backend.data_source.models import DirectoryContents, FileInfo, DATA_DIR, DirectoryRequest
+import logging
+import asyncio
+import posixpath
+from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse
+from starlette.datastructures import UploadFile as FormFile
+from backend.data_source.models import (
+    DirectoryContents, DATA_DIR, INTERNAL_DIR, DirectoryRequest, SearchQuery, BatchDeleteRequest,
+)
+from backend.data_source.listing import ListingCache, LISTING_CACHE_SIZE, LISTING_CACHE_MAX_ENTRIES, encode_cursor, decode_cursor
 from backend.data_source.auth import get_current_user
-from typing import Optional
+from typing import Annotated, Optional
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 backend_dir = os.path.dirname(current_dir)
 if backend_dir not in sys.path:
     sys.path.append(backend_dir)
 
-from backend.common.logging_utils import setup_logger
+from backend.common.file_response import RangeFileResponse
+from backend.common.storage import create_storage, normalize_key
+from backend.common.compression import compression_cache, with_compression_at_rest
+from backend.common.archive import ArchiveResponse, TooManyEntries, collect_entries, archive_type_supported
+from backend.common.metadata_index import (
+    MetadataIndex, METADATA_INDEX_ENABLED, search_criteria, encode_search_cursor, decode_search_cursor,
+)
+from backend.common.digests import (
+    DigestStore, DigestMismatch, DigestingReader, DIGESTS_ENABLED, new_digester, expected_digests, parse_digest_field,
+)
+from backend.common.line_index import LineIndex, LINE_INDEX_ENABLED
+from backend.common.admission import QuotaStore, QUOTAS_ENABLED
 
-logger = setup_logger("data_source.files")
+logger = logging.getLogger("data_source.files")
 
 router = APIRouter(prefix="/files")
 
-os.makedirs(DATA_DIR, exist_ok=True)
-logger.debug(f"Checking base data directory: {DATA_DIR}")
+MAX_PAGE_SIZE = 10000
+# Most files or paths accepted by one batch upload or batch delete request
+MAX_BATCH_ITEMS = int(os.environ.get("MAX_BATCH_ITEMS", 10000))
+# Items of one batch request processed at the same time
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 32))
+# Storage key of the service's internal state, never listed or served
+INTERNAL_KEY = os.path.relpath(INTERNAL_DIR, DATA_DIR).replace(os.sep, "/")
 
+# Resumable upload parts are staged next to the session files of uploads.py
+storage = with_compression_at_rest(create_storage(DATA_DIR, staging_dir=os.path.join(INTERNAL_DIR, "uploads")))
 
-def safe_path(subpath: str) -> str:
-    base = os.path.abspath(DATA_DIR)
-    full_path = os.path.abspath(os.path.join(base, subpath))
-    if not full_path.startswith(base):
-        logger.warning(f"Directory traversal attempt detected: {subpath}")
+listing_cache = ListingCache(LISTING_CACHE_SIZE, LISTING_CACHE_MAX_ENTRIES, excluded=[INTERNAL_KEY])
+
+# Covers the whole data root, the sink keeps its "received" subtree up to date itself
+metadata_index = MetadataIndex(excluded=[INTERNAL_KEY]) if METADATA_INDEX_ENABLED else None
+
+# Checksums computed while files are written, served with listings and downloads
+digest_store = DigestStore() if DIGESTS_ENABLED else None
+
+# Sparse line offsets of text files, for previews and line slices of pulls
+line_index = LineIndex() if LINE_INDEX_ENABLED else None
+
+# Bytes stored per user, for USER_QUOTA_BYTES; shared with the sink's received files
+quota_store = QuotaStore() if QUOTAS_ENABLED else None
+
+
+def safe_key(subpath: str) -> str:
+    try:
+        key = normalize_key(subpath)
+    except ValueError:
+        logger.warning("Directory traversal attempt detected: %s", subpath)
+        raise HTTPException(status_code=400, detail="Invalid path")
+    if key == INTERNAL_KEY or key.startswith(INTERNAL_KEY + "/"):
+        logger.warning("Access to internal directory denied: %s", subpath)
+        raise HTTPException(status_code=400, detail="Invalid path")
+    return key
+
+
+def invalidate_listing(key: str, include_self: bool = False):
+    # A change in a directory also changes its size/mtime as seen from the parent listing
+    parent = posixpath.dirname(key)
+    keys = [parent, posixpath.dirname(parent)]
+    if include_self:
+        keys.append(key)
+    listing_cache.invalidate(*keys)
+
+
+async def update_index(*keys: str):
+    # The change itself already succeeded, a stale entry is fixed by the next reconciliation
+    if metadata_index is None:
+        return
+    try:
+        await metadata_index.refresh(storage, *keys)
+    except Exception as e:
+        logger.error("Failed to update metadata index for %s keys: %s", len(keys), e)
+
+
+def upload_digests(headers, digest_field: Optional[str] = None) -> dict:
+    # Expected digests of one uploaded file, from its multipart part headers
+    # (Repr-Digest, Content-Digest, Digest, Content-MD5) or a digest form field
+    try:
+        expected = expected_digests(headers)
+        if digest_field:
+            expected.update(parse_digest_field(digest_field))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return expected
+
+
+async def record_digests(key: str, digests: dict):
+    if digest_store is None or not digests:
+        return
+    try:
+        await digest_store.record(key, await storage.stat(key), digests)
+    except Exception as e:
+        logger.error("Failed to store digests of '%s': %s", key, e)
+
+
+async def forget_digests(*keys: str):
+    if digest_store is None:
+        return
+    try:
+        await digest_store.forget(*keys)
+    except Exception as e:
+        logger.error("Failed to remove digests of %s keys: %s", len(keys), e)
+
+
+async def forget_line_index(key: str):
+    if line_index is None:
+        return
+    try:
+        await storage.run(line_index.forget, key)
+    except Exception as e:
+        logger.error("Failed to remove line index of '%s': %s", key, e)
+
+
+async def record_usage(key: str, user: str, size: int):
+    if quota_store is None:
+        return
+    try:
+        await quota_store.record(key, user, size)
+    except Exception as e:
+        logger.error("Failed to record storage usage of '%s': %s", key, e)
+
+
+async def forget_usage(*keys: str):
+    if quota_store is None:
+        return
+    try:
+        await quota_store.forget(*keys)
+    except Exception as e:
+        logger.error("Failed to release storage usage of %s keys: %s", len(keys), e)
+
+
+async def lookup_digests(key: str, file_stat) -> Optional[dict]:
+    if digest_store is None:
+        return None
+    try:
+        return await digest_store.lookup(key, file_stat)
+    except Exception as e:
+        logger.error("Failed to read digests of '%s': %s", key, e)
+        return None
+
+
+async def write_upload(file_key: str, source, expected: dict) -> tuple:
+    # Hashes the file in the same executor task that copies it into storage; on a
+    # mismatch with expected the copy is discarded and DigestMismatch raised
+    digester = new_digester(expected)
+    if digester is None:
+        return await storage.write_fileobj(file_key, source), {}
+    size = await storage.write_fileobj(file_key, DigestingReader(source, digester, expected))
+    digests = digester.stored()
+    await record_digests(file_key, digests)
+    return size, digests
+
+
+async def run_batch(items: list, handler) -> list:
+    # Runs handler on every item with at most BATCH_CONCURRENCY in flight; results keep
+    # the order of items, and the failure of one item never aborts the others
+    semaphore = asyncio.Semaphore(max(1, BATCH_CONCURRENCY))
+
+    async def run_item(item):
+        async with semaphore:
+            return await handler(item)
+
+    return await asyncio.gather(*(run_item(item) for item in items))
+
+
+def batch_response(results: list) -> dict:
+    failed = sum(1 for result in results if result["status"] >= 400)
+    return {"succeeded": len(results) - failed, "failed": failed, "results": results}
+
+
+async def remove_item(target_key: str, recursive: bool = False) -> dict:
+    # Shared by the single and batch deletes, errors are HTTPExceptions either way
+    if not target_key:
         raise HTTPException(status_code=400, detail="Invalid path")
-    return full_path
+    file_stat = await storage.stat(target_key)
+    if file_stat is None:
+        raise HTTPException(status_code=404, detail="File or directory not found")
+    if file_stat.is_dir:
+        if recursive:
+            removed = await storage.delete_tree(target_key)
+        elif not await storage.is_empty_dir(target_key):
+            raise HTTPException(status_code=400, detail="Directory is not empty")
+        else:
+            await storage.rmdir(target_key)
+            removed = 0
+        invalidate_listing(target_key, include_self=True)
+        await forget_digests(target_key)
+        await forget_line_index(target_key)
+        await forget_usage(target_key)
+        return {"type": "directory", "removed_files": removed}
+    await storage.delete(target_key)
+    invalidate_listing(target_key)
+    await forget_digests(target_key)
+    await forget_line_index(target_key)
+    await forget_usage(target_key)
+    return {"type": "file"}
+
+
+async def reconcile_index():
+    if metadata_index is None:
+        return
+    try:
+        result = await metadata_index.reconcile(storage)
+    except Exception as e:
+        logger.error("Metadata index reconciliation failed: %s", e)
+        return
+    if result is not None:
+        logger.info("Metadata index reconciled: %s", result)
+
+
+async def search_index(query: SearchQuery, directory: str) -> JSONResponse:
+    if metadata_index is None:
+        raise HTTPException(status_code=404, detail="Metadata index is disabled")
+    try:
+        cursor = decode_search_cursor(query.cursor) if query.cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    try:
+        entries, next_cursor = await metadata_index.query(**search_criteria(query, directory, cursor))
+    except Exception as e:
+        logger.error("Error occurred during metadata search: %s", e)
+        raise HTTPException(status_code=500, detail=f"Failed to search files: {str(e)}")
+    return JSONResponse({
+        "path": directory,
+        "entries": entries,
+        "next_cursor": encode_search_cursor(*next_cursor) if next_cursor is not None else None,
+    })
 
 
 @router.get("/", response_model=DirectoryContents)
-def list_directory(dir: Optional[str] = None, user: str = Depends(get_current_user)):
-    logger.debug(f"Directory listing request: '{dir or 'root'}' (user: {user})")
+async def list_directory(
+        dir: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+        sort: str = Query("name", pattern="^(name|size|mtime)$"),
+        order: str = Query("asc", pattern="^(asc|desc)$"),
+        digests: bool = False,
+        user: str = Depends(get_current_user)
+):
+    logger.debug("Directory listing request: '%s' (user: %s)", dir or 'root', user)
 
-    target_dir = safe_path(dir) if dir else DATA_DIR
-    if not os.path.isdir(target_dir):
-        logger.warning(f"Request for non-existent directory: {dir}")
+    target_key = safe_key(dir) if dir else ""
+    if not await storage.isdir(target_key):
+        logger.warning("Request for non-existent directory: %s", dir)
         raise HTTPException(status_code=404, detail="Directory not found")
 
-    dirs = []
-    files = []
     try:
-        for entry in os.scandir(target_dir):
-            if entry.is_dir():
-                dirs.append(entry.name)
-            else:
-                files.append(FileInfo(name=entry.name, size=os.path.getsize(entry.path)))
+        offset = decode_cursor(cursor) if cursor else 0
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
-        logger.info(f"Directory '{dir or 'root'}' listing complete: {len(dirs)} directories, {len(files)} files")
-        return {"path": dir or "", "directories": sorted(dirs), "files": files}
+    try:
+        snapshot = await listing_cache.get(storage, target_key)
+        dirs, files, next_offset = snapshot.page(sort, order == "desc", offset, limit)
+        if digests and digest_store is not None:
+            # Entries belong to the cached snapshot, so they are copied rather than updated
+            found = await digest_store.lookup_directory(target_key, files)
+            files = [dict(entry, digests=found.get(entry["name"])) for entry in files]
+
+        logger.info("Directory '%s' listing complete: %s directories, %s files", dir or 'root', len(dirs), len(files))
+        # Entries are already plain dicts, skip response_model validation of every entry
+        return JSONResponse({
+            "path": dir or "",
+            "directories": dirs,
+            "files": files,
+            "next_cursor": encode_cursor(next_offset) if next_offset is not None else None,
+        })
     except Exception as e:
-        logger.error(f"Error occurred while listing directory: {str(e)}")
+        logger.error("Error occurred while listing directory: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to list directory: {str(e)}")
 
 
-@router.post("/", dependencies=[Depends(get_current_user)])
-def upload_file(dir: Optional[str] = Form(None), file: UploadFile = File(...), user: str = Depends(get_current_user)):
-    logger.debug(f"File upload request: '{file.filename}' -> '{dir or 'root'}' (user: {user})")
+@router.get("/search")
+async def search_files(query: Annotated[SearchQuery, Query()], user: str = Depends(get_current_user)):
+    # Answered from the metadata index alone, without touching the storage
+    logger.debug("File search request: %s (user: %s)", query, user)
+    directory = safe_key(query.dir) if query.dir else ""
+    return await search_index(query, directory)
 
-    upload_dir = safe_path(dir) if dir else DATA_DIR
-    if not os.path.isdir(upload_dir):
-        logger.info(f"Creating upload directory: {dir}")
-        os.makedirs(upload_dir, exist_ok=True)
 
-    file_path = os.path.join(upload_dir, file.filename)
+@router.post("/")
+async def upload_file(
+        dir: Optional[str] = Form(None),
+        file: UploadFile = File(...),
+        digest: Optional[str] = Form(None),
+        user: str = Depends(get_current_user)
+):
+    logger.debug("File upload request: '%s' -> '%s' (user: %s)", file.filename, dir or 'root', user)
 
-    try:
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-                logger.info(f"Deleted existing file for overwrite: {file_path}")
-                import time
-                time.sleep(0.1)
-            except Exception as e:
-                logger.error(f"Error occurred while deleting existing file: {str(e)}")
-                raise HTTPException(status_code=500, detail=f"Failed to replace existing file: {str(e)}")
+    dir_key = safe_key(dir) if dir else ""
+    file_key = safe_key(posixpath.join(dir or "", file.filename))
+    expected = upload_digests(file.headers, digest)
+    if not await storage.isdir(dir_key):
+        logger.info("Creating upload directory: %s", dir)
+        await storage.mkdir(dir_key)
 
-        with open(file_path, "wb") as out_file:
-            shutil.copyfileobj(file.file, out_file)
+    try:
+        # The new content is written to a temp file and renamed over any existing file
+        file_size, digests = await write_upload(file_key, file.file, expected)
+        invalidate_listing(file_key)
+        await record_usage(file_key, user, file_size)
+        await update_index(file_key)
 
-        file_size = os.path.getsize(file_path)
-        logger.info(f"File upload complete: '{file.filename}' ({file_size} bytes) -> '{dir or '/'}'")
-        return {"msg": f"Uploaded {file.filename} to {dir or '/'}"}
+        logger.info("File upload complete: '%s' (%s bytes) -> '%s'", file.filename, file_size, dir or '/')
+        return {"msg": f"Uploaded {file.filename} to {dir or '/'}", "size": file_size, "digests": digests}
+    except DigestMismatch as e:
+        logger.warning("Upload of '%s' rejected: %s", file.filename, e)
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.error(f"Error occurred during file upload: {str(e)}")
+        logger.error("Error occurred during file upload: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to upload file: {str(e)}")
 
 
-@router.post("/mkdir", dependencies=[Depends(get_current_user)])
-def create_directory(request: DirectoryRequest, user: str = Depends(get_current_user)):
+@router.get("/usage")
+async def storage_usage(user: str = Depends(get_current_user)):
+    # Bytes and files the user has stored over both services, and their quota if any
+    if quota_store is None:
+        raise HTTPException(status_code=404, detail="Storage usage tracking is disabled")
+    return await quota_store.usage(user)
+
+
+@router.post("/mkdir")
+async def create_directory(request: DirectoryRequest, user: str = Depends(get_current_user)):
     path = request.path
-    logger.debug(f"Directory creation request: '{path}' (user: {user})")
+    logger.debug("Directory creation request: '%s' (user: %s)", path, user)
 
-    new_dir_path = safe_path(path)
-    if os.path.exists(new_dir_path):
-        logger.warning(f"Attempt to create directory at existing path: {path}")
+    new_dir_key = safe_key(path)
+    if await storage.exists(new_dir_key):
+        logger.warning("Attempt to create directory at existing path: %s", path)
         raise HTTPException(status_code=400, detail="Path already exists")
 
     try:
-        os.makedirs(new_dir_path, exist_ok=False)
-        logger.info(f"Directory creation complete: '{path}'")
+        await storage.mkdir(new_dir_key, exist_ok=False)
+        invalidate_listing(new_dir_key)
+        await update_index(new_dir_key)
+        logger.info("Directory creation complete: '%s'", path)
         return {"msg": f"Directory '{path}' created."}
     except Exception as e:
-        logger.error(f"Error occurred during directory creation: {str(e)}")
+        logger.error("Error occurred during directory creation: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to create directory: {str(e)}")
 
 
-@router.delete("/", dependencies=[Depends(get_current_user)])
-def delete_item(path: str, user: str = Depends(get_current_user)):
-    logger.debug(f"Deletion request: '{path}' (user: {user})")
+@router.delete("/")
+async def delete_item(path: str, recursive: bool = False, user: str = Depends(get_current_user)):
+    logger.debug("Deletion request: '%s' (recursive: %s, user: %s)", path, recursive, user)
 
-    target_path = safe_path(path)
+    target_key = safe_key(path)
     try:
-        if os.path.isdir(target_path):
-            if os.listdir(target_path):
-                logger.warning(f"Attempt to delete non-empty directory: {path}")
-                raise HTTPException(status_code=400, detail="Directory is not empty")
-            os.rmdir(target_path)
-            logger.info(f"Directory deletion complete: '{path}'")
-            return {"msg": f"Directory '{path}' deleted."}
-        elif os.path.isfile(target_path):
-            os.remove(target_path)
-            logger.info(f"File deletion complete: '{path}'")
-            return {"msg": f"File '{path}' deleted."}
-        else:
-            logger.warning(f"Attempt to delete non-existent item: {path}")
-            raise HTTPException(status_code=404, detail="File or directory not found")
-    except HTTPException:
+        result = await remove_item(target_key, recursive)
+    except HTTPException as e:
+        logger.warning("Deletion of '%s' refused: %s", path, e.detail)
         raise
     except Exception as e:
-        logger.error(f"Error occurred during item deletion: {str(e)}")
+        logger.error("Error occurred during item deletion: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to delete item: {str(e)}")
+    finally:
+        await update_index(target_key)
+
+    if result["type"] == "directory":
+        logger.info("Directory deletion complete: '%s' (%s files removed)", path, result["removed_files"])
+        return {"msg": f"Directory '{path}' deleted.", "removed_files": result["removed_files"]}
+    logger.info("File deletion complete: '%s'", path)
+    return {"msg": f"File '{path}' deleted."}
+
+
+@router.post("/batch/delete")
+async def delete_items(request: BatchDeleteRequest, user: str = Depends(get_current_user)):
+    # One request, one auth check and one log line for any number of paths
+    if len(request.paths) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_ITEMS} paths per request")
+
+    async def delete_one(path: str) -> dict:
+        try:
+            target_key = safe_key(path)
+            result = await remove_item(target_key, request.recursive)
+            return {"path": path, "status": 200, **result}
+        except HTTPException as e:
+            return {"path": path, "status": e.status_code, "error": e.detail}
+        except Exception as e:
+            return {"path": path, "status": 500, "error": str(e)}
+
+    results = await run_batch(request.paths, delete_one)
+    keys = []
+    for path in request.paths:
+        try:
+            keys.append(normalize_key(path))
+        except ValueError:
+            pass
+    await update_index(*keys)
+
+    response = batch_response(results)
+    logger.info("Batch deletion complete: %s deleted, %s failed (user: %s)", response["succeeded"], response["failed"], user)
+    return response
+
+
+@router.post("/batch/upload")
+async def upload_files(request: Request, user: str = Depends(get_current_user)):
+    # Multipart form with any number of "files" parts and an optional "dir" field. The
+    # form is parsed here rather than by FastAPI to lift Starlette's 1000 files limit.
+    try:
+        form = await request.form(max_files=MAX_BATCH_ITEMS, max_fields=MAX_BATCH_ITEMS)
+    except Exception as e:
+        logger.warning("Invalid batch upload form: %s", e)
+        raise HTTPException(status_code=400, detail=f"Invalid form data: {str(e)}")
+
+    try:
+        dir = form.get("dir") or ""
+        if not isinstance(dir, str):
+            raise HTTPException(status_code=400, detail="Invalid dir field")
+        dir_key = safe_key(dir) if dir else ""
+        uploads = [item for item in form.getlist("files") if isinstance(item, FormFile)]
+        if not uploads:
+            raise HTTPException(status_code=400, detail="No files in request")
+
+        # Filenames may carry subdirectories (folder uploads) but must stay below dir; each
+        # directory is created once
+        targets = []
+        for upload in uploads:
+            try:
+                name = normalize_key(upload.filename)
+                targets.append((upload, safe_key(posixpath.join(dir_key, name)) if name else None))
+            except (ValueError, HTTPException):
+                targets.append((upload, None))
+        parents = {posixpath.dirname(key) for _, key in targets if key}
+        try:
+            for parent in sorted(parents):
+                if not await storage.isdir(parent):
+                    await storage.mkdir(parent)
+        except Exception as e:
+            logger.error("Error occurred while creating upload directories: %s", e)
+            raise HTTPException(status_code=500, detail=f"Failed to create directories: {str(e)}")
+
+        async def write_one(target) -> dict:
+            upload, file_key = target
+            if not file_key:
+                return {"path": upload.filename, "status": 400, "error": "Invalid path"}
+            try:
+                size, digests = await write_upload(file_key, upload.file, upload_digests(upload.headers))
+                invalidate_listing(file_key)
+                await record_usage(file_key, user, size)
+                return {"path": file_key, "status": 200, "size": size, "digests": digests}
+            except HTTPException as e:
+                return {"path": file_key, "status": e.status_code, "error": e.detail}
+            except DigestMismatch as e:
+                return {"path": file_key, "status": 400, "error": str(e)}
+            except IsADirectoryError:
+                return {"path": file_key, "status": 409, "error": "A directory exists at the target path"}
+            except Exception as e:
+                return {"path": file_key, "status": 500, "error": str(e)}
+
+        results = await run_batch(targets, write_one)
+    finally:
+        await form.close()
+
+    await update_index(*parents, *(result["path"] for result in results if result["status"] == 200))
+    response = batch_response(results)
+    logger.info("Batch upload complete: %s stored, %s failed -> '%s' (user: %s)",
+                response["succeeded"], response["failed"], dir or '/', user)
+    return response
+
+
+@router.get("/archive")
+async def download_archive(
+        dir: Optional[str] = None,
+        format: str = Query("tar", pattern="^(tar|zip)$"),
+        compression: str = Query("none", pattern="^(none|gzip|zstd|deflate)$"),
+        include: Optional[str] = None,
+        user: str = Depends(get_current_user)
+):
+    # The whole tree in one response, streamed without a temp file. Plain tar can be
+    # resumed with Range/If-Range, tar.gz, tar.zst and zip are streamed chunked.
+    logger.debug("Archive download request: '%s' as %s/%s (user: %s)", dir or 'root', format, compression, user)
+
+    if not archive_type_supported(format, compression):
+        raise HTTPException(status_code=400, detail=f"Unsupported archive type: {format} with {compression} compression")
+    dir_key = safe_key(dir) if dir else ""
+    if not await storage.isdir(dir_key):
+        logger.warning("Archive request for non-existent directory: %s", dir)
+        raise HTTPException(status_code=404, detail="Directory not found")
+
+    root_name = posixpath.basename(dir_key) or "data"
+    try:
+        entries = await collect_entries(storage, dir_key, root_name, include=include, excluded=[INTERNAL_KEY])
+    except TooManyEntries as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        logger.error("Error occurred while collecting archive entries: %s", e)
+        raise HTTPException(status_code=500, detail=f"Failed to create archive: {str(e)}")
+
+    logger.info("Starting archive download: '%s' (%s entries, %s/%s)", dir or 'root', len(entries), format, compression)
+    return ArchiveResponse(storage, entries, root_name, archive_format=format, compression=compression)
 
 
-@router.get("/download")
-def download_file(path: str, user: str = Depends(get_current_user)):
-    logger.debug(f"File download request: '{path}' (user: {user})")
+@router.api_route("/download", methods=["GET", "HEAD"])
+async def download_file(path: str, user: str = Depends(get_current_user)):
+    logger.debug("File download request: '%s' (user: %s)", path, user)
 
-    file_path = safe_path(path)
-    if not os.path.isfile(file_path):
-        logger.warning(f"Attempt to download non-existent file: {path}")
+    file_key = safe_key(path)
+    file_stat = await storage.stat(file_key)
+    if file_stat is None or file_stat.is_dir:
+        logger.warning("Attempt to download non-existent file: %s", path)
         raise HTTPException(status_code=404, detail="File not found")
 
     try:
-        from fastapi.responses import FileResponse
-        file_size = os.path.getsize(file_path)
-        filename = os.path.basename(file_path)
-        logger.info(f"Starting file download: '{filename}' ({file_size} bytes)")
-        return FileResponse(file_path, filename=filename)
+        filename = file_stat.name
+        logger.info("Starting file download: '%s' (%s bytes)", filename, file_stat.size)
+        return RangeFileResponse(storage, file_key, file_stat, filename=filename, compression=compression_cache,
+                                 digests=await lookup_digests(file_key, file_stat))
     except Exception as e:
-        logger.error(f"Error occurred during file download: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to download file: {str(e)}")
\ No newline at end of file
+        logger.error("Error occurred during file download: %s", e)
+        raise HTTPException(status_code=500, detail=f"Failed to download file: {str(e)}")
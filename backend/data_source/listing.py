@@ -0,0 +1,142 @@
+# backend/data_source/listing.py
+
+import os
+import time
+import base64
+import posixpath
+import threading
+from collections import OrderedDict
+from operator import itemgetter
+from typing import Iterable, Optional
+from backend.common.storage import StorageBackend, normalize_key
+
+SORT_KEYS = ("name", "size", "mtime")
+
+# Maximum number of cached directories and of cached entries over all directories
+LISTING_CACHE_SIZE = int(os.environ.get("LISTING_CACHE_SIZE", 64))
+LISTING_CACHE_MAX_ENTRIES = int(os.environ.get("LISTING_CACHE_MAX_ENTRIES", 500000))
+# Lifetime (seconds) of snapshots of backends without a directory version, e.g. S3
+LISTING_CACHE_TTL = float(os.environ.get("LISTING_CACHE_TTL", 5))
+
+
+class DirectorySnapshot:
+    __slots__ = ("version", "created", "directories", "files", "sorted_views", "lock")
+
+    def __init__(self, version: Optional[int], directories: list, files: list):
+        self.version = version
+        self.created = time.monotonic()
+        self.directories = sorted(directories)
+        # Plain dicts, serialized as-is without building a model per entry
+        self.files = files
+        self.sorted_views = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.directories) + len(self.files)
+
+    def sorted_files(self, sort: str, descending: bool) -> list:
+        view_key = (sort, descending)
+        view = self.sorted_views.get(view_key)
+        if view is None:
+            with self.lock:
+                view = self.sorted_views.get(view_key)
+                if view is None:
+                    if sort == "name":
+                        view = sorted(self.files, key=itemgetter("name"), reverse=descending)
+                    else:
+                        view = sorted(self.files, key=itemgetter(sort, "name"), reverse=descending)
+                    self.sorted_views[view_key] = view
+        return view
+
+    def page(self, sort: str, descending: bool, offset: int, limit: Optional[int]):
+        directories = self.directories[::-1] if descending else self.directories
+        files = self.sorted_files(sort, descending)
+        total = len(directories) + len(files)
+        end = total if limit is None else min(total, offset + limit)
+
+        page_dirs = directories[offset:end] if offset < len(directories) else []
+        file_start = max(0, offset - len(directories))
+        file_end = max(0, end - len(directories))
+        page_files = files[file_start:file_end]
+        next_offset = end if end < total else None
+        return page_dirs, page_files, next_offset
+
+
+def encode_cursor(offset: int) -> str:
+    return base64.urlsafe_b64encode(str(offset).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    offset = int(base64.urlsafe_b64decode(padded.encode()).decode())
+    if offset < 0:
+        raise ValueError("negative cursor")
+    return offset
+
+
+async def scan_directory(storage: StorageBackend, key: str, version: Optional[int],
+                         excluded: Iterable[str] = ()) -> DirectorySnapshot:
+    directories, files = await storage.list(key)
+    if excluded:
+        directories = [d for d in directories if posixpath.join(key, d) not in excluded]
+        files = [f for f in files if posixpath.join(key, f["name"]) not in excluded]
+    return DirectorySnapshot(version, directories, files)
+
+
+class ListingCache:
+    # LRU of directory snapshots keyed by storage key. An entry is reused while the
+    # backend's directory version (the mtime on local disks) is unchanged, or for
+    # LISTING_CACHE_TTL seconds when the backend has none. Handlers that modify a
+    # directory also invalidate it explicitly, which covers changes landing within
+    # the filesystem's mtime granularity.
+
+    def __init__(self, max_dirs: int, max_entries: int, excluded: Iterable[str] = (), ttl: float = LISTING_CACHE_TTL):
+        self.max_dirs = max_dirs
+        self.max_entries = max_entries
+        self.excluded = frozenset(normalize_key(k) for k in excluded)
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.total_entries = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def is_fresh(self, snapshot: DirectorySnapshot, version: Optional[int]) -> bool:
+        if version is not None:
+            return snapshot.version == version
+        return time.monotonic() - snapshot.created < self.ttl
+
+    async def get(self, storage: StorageBackend, key: str) -> DirectorySnapshot:
+        key = normalize_key(key)
+        version = await storage.dir_version(key)
+        with self.lock:
+            snapshot = self.entries.get(key)
+            if snapshot is not None and self.is_fresh(snapshot, version):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return snapshot
+            self.misses += 1
+
+        snapshot = await scan_directory(storage, key, version, self.excluded)
+        self.put(key, snapshot)
+        return snapshot
+
+    def put(self, key: str, snapshot: DirectorySnapshot):
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.total_entries -= len(previous)
+            if len(snapshot) > self.max_entries:
+                return
+            self.entries[key] = snapshot
+            self.total_entries += len(snapshot)
+            while len(self.entries) > self.max_dirs or self.total_entries > self.max_entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_entries -= len(evicted)
+
+    def invalidate(self, *keys: str):
+        with self.lock:
+            for key in keys:
+                snapshot = self.entries.pop(normalize_key(key), None)
+                if snapshot is not None:
+                    self.total_entries -= len(snapshot)
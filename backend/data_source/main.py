@@ -1,6 +1,8 @@
 import os
+import asyncio
 import logging.config
 import sys
+from typing import Any, Dict, Optional
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 backend_dir = os.path.dirname(current_dir)
@@ -10,81 +12,134 @@ if backend_dir not in sys.path:
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from backend.common.logging_utils import setup_logger, LogConfig
-from backend.common.cli_parser import get_service_settings
-
-settings = get_service_settings("data_source")
-
-logger = setup_logger(
-    "data_source",
-    level=settings.get("log_level"),
-    log_file=settings.get("log_file"),
-    detailed_format=settings.get("detailed_logs", False)
-)
-
-logging_config = LogConfig.get_config(
-    "data_source",
-    log_level=settings.get("log_level"),
-    log_file=settings.get("log_file")
-)
-logging.config.dictConfig(logging_config)
-
-app = FastAPI(title="Data Source API")
-
-
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    logger.debug(f"Request: {request.method} {request.url.path}")
-    response = await call_next(request)
-    logger.debug(f"Response: {request.method} {request.url.path} - Status: {response.status_code}")
-    return response
-
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "http://localhost:4200",
-        "http://localhost:4201",
-        "http://host.docker.internal:4200",
-        "http://host.docker.internal:4201",
-        "http://provider-frontend:4200",
-        "http://consumer-frontend:4200",
-        "http://provider:11000",
-        "http://consumer:22000",
-    ],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-from backend.data_source.auth import router as auth_router
-from backend.data_source.files import router as files_router
-
-app.include_router(auth_router)
-app.include_router(files_router)
-
-
-@app.on_event("startup")
-async def startup_event():
-    logger.info("Data Source API service has started.")
-    logger.info(f"Host: {settings.get('host')}, Port: {settings.get('port')}")
-    logger.info(f"Log level: {settings.get('log_level')}")
-
-    data_dir = "./data"
-    if not os.path.isdir(data_dir):
-        os.makedirs(data_dir)
-        logger.info(f"Default data directory created: {data_dir}")
-    else:
-        logger.debug(f"Default data directory confirmed: {data_dir}")
+from backend.common.cli_parser import get_service_settings, get_uvicorn_options, load_service_settings, export_settings
+from backend.common.metrics import setup_metrics
+from backend.common.admission import setup_admission
+
+CORS_ORIGINS = [
+    "http://localhost:4200",
+    "http://localhost:4201",
+    "http://host.docker.internal:4200",
+    "http://host.docker.internal:4201",
+    "http://provider-frontend:4200",
+    "http://consumer-frontend:4200",
+    "http://provider:11000",
+    "http://consumer:22000",
+]
+
+
+def create_app(settings: Optional[Dict[str, Any]] = None) -> FastAPI:
+    # Importing this module has no side effects; logging, the storage backends and the
+    # routers are set up here, once per worker process
+    if settings is None:
+        settings = load_service_settings("data_source")
+
+    logger = setup_logger(
+        "data_source",
+        level=settings.get("log_level"),
+        log_file=settings.get("log_file"),
+        detailed_format=settings.get("detailed_logs", False),
+        json_format=settings.get("json_logs")
+    )
+
+    logging_config = LogConfig.get_config(
+        "data_source",
+        log_level=settings.get("log_level"),
+        log_file=settings.get("log_file"),
+        json_format=settings.get("json_logs")
+    )
+    logging.config.dictConfig(logging_config)
+
+    app = FastAPI(title="Data Source API")
+
+    # Only installed for debug logging: an http middleware costs an extra task per request
+    # even when its log lines are filtered out
+    if logger.isEnabledFor(logging.DEBUG):
+        @app.middleware("http")
+        async def log_requests(request: Request, call_next):
+            logger.debug("Request: %s %s", request.method, request.url.path)
+            response = await call_next(request)
+            logger.debug("Response: %s %s - Status: %s", request.method, request.url.path, response.status_code)
+            return response
+
+    from backend.data_source.auth import SECRET_KEY, ALGORITHM
+    from backend.data_source.files import quota_store
+
+    # Inside CORS, so rejections still carry the CORS headers the frontend needs to read them
+    setup_admission(
+        app, SECRET_KEY, ALGORITHM,
+        transfers=[
+            ("POST", "/files/"), ("POST", "/files/batch/upload"), ("PUT", "/files/uploads/[^/]+"),
+            ("GET", "/files/download"), ("GET", "/files/archive"), ("GET", "/pull/.*"),
+        ],
+        # Resumable sessions are checked against the quota when they are created
+        uploads=[("POST", "/files/"), ("POST", "/files/batch/upload")],
+        quota_store=quota_store,
+    )
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=CORS_ORIGINS,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        # Read by the frontend to page through previews and to back off when rate limited
+        expose_headers=["X-Total-Records", "Retry-After"],
+    )
+
+    # Outermost middleware, so its latency covers the whole stack
+    setup_metrics(app)
+
+    from backend.data_source.auth import router as auth_router
+    from backend.data_source.files import router as files_router, reconcile_index
+    from backend.data_source.uploads import router as uploads_router, UPLOADS_DIR
+    from backend.data_source.pull import router as pull_router
+    from backend.data_source.preview import router as preview_router
+    from backend.common.passwords import password_hasher
+
+    app.include_router(auth_router)
+    app.include_router(files_router)
+    app.include_router(uploads_router)
+    app.include_router(pull_router)
+    app.include_router(preview_router)
+
+    @app.on_event("startup")
+    async def startup_event():
+        logger.info("Data Source API service has started.")
+        logger.info("Host: %s, Port: %s", settings.get('host'), settings.get('port'))
+        logger.info("Log level: %s", settings.get('log_level'))
+
+        data_dir = "./data"
+        if not os.path.isdir(data_dir):
+            os.makedirs(data_dir)
+            logger.info("Default data directory created: %s", data_dir)
+        else:
+            logger.debug("Default data directory confirmed: %s", data_dir)
+        os.makedirs(UPLOADS_DIR, exist_ok=True)
+
+        # Picks up changes made while the service was down, without delaying startup
+        app.state.index_reconciler = asyncio.create_task(reconcile_index())
+
+    @app.on_event("shutdown")
+    async def shutdown_event():
+        password_hasher.shutdown()
+        logger.info("Data Source API service has stopped.")
+
+    return app
+
+
+def __getattr__(name: str):
+    # "backend.data_source.main:app" still works and builds the app on first access
+    if name == "app":
+        app = globals()["app"] = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
     import uvicorn
 
-    logger.info(f"Running Data Source API service with Uvicorn...")
-    uvicorn.run(
-        "backend.data_source.main:app",
-        host="0.0.0.0",
-        port=settings.get("port"),
-        reload=True,
-        log_level=settings.get("log_level")
-    )
\ No newline at end of file
+    settings = get_service_settings("data_source")
+    # The workers build their own app from these through create_app()
+    export_settings(settings)
+    uvicorn.run("backend.data_source.main:create_app", factory=True, **get_uvicorn_options(settings))
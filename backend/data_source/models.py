@@ -1,8 +1,13 @@
 # backend/data_source/models.py
 
-from pydantic import BaseModel
+import os
+from datetime import datetime
+from typing import Optional
+from pydantic import BaseModel, Field
 
 DATA_DIR = "./data"
+# Service-owned state (upload sessions, ...) kept under the data root but hidden from users
+INTERNAL_DIR = os.path.join(DATA_DIR, ".internal")
 
 class UserCreate(BaseModel):
     username: str
@@ -15,11 +20,51 @@ class UserLogin(BaseModel):
 class FileInfo(BaseModel):
     name: str
     size: int
+    mtime: Optional[float] = None
+    digests: Optional[dict[str, str]] = None
+    columnar: Optional[dict] = None
 
 class DirectoryContents(BaseModel):
     path: str
     directories: list[str]
     files: list[FileInfo]
+    next_cursor: Optional[str] = None
 
 class DirectoryRequest(BaseModel):
-    path: str
\ No newline at end of file
+    path: str
+
+class BatchDeleteRequest(BaseModel):
+    paths: list[str]
+    recursive: bool = False
+
+class SearchQuery(BaseModel):
+    dir: Optional[str] = None
+    recursive: bool = True
+    prefix: Optional[str] = None
+    glob: Optional[str] = None
+    min_size: Optional[int] = Field(None, ge=0)
+    max_size: Optional[int] = Field(None, ge=0)
+    modified_after: Optional[datetime] = None
+    modified_before: Optional[datetime] = None
+    content_type: Optional[str] = None
+    type: str = Field("file", pattern="^(file|dir|any)$")
+    sort: str = Field("path", pattern="^(path|name|size|mtime)$")
+    order: str = Field("asc", pattern="^(asc|desc)$")
+    cursor: Optional[str] = None
+    limit: int = Field(1000, ge=1, le=10000)
+
+class UploadSessionCreate(BaseModel):
+    filename: str
+    size: int
+    dir: Optional[str] = None
+    chunk_size: Optional[int] = None
+
+class UploadSessionStatus(BaseModel):
+    upload_id: str
+    filename: str
+    dir: str
+    size: int
+    chunk_size: int
+    offset: int
+    received_chunks: int
+    total_chunks: int
@@ -0,0 +1,107 @@
+# backend/data_source/preview.py
+
+import os
+import csv
+import json
+import logging
+import posixpath
+from typing import AsyncIterator, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from backend.data_source.auth import get_current_user
+from backend.data_source.files import storage, safe_key, line_index
+from backend.common.line_index import line_slice
+
+logger = logging.getLogger("data_source.preview")
+
+router = APIRouter(prefix="/files")
+
+PREVIEW_DEFAULT_RECORDS = 100
+MAX_PREVIEW_RECORDS = int(os.environ.get("MAX_PREVIEW_RECORDS", 10000))
+# Longer records are cut off, so a file without newlines cannot be previewed as one huge line
+MAX_RECORD_SIZE = int(os.environ.get("PREVIEW_MAX_RECORD_SIZE", 256 * 1024))
+PREVIEW_FORMATS = {".csv": "csv", ".tsv": "tsv", ".ndjson": "ndjson", ".jsonl": "ndjson"}
+
+
+def parse_json_line(text: str):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def encode_records(lines: List[bytes], record_format: str) -> bytes:
+    # One batch of lines as comma-separated JSON values: CSV/TSV lines as arrays of fields,
+    # NDJSON lines as their value (or the raw line when it is not valid JSON), other text
+    # as strings. Every line is one record, so windows line up with line offsets.
+    texts = [line[:MAX_RECORD_SIZE].rstrip(b"\r").decode("utf-8", errors="replace") for line in lines]
+    if record_format in ("csv", "tsv"):
+        delimiter = "," if record_format == "csv" else "\t"
+        records = [next(csv.reader((text,), delimiter=delimiter), []) for text in texts]
+    elif record_format == "ndjson":
+        records = [parse_json_line(text) for text in texts]
+    else:
+        records = texts
+    return json.dumps(records, ensure_ascii=False)[1:-1].encode()
+
+
+async def json_records(chunks: AsyncIterator[bytes], record_format: str) -> AsyncIterator[bytes]:
+    # Streams the lines of chunks as one JSON array, encoding a batch of records per chunk
+    # on the I/O executor
+    separator = b"["
+    pending = b""
+    truncated = False
+    async for chunk in chunks:
+        if truncated:
+            # Rest of an overlong line, dropped up to its end
+            end = chunk.find(b"\n")
+            if end < 0:
+                continue
+            chunk = chunk[end:]
+            truncated = False
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        if len(pending) > MAX_RECORD_SIZE:
+            pending = pending[:MAX_RECORD_SIZE]
+            truncated = True
+        if lines:
+            yield separator + await storage.run(encode_records, lines, record_format)
+            separator = b","
+    if pending:
+        yield separator + await storage.run(encode_records, [pending], record_format)
+        separator = b","
+    yield b"[]" if separator == b"[" else b"]"
+
+
+@router.get("/preview")
+async def preview_file(
+        path: str,
+        offset: int = Query(0, ge=0),
+        limit: int = Query(PREVIEW_DEFAULT_RECORDS, ge=1, le=MAX_PREVIEW_RECORDS),
+        format: Optional[str] = Query(None, pattern="^(text|csv|tsv|ndjson)$"),
+        user: str = Depends(get_current_user)
+):
+    # Records offset .. offset + limit of a line-delimited file, one record per line, so the
+    # frontend can page through large files. X-Total-Records is sent once the line count
+    # is known, i.e. after some window has reached the end of the file.
+    logger.debug("Preview request: '%s' from record %s (user: %s)", path, offset, user)
+
+    file_key = safe_key(path)
+    file_stat = await storage.stat(file_key) if file_key else None
+    if file_stat is None or file_stat.is_dir:
+        logger.warning("Attempt to preview non-existent file: %s", path)
+        raise HTTPException(status_code=404, detail="File not found")
+
+    record_format = format or PREVIEW_FORMATS.get(posixpath.splitext(file_key)[1].lower(), "text")
+    headers = {}
+    window = await line_index.window(storage, file_key, offset, limit) if line_index is not None else None
+    if window is not None:
+        start, end, total = window
+        chunks = storage.open_read(file_key, start, end)
+        if total is not None:
+            headers["x-total-records"] = str(total)
+    else:
+        chunks = line_slice(storage, file_key, offset, limit)
+
+    logger.info("Preview of '%s': records %s-%s as %s", file_key, offset, offset + limit - 1, record_format)
+    return StreamingResponse(json_records(chunks, record_format), media_type="application/json", headers=headers)
@@ -0,0 +1,70 @@
+# backend/data_source/pull.py
+
+import logging
+from mimetypes import guess_type
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from backend.data_source.auth import get_connector
+from backend.data_source.files import storage, safe_key, lookup_digests, line_index
+from backend.common.file_response import RangeFileResponse, etag_matches, make_etag
+from backend.common.compression import compression_cache
+from backend.common.line_index import line_slice
+
+logger = logging.getLogger("data_source.pull")
+
+# Provider side of EDC HttpData transfers: the data address points at /pull with
+# proxyPath/proxyQueryParams, so the consumer's path and query end up here
+router = APIRouter(prefix="/pull")
+
+
+@router.api_route("/{path:path}", methods=["GET", "HEAD"])
+async def pull_file(
+        path: str,
+        request: Request,
+        offset: int = Query(0, ge=0),
+        limit: Optional[int] = Query(None, ge=1),
+        unit: str = Query("lines", pattern="^(lines|bytes)$"),
+        connector: str = Depends(get_connector)
+):
+    # Without offset/limit the whole file, with Range/If-Range, conditional requests and
+    # the download's content negotiation. With them only that slice of the file, in
+    # lines (line-delimited files such as CSV or NDJSON) or bytes; Range then does not apply.
+    key = safe_key(path)
+    file_stat = await storage.stat(key) if key else None
+    if file_stat is None or file_stat.is_dir:
+        logger.warning("Pull of non-existent file: %s (connector: %s)", path, connector)
+        raise HTTPException(status_code=404, detail="File not found")
+
+    if not offset and limit is None:
+        logger.info("Pull of '%s' (%s bytes, connector: %s)", key, file_stat.size, connector)
+        return RangeFileResponse(storage, key, file_stat, compression=compression_cache,
+                                 digests=await lookup_digests(key, file_stat))
+
+    logger.info("Pull of '%s' %s %s-%s (connector: %s)", key, unit, offset, limit or "", connector)
+    media_type = guess_type(key)[0] or "application/octet-stream"
+    # A slice is its own representation, so it gets its own validator
+    etag = make_etag(file_stat)
+    slice_tag = f"{unit}-{offset}-{limit or ''}"
+    headers = {"etag": f'{etag[:-1]}-{slice_tag}"' if etag.endswith('"') else f'"{etag}-{slice_tag}"'}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and etag_matches(if_none_match, headers["etag"], weak=True):
+        return Response(status_code=304, headers=headers)
+    if unit == "bytes":
+        start = min(offset, file_stat.size)
+        end = file_stat.size if limit is None else min(file_stat.size, start + limit)
+    else:
+        # Local files seek through the line index; elsewhere the length of a line slice is
+        # only known once it has been sent, so it goes out chunked
+        window = await line_index.window(storage, key, offset, limit) if line_index is not None else None
+        start, end = window[:2] if window is not None else (None, None)
+    if start is not None:
+        headers["content-length"] = str(end - start)
+
+    if request.method == "HEAD":
+        body = iter(())
+    elif start is not None:
+        body = storage.open_read(key, start, end)
+    else:
+        body = line_slice(storage, key, offset, limit)
+    return StreamingResponse(body, media_type=media_type, headers=headers)
@@ -0,0 +1,353 @@
+# backend/data_source/uploads.py
+
+import os
+import sys
+import logging
+import json
+import posixpath
+import time
+import uuid
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from starlette.requests import ClientDisconnect
+from backend.data_source.models import UploadSessionCreate, UploadSessionStatus, INTERNAL_DIR
+from backend.data_source.auth import get_current_user
+from backend.data_source.files import safe_key, invalidate_listing, update_index, storage, quota_store, record_usage
+from backend.common.admission import QuotaExceeded
+from backend.common.digests import Digester, DigestMismatch, digest_stream, expected_digests
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_dir = os.path.dirname(current_dir)
+if backend_dir not in sys.path:
+    sys.path.append(backend_dir)
+
+
+logger = logging.getLogger("data_source.uploads")
+
+router = APIRouter(prefix="/files/uploads")
+
+UPLOADS_DIR = os.path.join(INTERNAL_DIR, "uploads")
+DEFAULT_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+MAX_CHUNK_SIZE = int(os.environ.get("UPLOAD_MAX_CHUNK_SIZE", 64 * 1024 * 1024))
+# Smallest chunk size for every chunk but the last; storage backends may require more
+MIN_CHUNK_SIZE = int(os.environ.get("UPLOAD_MIN_CHUNK_SIZE", 64 * 1024))
+# Largest file a session may be created for, and most chunks of one session. The size is
+# preallocated on local disks and the chunk map holds one byte per chunk.
+MAX_UPLOAD_SIZE = int(os.environ.get("UPLOAD_MAX_SIZE", 64 * 1024 * 1024 * 1024))
+MAX_CHUNKS = int(os.environ.get("UPLOAD_MAX_CHUNKS", 10000))
+# Block size in which chunk uploads scan the chunk map for the committed offset
+MAP_READ_SIZE = 4096
+# Sessions untouched for longer than this (seconds) are removed when new sessions are created
+SESSION_TTL = int(os.environ.get("UPLOAD_SESSION_TTL", 24 * 60 * 60))
+
+# Each session is two files in UPLOADS_DIR:
+#   <id>.json  immutable session metadata, including the storage multipart token
+#   <id>.map   one byte per chunk, set to 1 once the chunk is durably stored
+# Chunk data goes to the storage backend as one multipart part per chunk (a
+# preallocated staging file written with os.pwrite on local disks). Chunk writers
+# only ever touch their own part and their own byte in .map, so chunks can be
+# uploaded in parallel (also across worker processes).
+
+
+def session_paths(upload_id: str):
+    try:
+        uuid.UUID(upload_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    base = os.path.join(UPLOADS_DIR, upload_id)
+    return base + ".json", base + ".map"
+
+
+def read_session(upload_id: str) -> dict:
+    meta_path, _ = session_paths(upload_id)
+    with open(meta_path, "r") as f:
+        return json.load(f)
+
+
+def load_session(upload_id: str, user: str) -> dict:
+    try:
+        session = read_session(upload_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+
+    if session["user"] != user:
+        logger.warning("User %s tried to access upload session of %s", user, session['user'])
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return session
+
+
+def total_chunks(session: dict) -> int:
+    return max(1, -(-session["size"] // session["chunk_size"]))
+
+
+def read_chunk_map(upload_id: str) -> bytes:
+    _, map_path = session_paths(upload_id)
+    with open(map_path, "rb") as f:
+        return f.read()
+
+
+def committed_offset(session: dict, chunk_map: bytes) -> int:
+    # Offset up to which every chunk has been received, i.e. where a sequential client resumes
+    missing = chunk_map.find(b"\x00")
+    if missing == -1:
+        return session["size"]
+    return missing * session["chunk_size"]
+
+
+def read_committed_offset(session: dict) -> int:
+    # committed_offset without reading the whole map: stops at the first missing chunk,
+    # which for sequential clients is right after the one just stored
+    _, map_path = session_paths(session["upload_id"])
+    received = 0
+    with open(map_path, "rb") as f:
+        while True:
+            block = f.read(MAP_READ_SIZE)
+            missing = block.find(b"\x00")
+            if missing != -1:
+                return (received + missing) * session["chunk_size"]
+            if not block:
+                return session["size"]
+            received += len(block)
+
+
+def session_status(session: dict) -> dict:
+    chunk_map = read_chunk_map(session["upload_id"])
+    return {
+        "upload_id": session["upload_id"],
+        "filename": session["filename"],
+        "dir": session["dir"],
+        "size": session["size"],
+        "chunk_size": session["chunk_size"],
+        "offset": committed_offset(session, chunk_map),
+        "received_chunks": chunk_map.count(b"\x01"),
+        "total_chunks": len(chunk_map),
+    }
+
+
+def remove_session_files(upload_id: str):
+    for path in session_paths(upload_id):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+async def discard_session(session: dict):
+    await storage.abort_multipart(session["storage_token"])
+    await storage.run(remove_session_files, session["upload_id"])
+
+
+def find_expired_sessions() -> list:
+    now = time.time()
+    expired = []
+    for entry in os.scandir(UPLOADS_DIR):
+        if not entry.name.endswith(".json"):
+            continue
+        try:
+            if now - entry.stat().st_mtime > SESSION_TTL:
+                expired.append(read_session(entry.name[:-len(".json")]))
+        except Exception as e:
+            logger.error("Error occurred while reading expired upload session: %s", e)
+    return expired
+
+
+async def cleanup_expired_sessions():
+    for session in await storage.run(find_expired_sessions):
+        try:
+            await discard_session(session)
+            logger.info("Expired upload session removed: %s", session['upload_id'])
+        except Exception as e:
+            logger.error("Error occurred while removing expired upload session: %s", e)
+
+
+def create_session_files(session: dict):
+    meta_path, map_path = session_paths(session["upload_id"])
+    with open(map_path, "wb") as f:
+        f.write(b"\x00" * total_chunks(session))
+    tmp_meta_path = meta_path + ".tmp"
+    with open(tmp_meta_path, "w") as f:
+        json.dump(session, f)
+    os.replace(tmp_meta_path, meta_path)
+
+
+def mark_chunk(upload_id: str, chunk_index: int):
+    _, map_path = session_paths(upload_id)
+    map_fd = os.open(map_path, os.O_WRONLY)
+    try:
+        os.pwrite(map_fd, b"\x01", chunk_index)
+    finally:
+        os.close(map_fd)
+
+
+async def limited_chunk_stream(request: Request, expected_length: int):
+    # Enforces the exact chunk length while the body streams into the backend; raising
+    # here aborts the part write before it is made durable or marked as received
+    received = 0
+    async for data in request.stream():
+        if not data:
+            continue
+        received += len(data)
+        if received > expected_length:
+            raise HTTPException(status_code=413, detail=f"Chunk exceeds expected length of {expected_length} bytes")
+        yield data
+    if received != expected_length:
+        raise HTTPException(status_code=400, detail=f"Incomplete chunk: received {received} of {expected_length} bytes")
+
+
+@router.post("/", status_code=201, response_model=UploadSessionStatus)
+async def create_upload_session(request: UploadSessionCreate, user: str = Depends(get_current_user)):
+    logger.debug("Upload session request: '%s' (%s bytes) -> '%s' (user: %s)", request.filename, request.size, request.dir or 'root', user)
+
+    filename = os.path.basename(request.filename or "")
+    if not filename:
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    if request.size < 0:
+        raise HTTPException(status_code=400, detail="Invalid size")
+    if MAX_UPLOAD_SIZE and request.size > MAX_UPLOAD_SIZE:
+        logger.warning("Upload session of '%s' rejected: %s bytes exceed the limit of %s", filename, request.size, MAX_UPLOAD_SIZE)
+        raise HTTPException(status_code=413, detail=f"File too large, at most {MAX_UPLOAD_SIZE} bytes are allowed")
+
+    chunk_size = request.chunk_size or DEFAULT_CHUNK_SIZE
+    if chunk_size <= 0 or chunk_size > MAX_CHUNK_SIZE:
+        raise HTTPException(status_code=400, detail=f"Chunk size must be between 1 and {MAX_CHUNK_SIZE} bytes")
+    # Every chunk but the last becomes a storage part, which has a backend-specific minimum
+    min_chunk_size = max(MIN_CHUNK_SIZE, storage.min_part_size)
+    if chunk_size < min_chunk_size and request.size > chunk_size:
+        raise HTTPException(status_code=400, detail=f"Chunk size must be at least {min_chunk_size} bytes")
+    max_chunks = min(MAX_CHUNKS, storage.max_parts) if storage.max_parts else MAX_CHUNKS
+    if -(-request.size // chunk_size) > max_chunks:
+        raise HTTPException(status_code=400, detail=f"Chunk size too small, at most {max_chunks} chunks are allowed")
+
+    # Validate the target up front so a session can never finalize outside DATA_DIR
+    target_key = safe_key(posixpath.join(request.dir or "", filename))
+
+    # The declared size counts against the quota up front, so a session cannot fill up
+    # the rest of it chunk by chunk
+    if quota_store is not None:
+        try:
+            await quota_store.check(user, request.size)
+        except QuotaExceeded as e:
+            logger.warning("Upload session of '%s' rejected for user %s: %s", filename, user, e)
+            raise HTTPException(status_code=413, detail=str(e))
+
+    await cleanup_expired_sessions()
+
+    upload_id = str(uuid.uuid4())
+    session = {
+        "upload_id": upload_id,
+        "user": user,
+        "filename": filename,
+        "dir": request.dir or "",
+        "size": request.size,
+        "chunk_size": chunk_size,
+        "created_at": time.time(),
+    }
+
+    try:
+        session["storage_token"] = await storage.create_multipart(target_key, request.size, chunk_size)
+        await storage.run(create_session_files, session)
+    except Exception as e:
+        if "storage_token" in session:
+            await storage.abort_multipart(session["storage_token"])
+        await storage.run(remove_session_files, upload_id)
+        logger.error("Error occurred while creating upload session: %s", e)
+        raise HTTPException(status_code=500, detail=f"Failed to create upload session: {str(e)}")
+
+    logger.info("Upload session created: %s for '%s' (%s bytes, chunk size %s)", upload_id, filename, request.size, chunk_size)
+    return await storage.run(session_status, session)
+
+
+@router.get("/{upload_id}", response_model=UploadSessionStatus)
+async def get_upload_session(upload_id: str, response: Response, user: str = Depends(get_current_user)):
+    session = await storage.run(load_session, upload_id, user)
+    status = await storage.run(session_status, session)
+    response.headers["Upload-Offset"] = str(status["offset"])
+    response.headers["Upload-Length"] = str(status["size"])
+    return status
+
+
+@router.put("/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request, offset: Optional[int] = None, user: str = Depends(get_current_user)):
+    if offset is None:
+        header_offset = request.headers.get("upload-offset")
+        if header_offset is None or not header_offset.isdigit():
+            raise HTTPException(status_code=400, detail="Missing chunk offset")
+        offset = int(header_offset)
+
+    session = await storage.run(load_session, upload_id, user)
+    chunk_size = session["chunk_size"]
+    size = session["size"]
+
+    if offset < 0 or offset % chunk_size != 0 or (offset >= size and size > 0):
+        raise HTTPException(status_code=400, detail=f"Offset must be a multiple of {chunk_size} within the file")
+    expected_length = min(chunk_size, size - offset)
+    chunk_index = offset // chunk_size
+    logger.debug("Chunk upload: session %s, chunk %s at offset %s (user: %s)", upload_id, chunk_index, offset, user)
+
+    # Digests sent with a chunk are checked against that chunk before it counts as received.
+    # Chunks may arrive in any order and at any worker, so the whole file is not hashed here.
+    try:
+        expected = expected_digests(request.headers)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    chunks = limited_chunk_stream(request, expected_length)
+    if expected:
+        chunks = digest_stream(chunks, Digester(expected), storage.executor, expected)
+
+    try:
+        await storage.write_part(session["storage_token"], offset, chunks, expected_length)
+    except DigestMismatch as e:
+        logger.warning("Chunk %s of session %s rejected: %s", chunk_index, upload_id, e)
+        raise HTTPException(status_code=400, detail=str(e))
+    except ClientDisconnect:
+        logger.warning("Client disconnected during chunk %s of session %s", chunk_index, upload_id)
+        raise HTTPException(status_code=400, detail="Client disconnected")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+
+    await storage.run(mark_chunk, upload_id, chunk_index)
+    # Only the committed offset, the full status is one GET away
+    committed = await storage.run(read_committed_offset, session)
+    logger.debug("Chunk %s stored for session %s, committed offset %s", chunk_index, upload_id, committed)
+    return Response(
+        content=json.dumps({"upload_id": upload_id, "chunk": chunk_index, "offset": committed}),
+        media_type="application/json",
+        headers={"Upload-Offset": str(committed)}
+    )
+
+
+@router.post("/{upload_id}/complete")
+async def complete_upload_session(upload_id: str, user: str = Depends(get_current_user)):
+    session = await storage.run(load_session, upload_id, user)
+    status = await storage.run(session_status, session)
+    if status["received_chunks"] != status["total_chunks"]:
+        logger.warning("Attempt to complete unfinished upload session: %s", upload_id)
+        raise HTTPException(
+            status_code=409,
+            detail=f"Upload incomplete: {status['received_chunks']} of {status['total_chunks']} chunks received"
+        )
+
+    target_key = safe_key(posixpath.join(session["dir"], session["filename"]))
+    if await storage.isdir(target_key):
+        raise HTTPException(status_code=409, detail="A directory exists at the target path")
+    try:
+        # Local backends rename the staging file into place, S3 completes the multipart upload
+        await storage.complete_multipart(session["storage_token"], target_key)
+        await storage.run(remove_session_files, upload_id)
+        invalidate_listing(target_key)
+        await update_index(target_key)
+        await record_usage(target_key, user, session["size"])
+    except IsADirectoryError:
+        raise HTTPException(status_code=409, detail="A directory exists at the target path")
+    except Exception as e:
+        logger.error("Error occurred while completing upload session: %s", e)
+        raise HTTPException(status_code=500, detail=f"Failed to complete upload: {str(e)}")
+
+    logger.info("Chunked upload complete: '%s' (%s bytes) -> '%s'", session['filename'], session['size'], session['dir'] or '/')
+    return {"msg": f"Uploaded {session['filename']} to {session['dir'] or '/'}", "size": session["size"]}
+
+
+@router.delete("/{upload_id}")
+async def abort_upload_session(upload_id: str, user: str = Depends(get_current_user)):
+    session = await storage.run(load_session, upload_id, user)
+    await discard_session(session)
+    logger.info("Upload session aborted: %s", upload_id)
+    return {"msg": f"Upload session '{upload_id}' aborted."}
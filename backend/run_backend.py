@@ -26,8 +26,8 @@ def parse_args():
         "--log-level",
         type=str,
         choices=["debug", "info", "warning", "error", "critical"],
-        default="info",
-        help="Set logging level (default: info)"
+        default=os.environ.get("LOG_LEVEL", "info").lower(),
+        help="Set logging level (default: $LOG_LEVEL or info)"
     )
 
     parser.add_argument(
@@ -36,6 +36,12 @@ def parse_args():
         help="Use detailed log format (including filename and line numbers)"
     )
 
+    parser.add_argument(
+        "--json-logs",
+        action="store_true",
+        help="Write logs as one JSON object per line"
+    )
+
     parser.add_argument(
         "--log-dir",
         type=str,
@@ -43,6 +49,35 @@ def parse_args():
         help="Directory to store log files (default: ./logs)"
     )
 
+    parser.add_argument(
+        "--host",
+        type=str,
+        default=os.environ.get("HOST", "0.0.0.0"),
+        help="Host to bind the services (default: $HOST or 0.0.0.0)"
+    )
+
+    parser.add_argument(
+        "--mode",
+        type=str,
+        choices=["dev", "prod"],
+        default=os.environ.get("RUN_MODE", "dev"),
+        help="dev: one auto-reloading process per service, prod: worker pool per service (default: $RUN_MODE or dev)"
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("WORKERS", os.cpu_count() or 1)),
+        help="Worker processes per service in prod mode (default: $WORKERS or CPU count)"
+    )
+
+    parser.add_argument(
+        "--graceful-timeout",
+        type=int,
+        default=int(os.environ.get("GRACEFUL_TIMEOUT", 30)),
+        help="Seconds services get to finish open requests on shutdown (default: $GRACEFUL_TIMEOUT or 30)"
+    )
+
     return parser.parse_args()
 
 
@@ -67,13 +102,21 @@ def run_service(service_type, args):
         sys.executable, "-m", module_path,
         "--log-level", args.log_level,
         "--log-file", f"{args.log_dir}/{service_type}.log",
+        "--host", args.host,
+        "--mode", args.mode,
+        "--workers", str(args.workers),
+        "--graceful-timeout", str(args.graceful_timeout),
     ]
 
     if args.detailed_logs:
         cmd.append("--detailed-logs")
+    if args.json_logs:
+        cmd.append("--json-logs")
 
     print(f"[+] Starting {service_type} service...")
     print(f"    Module path: {module_path}")
+    if args.mode == "prod":
+        print(f"    Mode: prod, {args.workers} workers")
 
     env = os.environ.copy()
 
@@ -93,55 +136,88 @@ def run_service(service_type, args):
     )
 
 
-def handle_signals(processes):
+# Restarts of a crashed service are spaced out exponentially up to this many seconds
+MAX_RESTART_DELAY = 30
+
+
+def handle_signals(shutdown):
+    # Only record the request here; the main loop forwards it to the services
     def signal_handler(sig, frame):
-        print("\n[!] Termination signal received. Shutting down services...")
-        for proc in processes:
-            if proc:
-                proc.terminate()
-        sys.exit(0)
+        if not shutdown:
+            print("\n[!] Termination signal received. Draining services...")
+        shutdown.append(sig)
 
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
 
+def stop_services(services, timeout):
+    # SIGTERM lets uvicorn stop accepting connections and finish open requests; only
+    # services still running after the timeout are killed
+    for proc in services.values():
+        if proc.poll() is None:
+            proc.send_signal(signal.SIGTERM)
+
+    deadline = time.monotonic() + timeout
+    for name, proc in services.items():
+        try:
+            proc.wait(timeout=max(0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            print(f"[!] {name} did not stop within {timeout}s, killing it.")
+            proc.kill()
+            proc.wait()
+
+
 def main():
     args = parse_args()
-    processes = []
+    services = {}
+    shutdown = []
 
     try:
         print(f"[*] Running from: {'backend directory' if is_in_backend_dir() else 'project root'}")
 
-        if args.service in ["data_source", "all"]:
-            data_source_proc = run_service("data_source", args)
-            processes.append(data_source_proc)
-
-        if args.service in ["data_sink", "all"]:
-            data_sink_proc = run_service("data_sink", args)
-            processes.append(data_sink_proc)
+        handle_signals(shutdown)
 
-        handle_signals(processes)
+        for service_type in ("data_source", "data_sink"):
+            if args.service in [service_type, "all"]:
+                services[service_type] = run_service(service_type, args)
 
-        print(f"[*] Services are running. (Log level: {args.log_level})")
+        print(f"[*] Services are running. (Mode: {args.mode}, Log level: {args.log_level})")
         print(f"[*] Log files location: {args.log_dir}")
         print("[*] Press Ctrl+C to terminate...")
 
-        while all(proc.poll() is None for proc in processes if proc):
+        restarts = {name: 0 for name in services}
+        restart_at = {}
+        while not shutdown:
             time.sleep(1)
-
-        for proc in processes:
-            if proc and proc.returncode:
-                print(f"[!] Process terminated with code {proc.returncode}.")
+            for name, proc in list(services.items()):
+                if proc.poll() is None:
+                    continue
+                if args.mode != "prod":
+                    print(f"[!] Process terminated with code {proc.returncode}.")
+                    shutdown.append(None)
+                    break
+
+                # uvicorn already restarts single workers; this covers its supervisor dying
+                now = time.monotonic()
+                if name not in restart_at:
+                    delay = min(MAX_RESTART_DELAY, 2 ** restarts[name])
+                    restart_at[name] = now + delay
+                    print(f"[!] {name} exited with code {proc.returncode}, restarting in {delay}s.")
+                elif now >= restart_at[name]:
+                    del restart_at[name]
+                    restarts[name] += 1
+                    services[name] = run_service(name, args)
+
+        stop_services(services, args.graceful_timeout + 5)
 
     except Exception as e:
         print(f"[!] Error occurred: {str(e)}")
-        for proc in processes:
-            if proc:
-                proc.terminate()
+        stop_services(services, args.graceful_timeout + 5)
         return 1
 
     return 0
 
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
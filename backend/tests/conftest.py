@@ -0,0 +1,77 @@
+# backend/tests/conftest.py
+#
+#   python -m pytest backend/tests
+#
+# Every store of the services (users, metadata index, digests, quotas, jobs, ...) lives
+# under ./data of the working directory, so the tests run from a fresh temporary
+# directory. This has to happen before any backend module is imported, since their
+# settings are read at import time.
+
+import os
+import sys
+import tempfile
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+backend_dir = os.path.dirname(current_dir)
+project_dir = os.path.dirname(backend_dir)
+if project_dir not in sys.path:
+    sys.path.insert(0, project_dir)
+
+os.chdir(tempfile.mkdtemp(prefix="backend-tests-"))
+os.environ.setdefault("LOG_LEVEL", "warning")
+# Limits are tested on their own middleware instances, not through the apps
+os.environ.setdefault("RATE_LIMIT_PER_SECOND", "0")
+os.environ.setdefault("MAX_CONCURRENT_TRANSFERS", "0")
+os.environ.setdefault("JOB_QUEUE_ENABLED", "0")
+
+import time
+
+import jwt
+import pytest
+
+from backend.common.auth_store import JWT_SECRET_KEY, JWT_ALGORITHM
+
+
+def make_token(sub: str = "alice", expires_in: float = 600, **claims) -> str:
+    # expires_in=None leaves out exp
+    if expires_in is not None:
+        claims["exp"] = int(time.time() + expires_in)
+    return jwt.encode({"sub": sub, **claims}, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
+
+
+@pytest.fixture
+def token_factory():
+    return make_token
+
+
+@pytest.fixture(scope="session")
+def source_client():
+    from fastapi.testclient import TestClient
+    from backend.data_source.main import create_app
+
+    with TestClient(create_app()) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+def sink_client():
+    from fastapi.testclient import TestClient
+    from backend.data_sink.main import create_app
+
+    with TestClient(create_app()) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+def user():
+    # An account in the user store, as get_current_user of the data source requires
+    from backend.common.auth_store import user_store
+
+    if "alice" not in user_store:
+        user_store.create_user("alice", "not-a-real-hash")
+    return "alice"
+
+
+@pytest.fixture
+def auth_headers(user):
+    return {"Authorization": f"Bearer {make_token(user)}"}
@@ -0,0 +1,89 @@
+# backend/tests/test_admission.py
+
+import asyncio
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+
+from backend.common.admission import AdmissionMiddleware, QuotaStore, RateLimiter, TransferLimiter
+from backend.common.auth_store import JWT_SECRET_KEY, JWT_ALGORITHM
+
+
+def test_token_without_exp_is_rejected_on_first_request(source_client, user, token_factory):
+    # The admission middleware decodes every bearer token before the endpoint runs; what
+    # it accepts must not end up in the cache get_current_user decides with
+    headers = {"Authorization": f"Bearer {token_factory(user, expires_in=None)}"}
+    assert source_client.get("/files/", headers=headers).status_code == 401
+    assert source_client.get("/files/", headers=headers).status_code == 401
+
+
+def test_token_with_exp_is_accepted(source_client, auth_headers):
+    assert source_client.get("/files/", headers=auth_headers).status_code == 200
+
+
+async def ok(request):
+    return PlainTextResponse("ok")
+
+
+@pytest.fixture
+def admission(tmp_path):
+    # The middleware around a bare app; limits are switched on per test
+    from fastapi.testclient import TestClient
+
+    app = Starlette(routes=[Route("/upload", ok, methods=["POST"]), Route("/download", ok)])
+    middleware = AdmissionMiddleware(app, JWT_SECRET_KEY, JWT_ALGORITHM,
+                                     transfers=[("GET", "/download"), ("POST", "/upload")],
+                                     uploads=[("POST", "/upload")])
+    middleware.rate_limiter = None
+    middleware.transfer_limiter = None
+    with TestClient(middleware) as client:
+        client.middleware = middleware
+        yield client
+
+
+def bearer(token_factory, sub):
+    return {"Authorization": f"Bearer {token_factory(sub)}"}
+
+
+def test_rate_limit_per_user(admission, token_factory):
+    admission.middleware.rate_limiter = RateLimiter(rate=0.01, burst=2)
+    alice, bob = bearer(token_factory, "alice"), bearer(token_factory, "bob")
+    assert admission.get("/download", headers=alice).status_code == 200
+    assert admission.get("/download", headers=alice).status_code == 200
+    response = admission.get("/download", headers=alice)
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 1
+    assert admission.get("/download", headers=bob).status_code == 200
+
+
+def test_rate_limit_without_valid_token_uses_client_address(admission, token_factory):
+    admission.middleware.rate_limiter = RateLimiter(rate=0.01, burst=1)
+    assert admission.get("/download", headers={"Authorization": "Bearer forged"}).status_code == 200
+    assert admission.get("/download").status_code == 429
+    assert admission.get("/download", headers=bearer(token_factory, "alice")).status_code == 200
+
+
+def test_concurrent_transfer_limit(admission, token_factory):
+    limiter = admission.middleware.transfer_limiter = TransferLimiter(limit=1)
+    alice = bearer(token_factory, "alice")
+    # A transfer of alice still in flight
+    assert limiter.acquire("alice")
+    assert admission.get("/download", headers=alice).status_code == 429
+    assert admission.get("/download", headers=bearer(token_factory, "bob")).status_code == 200
+    limiter.release("alice")
+    assert admission.get("/download", headers=alice).status_code == 200
+    assert limiter.active == {}
+
+
+def test_upload_beyond_quota_is_rejected_before_the_body(admission, token_factory, tmp_path):
+    quota_store = QuotaStore(path=str(tmp_path / "quotas.db"), quota=100)
+    asyncio.run(quota_store.record("stored.bin", "alice", 90))
+    admission.middleware.quota_store = quota_store
+    alice = bearer(token_factory, "alice")
+    response = admission.post("/upload", headers=alice, content=b"x" * 20)
+    assert response.status_code == 413
+    assert "quota" in response.json()["detail"]
+    assert admission.post("/upload", headers=alice, content=b"x" * 10).status_code == 200
+    assert admission.post("/upload", headers=bearer(token_factory, "bob"), content=b"x" * 20).status_code == 200
@@ -0,0 +1,43 @@
+# backend/tests/test_archive.py
+
+
+def upload(client, headers, directory, name, data):
+    response = client.post("/files/", headers=headers, data={"dir": directory}, files={"file": (name, data)})
+    assert response.status_code == 200
+
+
+def test_tar_etag_changes_with_same_size_rewrite(source_client, auth_headers):
+    upload(source_client, auth_headers, "archived", "a.txt", b"first version")
+    response = source_client.get("/files/archive?dir=archived", headers=auth_headers)
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert b"first version" in response.content
+
+    # Same size, rewritten within the same second
+    upload(source_client, auth_headers, "archived", "a.txt", b"other version")
+    response = source_client.get("/files/archive?dir=archived", headers=auth_headers)
+    assert response.headers["etag"] != etag
+    assert b"other version" in response.content
+
+    # A resume against the old ETag gets the whole new archive instead of mixed bytes
+    response = source_client.get("/files/archive?dir=archived",
+                                 headers={**auth_headers, "Range": "bytes=10-", "If-Range": etag})
+    assert response.status_code == 200
+
+
+def test_tar_conditional_and_range_requests(source_client, auth_headers):
+    upload(source_client, auth_headers, "ranged", "b.txt", b"x" * 5000)
+    full = source_client.get("/files/archive?dir=ranged", headers=auth_headers)
+    etag = full.headers["etag"]
+
+    response = source_client.get("/files/archive?dir=ranged", headers={**auth_headers, "If-None-Match": etag})
+    assert response.status_code == 304
+
+    response = source_client.get("/files/archive?dir=ranged",
+                                 headers={**auth_headers, "Range": "bytes=600-", "If-Range": etag})
+    assert response.status_code == 206
+    assert response.content == full.content[600:]
+
+    response = source_client.get("/files/archive?dir=ranged",
+                                 headers={**auth_headers, "Range": f"bytes={len(full.content)}-"})
+    assert response.status_code == 416
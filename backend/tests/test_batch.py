@@ -0,0 +1,125 @@
+# backend/tests/test_batch.py
+
+from backend.data_source import files
+
+
+def usage(client, headers):
+    response = client.get("/files/usage", headers=headers)
+    assert response.status_code == 200
+    return response.json()
+
+
+def indexed(client, headers, dir):
+    response = client.get(f"/files/search?dir={dir}&type=any", headers=headers)
+    assert response.status_code == 200
+    return [entry["path"] for entry in response.json()["entries"]]
+
+
+def stored_digests(dir):
+    rows = files.digest_store.connection().execute(
+        "SELECT key FROM digests WHERE key >= ? AND key < ? ORDER BY key", (dir + "/", dir + "/\U0010ffff"))
+    return [row[0] for row in rows]
+
+
+def batch_upload(client, headers, dir, names):
+    return client.post("/files/batch/upload", headers=headers, data={"dir": dir},
+                       files=[("files", (name, b"x" * (i + 1))) for i, name in enumerate(names)])
+
+
+def test_batch_upload_reports_every_item(source_client, auth_headers):
+    assert source_client.post("/files/mkdir", headers=auth_headers, json={"path": "batch-up/taken"}).status_code == 200
+    before = usage(source_client, auth_headers)
+
+    response = batch_upload(source_client, auth_headers, "batch-up",
+                            ["a.csv", "nested/b.csv", "../escape.csv", "taken", "/abs/../../x"])
+    assert response.status_code == 200
+    body = response.json()
+    assert [(result["path"], result["status"]) for result in body["results"]] == [
+        ("batch-up/a.csv", 200),
+        ("batch-up/nested/b.csv", 200),
+        ("../escape.csv", 400),
+        ("batch-up/taken", 409),
+        ("/abs/../../x", 400),
+    ]
+    assert (body["succeeded"], body["failed"]) == (2, 3)
+    assert body["results"][1]["size"] == 2
+    assert body["results"][0]["digests"]
+
+    # Only the stored files count against the user, get digests and reach the index
+    after = usage(source_client, auth_headers)
+    assert (after["bytes"] - before["bytes"], after["files"] - before["files"]) == (3, 2)
+    assert stored_digests("batch-up") == ["batch-up/a.csv", "batch-up/nested/b.csv"]
+    assert indexed(source_client, auth_headers, "batch-up") == [
+        "batch-up/a.csv", "batch-up/nested", "batch-up/nested/b.csv", "batch-up/taken"]
+
+    # Replacing a file credits the previous size instead of adding to it
+    batch_upload(source_client, auth_headers, "batch-up", ["dummy", "a.csv"])
+    replaced = usage(source_client, auth_headers)
+    assert (replaced["bytes"] - after["bytes"], replaced["files"] - after["files"]) == (1 + 2 - 1, 1)
+
+
+def test_batch_upload_rejects_the_whole_request(source_client, auth_headers):
+    assert batch_upload(source_client, auth_headers, ".internal", ["a.csv"]).status_code == 400
+    assert batch_upload(source_client, auth_headers, "../outside", ["a.csv"]).status_code == 400
+    response = source_client.post("/files/batch/upload", headers=auth_headers, data={"dir": "batch-none"})
+    assert response.status_code == 400
+
+
+def test_batch_delete_reports_every_item(source_client, auth_headers):
+    batch_upload(source_client, auth_headers, "batch-del", ["a.csv", "tree/b.csv", "tree/deep/c.csv"])
+    before = usage(source_client, auth_headers)
+
+    response = source_client.post("/files/batch/delete", headers=auth_headers, json={
+        "paths": ["batch-del/a.csv", "../etc/passwd", ".internal", ".internal/metadata.db", "batch-del/missing",
+                  "batch-del/tree"],
+    })
+    assert response.status_code == 200
+    body = response.json()
+    assert [(result["path"], result["status"]) for result in body["results"]] == [
+        ("batch-del/a.csv", 200),
+        ("../etc/passwd", 400),
+        (".internal", 400),
+        (".internal/metadata.db", 400),
+        ("batch-del/missing", 404),
+        ("batch-del/tree", 400),
+    ]
+    assert body["results"][0]["type"] == "file"
+    assert body["results"][-1]["error"] == "Directory is not empty"
+    assert (body["succeeded"], body["failed"]) == (1, 5)
+
+    after = usage(source_client, auth_headers)
+    assert (before["bytes"] - after["bytes"], before["files"] - after["files"]) == (1, 1)
+    assert stored_digests("batch-del") == ["batch-del/tree/b.csv", "batch-del/tree/deep/c.csv"]
+    assert indexed(source_client, auth_headers, "batch-del") == [
+        "batch-del/tree", "batch-del/tree/b.csv", "batch-del/tree/deep", "batch-del/tree/deep/c.csv"]
+
+    response = source_client.post("/files/batch/delete", headers=auth_headers,
+                                  json={"paths": ["batch-del/tree"], "recursive": True})
+    assert response.json()["results"] == [
+        {"path": "batch-del/tree", "status": 200, "type": "directory", "removed_files": 2}]
+    removed = usage(source_client, auth_headers)
+    assert (after["bytes"] - removed["bytes"], after["files"] - removed["files"]) == (2 + 3, 2)
+    assert stored_digests("batch-del") == []
+    assert indexed(source_client, auth_headers, "batch-del") == []
+
+
+def test_recursive_delete(source_client, auth_headers):
+    batch_upload(source_client, auth_headers, "rm-tree", ["one.csv", "sub/two.csv"])
+    before = usage(source_client, auth_headers)
+
+    response = source_client.delete("/files/?path=rm-tree", headers=auth_headers)
+    assert response.status_code == 400
+    assert indexed(source_client, auth_headers, "rm-tree") == ["rm-tree/one.csv", "rm-tree/sub", "rm-tree/sub/two.csv"]
+
+    response = source_client.delete("/files/?path=rm-tree&recursive=true", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()["removed_files"] == 2
+    after = usage(source_client, auth_headers)
+    assert (before["bytes"] - after["bytes"], before["files"] - after["files"]) == (1 + 2, 2)
+    assert stored_digests("rm-tree") == []
+    assert indexed(source_client, auth_headers, "rm-tree") == []
+    assert source_client.get("/files/?dir=rm-tree", headers=auth_headers).status_code == 404
+
+    assert source_client.delete("/files/?path=rm-tree&recursive=true", headers=auth_headers).status_code == 404
+    assert source_client.delete("/files/?path=.internal&recursive=true", headers=auth_headers).status_code == 400
+    assert source_client.delete("/files/?path=../data&recursive=true", headers=auth_headers).status_code == 400
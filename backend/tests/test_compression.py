@@ -0,0 +1,80 @@
+# backend/tests/test_compression.py
+
+import gzip
+import tracemalloc
+
+import pytest
+import zstandard
+
+from backend.common.compression import Decoder, DecodingError, DECODE_PIECE_SIZE
+
+
+def zstd_bomb(size: int) -> bytes:
+    # size bytes of zeros, compressed to a few KB
+    compressor = zstandard.ZstdCompressor().compressobj()
+    zeros = bytes(1024 * 1024)
+    return b"".join(compressor.compress(zeros) for _ in range(size // len(zeros))) + compressor.flush()
+
+
+def decode_all(decoder: Decoder, body: bytes, chunk_size: int = 65536):
+    pieces = []
+    for start in range(0, len(body), chunk_size):
+        pieces.append(decoder.decode(body[start:start + chunk_size]))
+        while decoder.has_pending():
+            pieces.append(decoder.decode(b""))
+    decoder.finish()
+    return pieces
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4096, 1024 * 1024])
+def test_zstd_frames_roundtrip(chunk_size):
+    data = bytes(range(256)) * 4000 + b"a" * 300000
+    compressor = zstandard.ZstdCompressor(write_checksum=True)
+    skippable = b"\x50\x2a\x4d\x18" + (5).to_bytes(4, "little") + b"skip!"
+    body = compressor.compress(data) + skippable + compressor.compress(b"second frame")
+    pieces = decode_all(Decoder("zstd"), body, chunk_size)
+    assert b"".join(pieces) == data + b"second frame"
+
+
+def test_gzip_members_roundtrip():
+    pieces = decode_all(Decoder("gzip"), gzip.compress(b"x" * 3000000) + gzip.compress(b"y"))
+    assert b"".join(pieces) == b"x" * 3000000 + b"y"
+    assert max(map(len, pieces)) <= DECODE_PIECE_SIZE
+
+
+def test_zstd_bomb_decodes_in_bounded_pieces():
+    body = zstd_bomb(256 * 1024 * 1024)
+    decoder = Decoder("zstd")
+    tracemalloc.start()
+    try:
+        total = len(decoder.decode(body))
+        while decoder.has_pending():
+            piece = decoder.decode(b"")
+            assert len(piece) <= DECODE_PIECE_SIZE
+            total += len(piece)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert total == 256 * 1024 * 1024
+    assert peak < 16 * 1024 * 1024
+
+
+def test_truncated_zstd_is_rejected():
+    body = zstandard.ZstdCompressor().compress(bytes(range(256)) * 100)
+    with pytest.raises(DecodingError):
+        decode_all(Decoder("zstd"), body[:-10])
+
+
+def test_zstd_bomb_is_refused_with_413(sink_client, auth_headers, monkeypatch):
+    from backend.data_sink import receive
+
+    monkeypatch.setattr(receive, "MAX_RECEIVE_SIZE", 4 * 1024 * 1024)
+    tracemalloc.start()
+    try:
+        response = sink_client.post("/receive-file", content=zstd_bomb(512 * 1024 * 1024), headers={
+            **auth_headers, "Content-Encoding": "zstd", "Content-Disposition": 'attachment; filename="bomb.bin"'})
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert response.status_code == 413
+    assert peak < 32 * 1024 * 1024
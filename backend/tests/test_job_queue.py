@@ -0,0 +1,78 @@
+# backend/tests/test_job_queue.py
+
+import asyncio
+import sqlite3
+
+from backend.common import job_queue as job_queue_module
+from backend.common.job_queue import JobQueue, PermanentJobError
+
+
+def run_next(queue: JobQueue):
+    async def run():
+        job_id, kind, payload, attempt, max_attempts, _ = await queue.executor.run(queue.claim, tuple(queue.handlers))
+        await queue.run_job(job_id, kind, payload, attempt, max_attempts)
+        return await queue.lookup(job_id)
+
+    return asyncio.run(run())
+
+
+def test_failed_lease_renewal_does_not_fail_a_running_job(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue_module, "JOB_LEASE_SECONDS", 0.15)
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    calls = []
+
+    async def handler(payload):
+        calls.append(payload)
+        await asyncio.sleep(0.3)
+        return {"ok": True}
+
+    def locked(job_id):
+        raise sqlite3.OperationalError("database is locked")
+
+    queue.register("slow", handler)
+    asyncio.run(queue.enqueue("slow", {"n": 1}))
+    monkeypatch.setattr(queue, "renew", locked)
+    job = run_next(queue)
+    assert job["status"] == "done"
+    assert job["result"] == {"ok": True}
+    assert calls == [{"n": 1}]
+
+
+def test_failures_are_retried_until_permanent(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+
+    async def handler(payload):
+        if payload["permanent"]:
+            raise PermanentJobError("bad input")
+        raise RuntimeError("try again")
+
+    queue.register("flaky", handler)
+    asyncio.run(queue.enqueue("flaky", {"permanent": False}))
+    job = run_next(queue)
+    assert (job["status"], job["attempts"]) == ("queued", 1)
+    assert "try again" in job["last_error"]
+
+    asyncio.run(queue.enqueue("flaky", {"permanent": True}))
+    # The retried job is not due yet, so the permanent one is claimed next
+    job = run_next(queue)
+    assert (job["status"], job["attempts"]) == ("failed", 1)
+
+
+def test_sink_registers_only_enabled_job_kinds(tmp_path, monkeypatch):
+    from backend.data_sink import jobs
+
+    monkeypatch.setattr(jobs, "columnar_store", None)
+    monkeypatch.setattr(jobs, "RECEIVE_WEBHOOK_URL", None)
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    jobs.register_handlers(queue)
+    assert queue.handlers == {}
+
+    async def start():
+        queue.start()
+        return list(queue.tasks)
+
+    assert asyncio.run(start()) == []
+
+    monkeypatch.setattr(jobs, "RECEIVE_WEBHOOK_URL", "http://127.0.0.1:9/hook")
+    jobs.register_handlers(queue)
+    assert list(queue.handlers) == ["notify"]
@@ -0,0 +1,152 @@
+# backend/tests/test_metadata_index.py
+
+import os
+import asyncio
+
+import pytest
+
+from backend.common.storage import LocalStorageBackend
+from backend.common.metadata_index import MetadataIndex
+
+# key: (size, mtime); sizes and mtimes repeat so the keyset has ties to break on the key
+FILES = {
+    "a.csv": (30, 1000),
+    "b.txt": (10, 3000),
+    "reports/2024-jan.csv": (50, 2000),
+    "reports/2024-feb.csv": (20, 3000),
+    "reports/2023-dec.csv": (40, 1000),
+    "reports/old/2024-x.csv": (20, 2000),
+    "received/in.csv": (5, 4000),
+    "received/batch/out.csv": (7, 4000),
+}
+INTERNAL = ".internal/secret"
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / "data"
+    for key, (size, mtime) in {**FILES, INTERNAL: (1, 1000)}.items():
+        path = root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x" * size)
+        os.utime(path, (mtime, mtime))
+    return root
+
+
+@pytest.fixture
+def index(tree, tmp_path):
+    index = MetadataIndex(str(tmp_path / "metadata.db"), excluded=[".internal"])
+    assert asyncio.run(index.reconcile(LocalStorageBackend(str(tree)), force=True))["files"] == len(FILES)
+    return index
+
+
+def paths(entries):
+    return [entry["path"] for entry in entries]
+
+
+def search_all(index, limit=2, **criteria):
+    # Follows the cursor page by page
+    found, cursor = [], None
+    while True:
+        entries, cursor = index.search(cursor=cursor, limit=limit, **criteria)
+        assert len(entries) <= limit
+        found += paths(entries)
+        if cursor is None:
+            return found
+
+
+@pytest.mark.parametrize("sort", ["path", "name", "size", "mtime"])
+@pytest.mark.parametrize("descending", [False, True])
+def test_search_cursor_pages_in_order(index, sort, descending):
+    def order(key):
+        size, mtime = FILES[key]
+        value = {"path": key, "name": os.path.basename(key), "size": size, "mtime": mtime}[sort]
+        return value, key
+
+    expected = sorted(FILES, key=order, reverse=descending)
+    assert search_all(index, sort=sort, descending=descending) == expected
+    # Pages of one match a single query of all
+    assert search_all(index, limit=len(FILES) + 1, sort=sort, descending=descending) == expected
+    assert search_all(index, limit=1, sort=sort, descending=descending) == expected
+
+
+def test_search_prefix(index):
+    assert search_all(index, prefix="reports/2024-") == ["reports/2024-feb.csv", "reports/2024-jan.csv"]
+    assert search_all(index, directory="reports", prefix="2024-") == ["reports/2024-feb.csv", "reports/2024-jan.csv"]
+    assert search_all(index, directory="reports") == [
+        "reports/2023-dec.csv", "reports/2024-feb.csv", "reports/2024-jan.csv", "reports/old/2024-x.csv"]
+    # Without recursion only the directory's own children, with the prefix on their name
+    assert search_all(index, directory="reports", recursive=False, entry_type="any") == [
+        "reports/2023-dec.csv", "reports/2024-feb.csv", "reports/2024-jan.csv", "reports/old"]
+    assert search_all(index, directory="reports", recursive=False, prefix="2024") == [
+        "reports/2024-feb.csv", "reports/2024-jan.csv"]
+    assert search_all(index, recursive=False, entry_type="dir") == ["received", "reports"]
+
+
+def test_search_glob(index):
+    # A pattern without "/" matches names anywhere below the directory
+    assert search_all(index, glob="2024-*.csv") == [
+        "reports/2024-feb.csv", "reports/2024-jan.csv", "reports/old/2024-x.csv"]
+    assert search_all(index, directory="received", glob="*.csv") == ["received/batch/out.csv", "received/in.csv"]
+    # One with "/" matches the whole path
+    assert search_all(index, glob="reports/old/*") == ["reports/old/2024-x.csv"]
+    assert search_all(index, glob="*/2024-*", sort="size") == [
+        "reports/2024-feb.csv", "reports/old/2024-x.csv", "reports/2024-jan.csv"]
+
+
+def test_root_key_keeps_keys_relative(tree, tmp_path, index):
+    received = MetadataIndex(str(tmp_path / "metadata.db"), root_key="received")
+    assert search_all(received) == ["batch/out.csv", "in.csv"]
+    assert search_all(received, sort="size", descending=True) == ["batch/out.csv", "in.csv"]
+    assert search_all(received, directory="batch", recursive=False) == ["batch/out.csv"]
+    assert search_all(received, glob="batch/*") == ["batch/out.csv"]
+    assert search_all(received, recursive=False, entry_type="dir") == ["batch"]
+    # Cursors carry storage keys and come back in the same form
+    entries, cursor = received.search(limit=1)
+    assert paths(entries) == ["batch/out.csv"]
+    assert cursor == (None, "batch/out.csv")
+    assert paths(received.search(cursor=cursor)[0]) == ["in.csv"]
+
+
+def test_reconcile_removes_unseen(tree, tmp_path, index):
+    storage = LocalStorageBackend(str(tree))
+    os.remove(tree / "reports" / "2024-jan.csv")
+    counts = asyncio.run(index.reconcile(storage, force=True))
+    assert counts["files"] == len(FILES) - 1
+    assert counts["removed"] == 1
+    assert "reports/2024-jan.csv" not in search_all(index)
+
+    # A tree reconciled under a root key only removes entries of that subtree
+    os.remove(tree / "a.csv")
+    os.remove(tree / "received" / "in.csv")
+    received = MetadataIndex(str(tmp_path / "metadata.db"), root_key="received")
+    counts = asyncio.run(received.reconcile(LocalStorageBackend(str(tree / "received")), force=True))
+    assert counts == {"directories": 1, "files": 1, "removed": 1, "seconds": counts["seconds"]}
+    assert search_all(received) == ["batch/out.csv"]
+    assert "a.csv" in search_all(index)
+
+    counts = asyncio.run(index.reconcile(storage, force=True))
+    assert counts["removed"] == 1
+    assert "a.csv" not in search_all(index)
+
+
+def test_reconcile_is_claimed_once_per_interval(tree, index):
+    storage = LocalStorageBackend(str(tree))
+    assert asyncio.run(index.reconcile(storage)) is None
+    assert asyncio.run(index.reconcile(storage, force=True)) is not None
+
+
+def test_refresh_and_apply_track_changes(tree, index):
+    storage = LocalStorageBackend(str(tree))
+    (tree / "reports" / "new").mkdir()
+    (tree / "reports" / "new" / "added.csv").write_bytes(b"12345")
+    asyncio.run(index.refresh(storage, "reports/new/added.csv", ".internal/other"))
+    entries, _ = index.search(directory="reports/new", entry_type="any")
+    assert [(entry["path"], entry["size"], entry["is_dir"]) for entry in entries] == [
+        ("reports/new/added.csv", 5, False)]
+    assert search_all(index, directory="reports", recursive=False, entry_type="dir") == ["reports/new", "reports/old"]
+
+    # Removing a directory removes everything below it
+    index.apply([("reports", None)])
+    assert search_all(index, prefix="reports", entry_type="any") == []
+    assert search_all(index, glob=".internal*", entry_type="any") == []
@@ -0,0 +1,47 @@
+# backend/tests/test_preview.py
+
+import pytest
+
+from backend.common.line_index import LineIndex
+
+LINES = 1000
+
+
+def upload(client, headers, name, data):
+    response = client.post("/files/", headers=headers, data={"dir": "preview"}, files={"file": (name, data)})
+    assert response.status_code == 200
+    return f"preview/{name}"
+
+
+@pytest.mark.parametrize("offset", [LINES - 5, LINES - 1, LINES, LINES + 10])
+def test_total_is_sent_once_a_window_reaches_the_end(source_client, auth_headers, offset):
+    data = b"".join(b"%d,value %d\n" % (i, i) for i in range(LINES))
+    path = upload(source_client, auth_headers, f"end-{offset}.csv", data)
+    response = source_client.get(f"/files/preview?path={path}&offset={offset}&limit=5", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.headers["x-total-records"] == str(LINES)
+    assert response.json() == [[str(i), f"value {i}"] for i in range(offset, min(offset + 5, LINES))]
+
+
+def test_total_is_not_guessed_before_the_end(source_client, auth_headers):
+    data = b"".join(b"%d\n" % i for i in range(LINES))
+    path = upload(source_client, auth_headers, "start.csv", data)
+    response = source_client.get(f"/files/preview?path={path}&offset=0&limit=5", headers=auth_headers)
+    assert "x-total-records" not in response.headers
+    assert response.json() == [[str(i)] for i in range(5)]
+
+
+@pytest.mark.parametrize("data", [b"a\nb\nc", b"a\nb\nc\n", b"\n\n", b"x" * 10])
+def test_window_total_matches_lines(tmp_path, data):
+    path = tmp_path / "file.txt"
+    path.write_bytes(data)
+    lines = data.split(b"\n")
+    expected_total = len(lines) - (1 if data.endswith(b"\n") else 0)
+    for first in range(expected_total + 3):
+        index = LineIndex(directory=str(tmp_path / "index"), stride=2)
+        start, end, total = index.find_window(str(path), "file.txt", first, 1)
+        assert data[start:end] == b"".join(line + b"\n" for line in lines[first:first + 1])[:end - start]
+        if first + 1 >= expected_total:
+            assert total == expected_total
+        # Saved with the index, so a fresh process knows it as well
+        assert LineIndex(directory=str(tmp_path / "index"), stride=2).find_window(str(path), "file.txt", 0, 1)[2] == total
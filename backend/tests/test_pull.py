@@ -0,0 +1,57 @@
+# backend/tests/test_pull.py
+
+import pytest
+
+DATA = b"".join(b"line %d\n" % i for i in range(100))
+
+
+@pytest.fixture
+def pulled(source_client, auth_headers):
+    response = source_client.post("/files/", headers=auth_headers, data={"dir": "pulled"},
+                                  files={"file": ("lines.csv", DATA)})
+    assert response.status_code == 200
+    return "/pull/pulled/lines.csv"
+
+
+@pytest.mark.parametrize("unit", ["lines", "bytes"])
+def test_slice_honours_if_none_match(source_client, auth_headers, pulled, unit):
+    url = f"{pulled}?unit={unit}&offset=3&limit=5"
+    response = source_client.get(url, headers=auth_headers)
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    response = source_client.get(url, headers={**auth_headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+    # Another slice of the same file is another representation
+    response = source_client.get(f"{pulled}?unit={unit}&offset=4&limit=5", headers={**auth_headers, "If-None-Match": etag})
+    assert response.status_code == 200
+
+
+def test_slice_content(source_client, auth_headers, pulled):
+    assert source_client.get(f"{pulled}?offset=2&limit=2", headers=auth_headers).content == b"line 2\nline 3\n"
+    assert source_client.get(f"{pulled}?unit=bytes&offset=5&limit=3", headers=auth_headers).content == DATA[5:8]
+
+
+def test_whole_file_ranges(source_client, auth_headers, pulled):
+    response = source_client.get(pulled, headers=auth_headers)
+    assert response.content == DATA
+    etag = response.headers["etag"]
+
+    response = source_client.get(pulled, headers={**auth_headers, "If-None-Match": etag})
+    assert response.status_code == 304
+
+    response = source_client.get(pulled, headers={**auth_headers, "Range": "bytes=10-19", "If-Range": etag})
+    assert response.status_code == 206
+    assert response.content == DATA[10:20]
+    assert response.headers["content-range"] == f"bytes 10-19/{len(DATA)}"
+
+    response = source_client.get(pulled, headers={**auth_headers, "Range": "bytes=10-19", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert response.content == DATA
+
+    response = source_client.get(pulled, headers={**auth_headers, "Range": f"bytes={len(DATA)}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(DATA)}"
@@ -0,0 +1,33 @@
+# backend/tests/test_receive.py
+
+import pytest
+
+
+def receive(client, headers, filename, data=b"payload"):
+    return client.post("/receive-file", content=data,
+                       headers={**headers, "Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@pytest.mark.parametrize("filename", ["sub/x.txt", "../x.txt", "a/../../x.txt"])
+def test_nested_names_are_rejected(sink_client, auth_headers, filename):
+    assert receive(sink_client, auth_headers, filename).status_code == 400
+
+
+def test_received_file_can_be_downloaded(sink_client, auth_headers):
+    assert receive(sink_client, auth_headers, "flat.txt", b"flat payload").status_code == 200
+    response = sink_client.get("/received/download?name=flat.txt", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.content == b"flat payload"
+    assert sink_client.get("/received/download?name=sub/flat.txt", headers=auth_headers).status_code == 400
+
+
+def test_payload_above_limit_is_rejected(sink_client, auth_headers, monkeypatch):
+    from backend.data_sink import receive as receive_module
+
+    monkeypatch.setattr(receive_module, "MAX_RECEIVE_SIZE", 1000)
+    # Declared too large up front, and cut off while streaming without a length
+    assert receive(sink_client, auth_headers, "big.bin", b"x" * 1001).status_code == 413
+    chunks = iter([b"x" * 600, b"x" * 600])
+    assert receive(sink_client, auth_headers, "big.bin", chunks).status_code == 413
+    assert sink_client.get("/received/download?name=big.bin", headers=auth_headers).status_code == 404
+    assert receive(sink_client, auth_headers, "big.bin", b"x" * 1000).status_code == 200
@@ -0,0 +1,146 @@
+# backend/tests/test_s3_storage.py
+#
+# Against moto's in-process S3, the same API a MinIO service answers
+
+import asyncio
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+from botocore.exceptions import ClientError
+
+from backend.common import s3_storage
+from backend.common.storage import PayloadTooLarge
+
+MiB = 1024 * 1024
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="data")
+        yield client
+
+
+def make_storage(client, **options):
+    return s3_storage.S3StorageBackend(client, "data", "root", part_size=5 * MiB, **options)
+
+
+async def generate(total: int, chunk_size: int = MiB, consumed: list = None):
+    # The request body; sleeps like a socket read would, so part uploads can finish meanwhile
+    sent = 0
+    while sent < total:
+        chunk = bytes([sent // chunk_size % 256]) * min(chunk_size, total - sent)
+        sent += len(chunk)
+        if consumed is not None:
+            consumed.append(len(chunk))
+        await asyncio.sleep(0.001)
+        yield chunk
+
+
+def expected_body(total: int, chunk_size: int = MiB) -> bytes:
+    return b"".join(bytes([i // chunk_size % 256]) * min(chunk_size, total - i) for i in range(0, total, chunk_size))
+
+
+def read_object(client, key):
+    return client.get_object(Bucket="data", Key=key)["Body"].read()
+
+
+def test_write_stream_multipart_and_single_put(client):
+    storage = make_storage(client, max_concurrency=2)
+    assert asyncio.run(storage.write_stream("big.bin", generate(12 * MiB + 5))) == 12 * MiB + 5
+    assert read_object(client, "root/big.bin") == expected_body(12 * MiB + 5)
+
+    assert asyncio.run(storage.write_stream("small.bin", generate(1000))) == 1000
+    assert read_object(client, "root/small.bin") == expected_body(1000)
+    assert client.list_multipart_uploads(Bucket="data").get("Uploads", []) == []
+
+
+def test_write_stream_over_limit_aborts_the_upload(client):
+    storage = make_storage(client)
+    with pytest.raises(PayloadTooLarge):
+        asyncio.run(storage.write_stream("big.bin", generate(12 * MiB), max_size=11 * MiB))
+    assert client.list_multipart_uploads(Bucket="data").get("Uploads", []) == []
+    assert "Contents" not in client.list_objects_v2(Bucket="data")
+
+
+def test_failed_part_stops_reading_the_body(client, monkeypatch):
+    def failing_upload_part(**kwargs):
+        raise ClientError({"Error": {"Code": "InternalError", "Message": "boom"}}, "UploadPart")
+
+    storage = make_storage(client, max_concurrency=1)
+    aborted = []
+    abort = client.abort_multipart_upload
+    monkeypatch.setattr(client, "upload_part", failing_upload_part)
+    monkeypatch.setattr(client, "abort_multipart_upload", lambda **kwargs: aborted.append(kwargs) or abort(**kwargs))
+    consumed = []
+    with pytest.raises(ClientError):
+        asyncio.run(storage.write_stream("big.bin", generate(200 * MiB, consumed=consumed)))
+    # The first part fails; the body is read at most until the next part is due
+    assert sum(consumed) <= 10 * MiB
+    assert len(aborted) == 1
+
+
+class SmallPages:
+    # Paginator with 2 keys per page unless the caller asks for a page size
+
+    def __init__(self, paginator):
+        self.paginator = paginator
+
+    def paginate(self, PaginationConfig=None, **kwargs):
+        return self.paginator.paginate(PaginationConfig=PaginationConfig or {"PageSize": 2}, **kwargs)
+
+
+def test_list_pages_and_delete_tree_batches(client, monkeypatch):
+    monkeypatch.setattr(s3_storage, "DELETE_BATCH_SIZE", 3)
+    storage = make_storage(client)
+    for i in range(7):
+        client.put_object(Bucket="data", Key=f"root/dir/file-{i}.txt", Body=b"x" * i)
+    client.put_object(Bucket="data", Key="root/dir/sub/nested.txt", Body=b"n")
+    client.put_object(Bucket="data", Key="root/dir/", Body=b"")
+
+    get_paginator = client.get_paginator
+    monkeypatch.setattr(client, "get_paginator", lambda name: SmallPages(get_paginator(name)))
+    directories, files = asyncio.run(storage.list("dir"))
+    assert directories == ["sub"]
+    assert [(f["name"], f["size"]) for f in files] == [(f"file-{i}.txt", i) for i in range(7)]
+    assert all(f["etag"] for f in files)
+
+    deletes = []
+    delete_objects = client.delete_objects
+    monkeypatch.setattr(client, "delete_objects",
+                        lambda **kwargs: deletes.append(len(kwargs["Delete"]["Objects"])) or delete_objects(**kwargs))
+    assert asyncio.run(storage.delete_tree("dir")) == 8
+    assert deletes == [3, 3, 3]
+    assert "Contents" not in client.list_objects_v2(Bucket="data")
+
+
+def test_resumable_multipart_complete_and_abort(client):
+    storage = make_storage(client)
+
+    async def upload(key, parts):
+        token = await storage.create_multipart(key, sum(map(len, parts)), 5 * MiB)
+        # Parts out of order, as chunks of a resumable upload may arrive
+        for number in reversed(range(len(parts))):
+            async def body(data=parts[number]):
+                yield data
+            await storage.write_part(token, number * 5 * MiB, body(), len(parts[number]))
+        return token
+
+    parts = [b"a" * 5 * MiB, b"b" * 5 * MiB, b"c" * 10]
+    token = asyncio.run(upload("resumed.bin", parts))
+    with pytest.raises(ValueError):
+        asyncio.run(storage.complete_multipart(token, "other.bin"))
+    asyncio.run(storage.complete_multipart(token, "resumed.bin"))
+    assert read_object(client, "root/resumed.bin") == b"".join(parts)
+
+    token = asyncio.run(upload("aborted.bin", parts))
+    asyncio.run(storage.abort_multipart(token))
+    asyncio.run(storage.abort_multipart(token))
+    assert client.list_multipart_uploads(Bucket="data").get("Uploads", []) == []
+    assert asyncio.run(storage.stat("aborted.bin")) is None
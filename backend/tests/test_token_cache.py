@@ -0,0 +1,70 @@
+# backend/tests/test_token_cache.py
+
+import time
+import asyncio
+
+import jwt
+import pytest
+from fastapi import HTTPException
+
+from backend.common.token_cache import TokenCache, decode_token
+from backend.common.auth_store import JWT_SECRET_KEY, JWT_ALGORITHM
+
+
+def test_cached_token_without_exp_still_fails_require_exp(token_factory):
+    cache = TokenCache()
+    token = token_factory(expires_in=None)
+    assert decode_token(token, JWT_SECRET_KEY, JWT_ALGORITHM, cache)["sub"] == "alice"
+    with pytest.raises(jwt.MissingRequiredClaimError):
+        decode_token(token, JWT_SECRET_KEY, JWT_ALGORITHM, cache, require_exp=True)
+
+
+def test_require_exp_on_cold_cache(token_factory):
+    with pytest.raises(jwt.MissingRequiredClaimError):
+        decode_token(token_factory(expires_in=None), JWT_SECRET_KEY, JWT_ALGORITHM, TokenCache(), require_exp=True)
+
+
+def test_cache_hit_returns_claims(token_factory):
+    cache = TokenCache()
+    token = token_factory()
+    first = decode_token(token, JWT_SECRET_KEY, JWT_ALGORITHM, cache, require_exp=True)
+    assert decode_token(token, JWT_SECRET_KEY, JWT_ALGORITHM, cache, require_exp=True) == first
+    assert cache.stats()["hits"] == 1
+
+
+def test_entry_dropped_at_exp(token_factory):
+    cache = TokenCache()
+    token = token_factory(expires_in=1)
+    decode_token(token, JWT_SECRET_KEY, JWT_ALGORITHM, cache)
+    time.sleep(1.1)
+    assert cache.get(token) is None
+    with pytest.raises(jwt.ExpiredSignatureError):
+        decode_token(token, JWT_SECRET_KEY, JWT_ALGORITHM, cache)
+
+
+def test_bad_signature_is_not_cached(token_factory):
+    cache = TokenCache()
+    token = jwt.encode({"sub": "alice", "exp": int(time.time()) + 600}, "other-key", algorithm=JWT_ALGORITHM)
+    with pytest.raises(jwt.InvalidSignatureError):
+        decode_token(token, JWT_SECRET_KEY, JWT_ALGORITHM, cache)
+    assert cache.stats()["size"] == 0
+
+
+def test_get_current_user_rejects_no_exp_token_seen_by_get_connector(token_factory):
+    # get_connector accepts tokens without exp and shares the service's cache
+    from backend.data_source import auth
+
+    token = token_factory(expires_in=None)
+    if "alice" not in auth.user_store:
+        auth.user_store.create_user("alice", "x")
+
+    class Client:
+        host = "127.0.0.1"
+
+    class FakeRequest:
+        client = Client()
+
+    assert asyncio.run(auth.get_connector(FakeRequest(), f"Bearer {token}")) == "alice"
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(auth.get_current_user(token))
+    assert raised.value.status_code == 401
@@ -0,0 +1,54 @@
+# backend/tests/test_uploads.py
+
+import os
+
+from backend.data_source import uploads
+
+
+def create_session(client, headers, size, chunk_size=None, filename="upload.bin"):
+    return client.post("/files/uploads/", headers=headers,
+                       json={"filename": filename, "size": size, "chunk_size": chunk_size})
+
+
+def test_size_above_limit_is_rejected(source_client, auth_headers):
+    response = create_session(source_client, auth_headers, uploads.MAX_UPLOAD_SIZE + 1)
+    assert response.status_code == 413
+
+
+def test_tiny_chunks_are_rejected(source_client, auth_headers):
+    assert create_session(source_client, auth_headers, 10 * 1024 * 1024, chunk_size=1).status_code == 400
+    assert create_session(source_client, auth_headers, 1024 * 1024, chunk_size=1024).status_code == 400
+
+
+def test_chunk_count_is_capped(source_client, auth_headers, monkeypatch):
+    monkeypatch.setattr(uploads, "MAX_CHUNKS", 4)
+    size = 5 * uploads.MIN_CHUNK_SIZE
+    assert create_session(source_client, auth_headers, size, chunk_size=uploads.MIN_CHUNK_SIZE).status_code == 400
+    assert create_session(source_client, auth_headers, size, chunk_size=2 * uploads.MIN_CHUNK_SIZE).status_code == 201
+
+
+def test_small_file_may_use_a_single_small_chunk(source_client, auth_headers):
+    session = create_session(source_client, auth_headers, 10, chunk_size=16).json()
+    assert session["total_chunks"] == 1
+    source_client.delete(f"/files/uploads/{session['upload_id']}", headers=auth_headers)
+
+
+def test_chunks_out_of_order_report_committed_offset(source_client, auth_headers):
+    chunk_size = uploads.MIN_CHUNK_SIZE
+    data = os.urandom(2 * chunk_size + 100)
+    session = create_session(source_client, auth_headers, len(data), chunk_size, "chunked.bin").json()
+    url = f"/files/uploads/{session['upload_id']}"
+
+    response = source_client.put(f"{url}?offset={chunk_size}", headers=auth_headers,
+                                 content=data[chunk_size:2 * chunk_size])
+    assert response.status_code == 200
+    assert response.headers["Upload-Offset"] == "0"
+    response = source_client.put(f"{url}?offset=0", headers=auth_headers, content=data[:chunk_size])
+    assert response.json() == {"upload_id": session["upload_id"], "chunk": 0, "offset": 2 * chunk_size}
+
+    assert source_client.post(f"{url}/complete", headers=auth_headers).status_code == 409
+    response = source_client.put(f"{url}?offset={2 * chunk_size}", headers=auth_headers, content=data[2 * chunk_size:])
+    assert response.headers["Upload-Offset"] == str(len(data))
+    status = source_client.get(url, headers=auth_headers).json()
+    assert (status["offset"], status["received_chunks"], status["total_chunks"]) == (len(data), 3, 3)
+    assert source_client.post(f"{url}/complete", headers=auth_headers).status_code == 200
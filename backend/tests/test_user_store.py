@@ -0,0 +1,60 @@
+# backend/tests/test_user_store.py
+
+import asyncio
+import sqlite3
+
+from backend.common.user_store import SQLiteUserStore
+
+
+def insert_behind_cache(path, username):
+    # A write by another process, which this store's cache does not hear about
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("INSERT INTO users VALUES (?, 'hash', 0, 0)", (username,))
+    conn.close()
+
+
+def test_unknown_user_is_cached_briefly(tmp_path, monkeypatch):
+    path = str(tmp_path / "users.db")
+    store = SQLiteUserStore(path, negative_cache_ttl=60)
+    assert store.get_password_hash("carol") is None
+    insert_behind_cache(path, "carol")
+    assert store.cached("carol") == (True, None)
+    assert store.get_password_hash("carol") is None
+
+    # Expired negative entries go back to the database
+    store = SQLiteUserStore(path, negative_cache_ttl=0)
+    assert store.get_password_hash("dave") is None
+    assert store.cached("dave") == (False, None)
+    insert_behind_cache(path, "dave")
+    assert store.get_password_hash("dave") == "hash"
+
+
+def test_created_user_replaces_negative_entry(tmp_path):
+    store = SQLiteUserStore(str(tmp_path / "users.db"), negative_cache_ttl=60)
+    assert "erin" not in store
+    store.create_user("erin", "hash")
+    assert "erin" in store
+    assert store.cached("erin") == (True, "hash")
+
+
+def test_auth_endpoints_query_the_store_off_the_event_loop(source_client, auth_headers, monkeypatch):
+    from backend.data_source.auth import user_store
+
+    on_loop = []
+    query = user_store.get_password_hash
+
+    def recording_query(username):
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(username)
+        except RuntimeError:
+            pass
+        return query(username)
+
+    monkeypatch.setattr(user_store, "get_password_hash", recording_query)
+    monkeypatch.setattr(user_store, "cache", type(user_store.cache)())
+    assert source_client.post("/auth/login", json={"username": "nobody", "password": "secret"}).status_code == 401
+    assert source_client.post("/auth/login", json={"username": "nobody", "password": "secret"}).status_code == 401
+    assert source_client.get("/files/", headers=auth_headers).status_code == 200
+    assert on_loop == []